@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import configparser
+import json
+import re
+from collections import Counter
+from sql_queries import (insert_table_queries, songplay_table_create, user_table_create, song_table_create,
+                         artist_table_create, time_table_create)
+
+
+# join steps that move rows between slices (ref:
+# https://docs.aws.amazon.com/redshift/latest/dg/c_data_redistribution.html)
+REDISTRIBUTION_STEPS = ("DS_BCAST_INNER", "DS_DIST_BOTH", "DS_DIST_ALL_INNER", "DS_DIST_INNER", "DS_DIST_OUTER")
+
+# tables with fewer rows are copied to every node (DISTSTYLE ALL) instead of distributed on a key
+ALL_MAX_ROWS = 1000000
+
+# star schema DDL the advisor proposes changes to
+TABLE_DDL = {
+    "songplays": songplay_table_create,
+    "users": user_table_create,
+    "songs": song_table_create,
+    "artists": artist_table_create,
+    "time": time_table_create,
+}
+
+
+def notebook_queries(path="analytics.ipynb"):
+    """
+    gets sql queries of the analytics notebook (%sql magics & query strings run with a cursor).
+    :param path: notebook file
+    :return: list of sql queries
+    """
+    with open(path) as notebook:
+        cells = json.load(notebook)["cells"]
+
+    queries = []
+    for cell in cells:
+        if cell["cell_type"] != "code":
+            continue
+        source = "".join(cell["source"])
+        if source.startswith("%sql ") and not source.startswith("%sql $"):
+            queries.append(source[len("%sql "):].replace("\\\n", "\n").strip())
+        queries.extend(query.replace("\\\n", "\n").strip()
+                       for query in re.findall(r'query = """(.*?)"""', source, re.S))
+
+    return queries
+
+
+def parse_plan(text):
+    """
+    parses EXPLAIN output into a tree of plan steps.
+    :param text: EXPLAIN output (one plan line per row)
+    :return: root step, dict with step, details, children & indent
+    """
+    root, stack = None, []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        indent = len(line) - len(line.lstrip())
+        content = line.strip()
+        if content.startswith("->") or root is None:
+            step = {"step": re.sub(r"^->\s*", "", content).split("  (")[0].strip(),
+                    "details": [], "children": [], "indent": indent}
+            while stack and stack[-1]["indent"] >= indent:
+                stack.pop()
+            if stack:
+                stack[-1]["children"].append(step)
+            else:
+                root = step
+            stack.append(step)
+        elif stack:
+            stack[-1]["details"].append(content)
+    return root
+
+
+def scanned_tables(step):
+    """
+    gets tables scanned under a plan step.
+    :param step: plan step (from parse_plan)
+    :return: list of (table, alias) tuples
+    """
+    match = re.search(r"Scan on (\w+)(?: (\w+))?", step["step"])
+    tables = [(match.group(1), match.group(2) or match.group(1))] if match else []
+    for child in step["children"]:
+        tables.extend(scanned_tables(child))
+    return tables
+
+
+def join_columns(step, outer_tables, inner_tables):
+    """
+    gets (table, column) of both sides of a join condition.
+    :param step: join plan step
+    :param outer_tables: (table, alias) scanned under the outer side
+    :param inner_tables: (table, alias) scanned under the inner side
+    :return: list of (table, column) tuples
+    """
+    columns = []
+    for detail in step["details"]:
+        if not re.match(r"(Hash|Merge|Join) Cond:", detail):
+            continue
+        for qualifier, column in re.findall(r'"?(\w+)"?\.(\w+)', detail):
+            if qualifier in ("outer", "inner"):
+                tables = outer_tables if qualifier == "outer" else inner_tables
+            else:
+                tables = [t for t in outer_tables + inner_tables if qualifier in t]
+            if tables:
+                columns.append((tables[0][0], column))
+    return columns
+
+
+def find_redistribution(root):
+    """
+    finds join steps that redistribute or broadcast rows.
+    :param root: plan root (from parse_plan)
+    :return: list of dicts with kind, join columns, outer & inner tables
+    """
+    findings = []
+
+    def visit(step):
+        kinds = [kind for kind in REDISTRIBUTION_STEPS if kind in step["step"]]
+        if kinds and len(step["children"]) == 2:
+            outer_tables = scanned_tables(step["children"][0])
+            inner_tables = scanned_tables(step["children"][1])
+            findings.append({
+                "kind": kinds[0],
+                "columns": join_columns(step, outer_tables, inner_tables),
+                "outer": [table for table, _ in outer_tables],
+                "inner": [table for table, _ in inner_tables],
+            })
+        for child in step["children"]:
+            visit(child)
+
+    if root:
+        visit(root)
+    return findings
+
+
+def propose(findings, table_rows=None):
+    """
+    proposes distribution & sort keys for the star schema tables, from the joins that move rows.
+    small tables broadcast to every slice become DISTSTYLE ALL; others are distributed (& sorted)
+    on the join column that causes most redistribution.
+    :param findings: list of findings (from find_redistribution)
+    :param table_rows: dict of table -> number of rows (svv_table_info), optional
+    :return: dict of table -> dict with diststyle, distkey, sortkey & reason
+    """
+    table_rows = table_rows or {}
+    votes = Counter()
+    for finding in findings:
+        for table, column in finding["columns"]:
+            if table in TABLE_DDL:
+                votes[(table, column)] += 1
+
+    proposals = {}
+    for (table, column), count in votes.most_common():
+        if table in proposals:
+            continue
+        if table_rows.get(table, ALL_MAX_ROWS + 1) <= ALL_MAX_ROWS:
+            proposals[table] = {"diststyle": "ALL", "distkey": None, "sortkey": column,
+                                "reason": "{} rows, joined on {} in {} redistributed steps".format(
+                                    table_rows[table], column, count)}
+        else:
+            proposals[table] = {"diststyle": "KEY", "distkey": column, "sortkey": column,
+                                "reason": "joined on {} in {} redistributed steps".format(column, count)}
+    return proposals
+
+
+def rewrite_ddl(create_sql, proposal):
+    """
+    rewrites CREATE TABLE statement with proposed distribution & sort keys.
+    :param create_sql: CREATE TABLE statement (sql_queries.py)
+    :param proposal: dict with diststyle, distkey & sortkey (from propose)
+    :return: CREATE TABLE statement
+    """
+    lines = []
+    for line in create_sql.strip().splitlines():
+        line = re.sub(r"\s+(SORTKEY|DISTKEY)\b", "", line)
+        words = line.split()
+        if words and words[0] in (proposal["distkey"], proposal["sortkey"]):
+            keys = [key for key, column in (("SORTKEY", proposal["sortkey"]), ("DISTKEY", proposal["distkey"]))
+                    if column == words[0]]
+            line = re.sub(r"(,?)$", " " + " ".join(keys) + r"\1", line, count=1)
+        lines.append(line)
+
+    ddl = "\n".join(lines)
+    if proposal["diststyle"] == "ALL":
+        ddl = re.sub(r"\)\s*;$", ")\nDISTSTYLE ALL;", ddl)
+    return ddl
+
+
+def advise(cur, queries):
+    """
+    runs EXPLAIN on each query & prints redistribution steps & proposed DDL.
+    :param cur: postgres cursor
+    :param queries: list of sql queries (SELECT/INSERT)
+    :return: dict of table -> proposal
+    """
+    findings = []
+    for query in queries:
+        for statement in [s.strip() for s in query.split(";") if s.strip()]:
+            if not statement.upper().startswith(("SELECT", "INSERT")):
+                continue
+            cur.execute("EXPLAIN " + statement)
+            plan_findings = find_redistribution(parse_plan("\n".join(row[0] for row in cur.fetchall())))
+            for finding in plan_findings:
+                print("\n{}: {} (outer: {}, inner: {})\n{}".format(
+                    finding["kind"], finding["columns"], finding["outer"], finding["inner"], statement))
+            findings.extend(plan_findings)
+
+    cur.execute('SELECT "table", tbl_rows FROM svv_table_info;')
+    proposals = propose(findings, dict(cur.fetchall()))
+    for table, proposal in proposals.items():
+        print("\n-- {}: {}\n{}".format(table, proposal["reason"], rewrite_ddl(TABLE_DDL[table], proposal)))
+
+    return proposals
+
+
+if __name__ == "__main__":
+    from db import connect
+
+    config = configparser.ConfigParser()
+    config.read_file(open("dwh.cfg"))
+
+    conn = connect(config)
+    advise(conn.cursor(), notebook_queries() + insert_table_queries)
+    conn.close()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import metrics
+from query_cache import bump_table_versions
+from sql_queries import aggregate_tables
+
+
+def merge_queries(aggregate):
+    """
+    builds statements adding the delta of an aggregate (new songplays only) to its summary table:
+    measures of existing keys are incremented, new keys are inserted.
+    :param aggregate: dict with name, keys, measures & delta (sql_queries.aggregate_tables)
+    :return: list of sql statements
+    """
+    name, keys, measures = aggregate["name"], aggregate["keys"], aggregate["measures"]
+    delta = "delta_{}".format(name)
+    on = " AND ".join("{0}.{1} = {2}.{1}".format(name, key, delta) for key in keys)
+
+    return [
+        "CREATE TEMP TABLE {} AS {};".format(delta, aggregate["delta"].strip()),
+        "UPDATE {} SET {} FROM {} WHERE {};".format(
+            name, ", ".join("{0} = {1}.{0} + {2}.{0}".format(measure, name, delta) for measure in measures),
+            delta, on),
+        "INSERT INTO {0} ({1}) SELECT {2} FROM {3} LEFT JOIN {0} ON {4} WHERE {0}.{5} IS NULL;".format(
+            name, ", ".join(keys + measures), ", ".join("{}.{}".format(delta, column) for column in keys + measures),
+            delta, on, keys[0]),
+        "DROP TABLE {};".format(delta),
+    ]
+
+
+def refresh_aggregates(cur, aggregates=aggregate_tables, bump_versions=True):
+    """
+    refreshes summary tables from the songplays of the run (committed by caller, with them).
+    :param cur: postgres cursor
+    :param aggregates: list of aggregates (sql_queries.aggregate_tables)
+    :param bump_versions: bumps load versions (false: shadow tables, bumped when swapped in)
+    :return: none
+    """
+    for aggregate in aggregates:
+        print("\nrefreshing {}...".format(aggregate["name"]))
+        for query in merge_queries(aggregate):
+            metrics.execute(cur, query)
+    if bump_versions:
+        bump_table_versions(cur, [aggregate["name"] for aggregate in aggregates])
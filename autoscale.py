@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import configparser
+import math
+from datetime import datetime
+from time import sleep, perf_counter
+from botocore.exceptions import ClientError
+import metrics
+from etl import etl
+from manifest import list_objects
+from setup_cluster import create_client, wait_for_cluster
+
+
+def source_bytes(config, s3):
+    """
+    estimates input volume: bytes of the objects under LOG_DATA & SONG_DATA prefixes.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :return: bytes
+    """
+    return sum(size for source in ("log_data", "song_data") for _, size in list_objects(s3, config.get("S3", source)))
+
+
+def nodes_for_load(n_bytes, gb_per_node, min_nodes, max_nodes):
+    """
+    gets number of nodes for a load of given size (one node per gb_per_node, within limits).
+    :param n_bytes: input bytes
+    :param gb_per_node: input gigabytes loaded per node
+    :param min_nodes: fewest nodes
+    :param max_nodes: most nodes
+    :return: number of nodes
+    """
+    return max(min_nodes, min(max_nodes, int(math.ceil(n_bytes / (gb_per_node * 1024.0 ** 3)))))
+
+
+def wait_for_resize(redshift, DWH_CLUSTER_IDENTIFIER, num_nodes, timeout=3600, delay=5, max_delay=60):
+    """
+    polls resize status with adaptive backoff until the resize to num_nodes is over
+    (the cluster stays available for a while after the request: its status alone is not enough).
+    :param redshift: redshift client
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :param num_nodes: target number of nodes
+    :param timeout: total seconds before giving up
+    :param delay: first delay between polls (seconds)
+    :param max_delay: longest delay between polls (seconds)
+    :return: resize status (SUCCEEDED, FAILED or not found / timeout)
+    """
+
+    deadline = perf_counter() + timeout
+    while True:
+        try:
+            response = redshift.describe_resize(ClusterIdentifier=DWH_CLUSTER_IDENTIFIER)
+        except ClientError as err:
+            if 'ResizeNotFound' not in str(err):
+                raise
+            status = 'not found'
+        else:
+            status = response['Status']
+            if response.get('TargetNumberOfNodes') == int(num_nodes) and status in ('SUCCEEDED', 'FAILED'):
+                return status
+
+        if perf_counter() + delay > deadline:
+            return 'timeout ({})'.format(status)
+
+        print("\nresize of {} is {}, wait {}s...".format(DWH_CLUSTER_IDENTIFIER, status, delay))
+        sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def resize_cluster(redshift, config, num_nodes):
+    """
+    elastic-resizes cluster, waits until the resize is over & the cluster available & updates
+    DWH_NUM_NODES in dwh.cfg (slice count used by the manifests).
+    :param redshift: redshift client
+    :param config: parsed dwh.cfg
+    :param num_nodes: target number of nodes
+    :return: true if resized
+    """
+    DWH_CLUSTER_IDENTIFIER = config.get("CLUSTER", "DWH_CLUSTER_IDENTIFIER")
+
+    print("\nresizing {} to {} nodes...".format(DWH_CLUSTER_IDENTIFIER, num_nodes))
+    try:
+        redshift.resize_cluster(
+            ClusterIdentifier=DWH_CLUSTER_IDENTIFIER,
+            NodeType=config.get("CLUSTER", "DWH_NODE_TYPE"),
+            NumberOfNodes=int(num_nodes),
+            Classic=False
+        )
+    except ClientError as err:
+        print("\nerror resizing cluster: {}".format(err))
+        return False
+
+    status = wait_for_resize(redshift, DWH_CLUSTER_IDENTIFIER, num_nodes)
+    wait_for_cluster(redshift, DWH_CLUSTER_IDENTIFIER)
+    if status != 'SUCCEEDED':
+        print("\ncluster not resized: {}".format(status))
+        return False
+
+    config.set("CLUSTER", "DWH_NUM_NODES", str(num_nodes))
+    with open("dwh.cfg", 'w') as configfile:
+        config.write(configfile)
+    print("\nvalue of DWH_NUM_NODES updated in configuration file.")
+    return True
+
+
+def autoscale_etl():
+    """
+    - Estimates input volume & sizes the cluster for the load.
+
+    - Elastic-resizes the cluster up (never down before the load) & runs the ETL.
+
+    - Shrinks the cluster back to the analytics size (also when the ETL fails).
+    """
+
+    config = configparser.ConfigParser()
+    config.read_file(open("dwh.cfg"))
+    # the etl records its statements under the same run id as the scaling decision
+    run_id = metrics.configure(config.get("ETL", "METRICS_FILE", fallback=None))
+
+    ec2, s3, iam, redshift = create_client(config.get("CLUSTER", "DWH_REGION"),
+                                           config.get("AWS", "AWS_KEY"),
+                                           config.get("AWS", "AWS_SECRET"))
+
+    current_nodes = config.getint("CLUSTER", "DWH_NUM_NODES")
+    analytics_nodes = config.getint("AUTOSCALE", "ANALYTICS_NODES", fallback=current_nodes)
+    n_bytes = source_bytes(config, s3)
+    load_nodes = nodes_for_load(n_bytes,
+                                config.getfloat("AUTOSCALE", "GB_PER_NODE", fallback=50),
+                                config.getint("AUTOSCALE", "MIN_NODES", fallback=2),
+                                config.getint("AUTOSCALE", "MAX_NODES", fallback=16))
+    load_nodes = max(load_nodes, current_nodes)
+
+    # COPY & insert throughput grows with the number of slices (same node type: with the nodes)
+    decision = {
+        "run_id": run_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "statement": "AUTOSCALE",
+        "input_gb": n_bytes / 1024.0 ** 3,
+        "current_nodes": current_nodes,
+        "load_nodes": load_nodes,
+        "analytics_nodes": analytics_nodes,
+        "estimated_speedup": load_nodes / float(current_nodes),
+    }
+    print("\n{:.2f} GB to load: {} -> {} nodes, estimated speedup {:.1f}x".format(
+        decision["input_gb"], current_nodes, load_nodes, decision["estimated_speedup"]))
+    metrics.record(decision)
+
+    if load_nodes != current_nodes:
+        resize_cluster(redshift, config, load_nodes)
+    try:
+        etl(run_id=run_id)
+    finally:
+        if analytics_nodes != config.getint("CLUSTER", "DWH_NUM_NODES"):
+            resize_cluster(redshift, config, analytics_nodes)
+
+
+if __name__ == '__main__':
+    autoscale_etl()
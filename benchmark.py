@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import configparser
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import tempfile
+from datetime import datetime
+from time import perf_counter
+import psycopg2
+import metrics
+from converter import iter_documents, convert_records, parse_jsonpaths, table_columns, write_csv
+from sql_queries import (create_table_queries, drop_table_queries, staging_insert_queries, insert_table_steps,
+                         staging_events_table_create, staging_songs_table_create)
+
+
+# ts of each extra copy of the log data is shifted by one week per copy
+SCALE_SHIFT_MS = 7 * 24 * 3600 * 1000
+
+
+def strip_redshift(sql):
+    """
+    removes redshift-only DDL from a statement so it runs on a local postgres.
+    :param sql: sql statement
+    :return: sql statement
+    """
+    sql = re.sub(r"\bINT IDENTITY\(\d+,\s*\d+\)", "SERIAL", sql)
+    sql = re.sub(r"\s+(DISTKEY|SORTKEY)\b(\s*\([^)]*\))?", "", sql)
+    sql = re.sub(r"\s+DISTSTYLE\s+\w+", "", sql)
+    sql = re.sub(r"\s+ENCODE\s+\w+", "", sql)
+    return sql
+
+
+def iter_local_documents(directory):
+    """
+    yields json documents of every .json file under a directory (file name order).
+    :param directory: local directory
+    :return: generator of dicts
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".json"):
+                with open(os.path.join(root, name), encoding="utf-8") as json_file:
+                    for document in iter_documents(json_file):
+                        yield document
+
+
+def directory_size(directory):
+    """
+    gets total size of .json files under a directory.
+    :param directory: local directory
+    :return: bytes
+    """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(directory) for name in files if name.endswith(".json"))
+
+
+def scaled_documents(directory, source, scale):
+    """
+    yields documents of a source scale times; each extra copy gets its own songs (suffixed song ids
+    & titles, matched by suffixed event songs) & later event timestamps, so every copy adds new rows.
+    :param directory: local source directory
+    :param source: log_data or song_data
+    :param scale: number of copies
+    :return: generator of dicts
+    """
+    for copy in range(scale):
+        for document in iter_local_documents(directory):
+            if copy:
+                document = dict(document)
+                if source == "log_data":
+                    document["ts"] = document["ts"] + copy * SCALE_SHIFT_MS if document.get("ts") else None
+                    document["song"] = "{} ({})".format(document["song"], copy) if document.get("song") else None
+                else:
+                    document["song_id"] = "{}_{}".format(document["song_id"], copy)
+                    document["title"] = "{} ({})".format(document["title"], copy)
+            yield document
+
+
+def local_rows(documents, fields, columns):
+    """
+    maps documents to staging rows cast to their column types, as converter.py does for csv/parquet
+    files; epoch milliseconds become timestamps (postgres COPY has no epochmillisecs).
+    :param documents: iterable of dicts
+    :param fields: field names in column order
+    :param columns: list of (column, type) tuples
+    :return: generator of tuples
+    """
+    timestamps = [i for i, (_, sql_type) in enumerate(columns) if sql_type == "TIMESTAMP"]
+    for row in convert_records(documents, fields, types=[sql_type for _, sql_type in columns[:len(fields)]]):
+        yield tuple(datetime.utcfromtimestamp(value / 1000.0) if i in timestamps and value is not None else value
+                    for i, value in enumerate(row))
+
+
+def copy_local(cur, table, rows):
+    """
+    loads rows into a raw staging table with COPY FROM STDIN (CSV spooled to a temporary file).
+    :param cur: postgres cursor
+    :param table: table name (staging_events_raw or staging_songs_raw)
+    :param rows: iterable of tuples (in table column order, join_key excluded)
+    :return: number of rows
+    """
+    columns = [name for name, _ in table_columns(
+        staging_events_table_create if table.startswith("staging_events") else staging_songs_table_create)
+        if name != "join_key"]
+    with tempfile.TemporaryFile() as spool:
+        n_rows = write_csv(rows, spool, compress=False)
+        spool.seek(0)
+        cur.copy_expert("COPY {} ({}) FROM STDIN WITH CSV".format(table, ", ".join(columns)), spool)
+    return n_rows
+
+
+def stage(results, name, run, n_bytes=0):
+    """
+    runs one stage & records its time, throughput & memory: ru_maxrss is the peak of the whole process
+    so far, so the stage's own footprint is how much it raised that peak (0: below an earlier stage's peak).
+    :param results: list the stage result is appended to
+    :param name: stage name
+    :param run: function returning number of rows processed
+    :param n_bytes: input bytes (for MB/s)
+    :return: none
+    """
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    rows = run()
+    elapsed = perf_counter() - start
+    peak_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.append({
+        "stage": name,
+        "elapsed": elapsed,
+        "rows": rows,
+        "rows_per_s": rows / elapsed if elapsed else None,
+        "mb_per_s": n_bytes / 1024.0 / 1024.0 / elapsed if n_bytes and elapsed else None,
+        "peak_rss_mb": peak_after / 1024.0,
+        "peak_rss_increase_mb": (peak_after - peak_before) / 1024.0,
+    })
+    print("\n{:<20}{:>10.2f}s{:>12} rows{:>10.1f} MB peak increase".format(
+        name, elapsed, rows, (peak_after - peak_before) / 1024.0))
+
+
+def run_benchmark(conn, data_dir, scale):
+    """
+    runs create_tables -> staging load -> inserts on a local database at a scale factor.
+    :param conn: postgres connection (local stand-in)
+    :param data_dir: local directory with log_data, song_data & log_json_path.json
+    :param scale: scale factor (copies of the input data)
+    :return: list of stage results
+    """
+    cur = conn.cursor()
+    results = []
+
+    def run_queries(queries):
+        rows = 0
+        for query in queries:
+            rows += max(metrics.execute(cur, strip_redshift(query))["rows"], 0)
+        conn.commit()
+        return rows
+
+    stage(results, "create_tables", lambda: run_queries(drop_table_queries + create_table_queries))
+
+    with open(os.path.join(data_dir, "log_json_path.json")) as jsonpath_file:
+        log_fields = parse_jsonpaths(jsonpath_file.read())
+    song_columns = table_columns(staging_songs_table_create)
+    sources = [
+        ("staging_events", "log_data", log_fields, table_columns(staging_events_table_create)),
+        ("staging_songs", "song_data", [name for name, _ in song_columns if name != "join_key"], song_columns),
+    ]
+    for table, source, fields, columns in sources:
+        directory = os.path.join(data_dir, source)
+
+        def load(table=table, source=source, fields=fields, columns=columns, directory=directory):
+            rows = copy_local(cur, table + "_raw", local_rows(scaled_documents(directory, source, scale), fields, columns))
+            conn.commit()
+            return rows
+
+        stage(results, table, load, directory_size(directory) * scale)
+
+    stage(results, "join_keys", lambda: run_queries(staging_insert_queries))
+    for step in insert_table_steps:
+        stage(results, step["name"], lambda step=step: run_queries([step["query"]]))
+
+    return results
+
+
+def git_commit():
+    """
+    gets commit the benchmark runs on (results are compared between commits).
+    :return: commit hash or none
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"]).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(config, scales=(1, 10, 100)):
+    """
+    runs the benchmark at each scale factor & appends results (json lines) to the results file.
+    :param config: parsed dwh.cfg
+    :param scales: scale factors
+    :return: list of results
+    """
+    conn = psycopg2.connect(config.get("BENCHMARK", "DSN"))
+    runs = []
+    for scale in scales:
+        print("\nscale {}x...".format(scale))
+        run = {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "scale": scale,
+            "python": platform.python_version(),
+            "server_version": conn.server_version,
+            "stages": run_benchmark(conn, config.get("BENCHMARK", "DATA_DIR"), scale),
+        }
+        with open(config.get("BENCHMARK", "RESULTS_FILE"), "a") as results_file:
+            results_file.write(json.dumps(run) + "\n")
+        runs.append(run)
+    conn.close()
+    return runs
+
+
+def compare_commits(results_file, base, head):
+    """
+    prints time of each stage at each scale for two commits (latest run of each), e.g. before & after a
+    change to the insert statements.
+    :param results_file: json lines written by benchmark
+    :param base: commit (or its prefix) before the change
+    :param head: commit (or its prefix) after the change
+    :return: list of (scale, stage, base seconds, head seconds) tuples (none: stage not run by that commit)
+    """
+    latest = {}
+    with open(results_file) as results:
+        for line in results:
+            run = json.loads(line)
+            for name, commit in (("base", base), ("head", head)):
+                if (run.get("commit") or "").startswith(commit):
+                    latest[(name, run["scale"])] = {stage["stage"]: stage["elapsed"] for stage in run["stages"]}
+
+    rows = []
+    print("\n{:<8}{:<28}{:>12}{:>12}{:>10}".format("scale", "stage", base[:10], head[:10], "change"))
+    for scale in sorted({scale for _, scale in latest}):
+        base_stages, head_stages = latest.get(("base", scale), {}), latest.get(("head", scale), {})
+        for stage_name in list(base_stages) + [name for name in head_stages if name not in base_stages]:
+            before, after = base_stages.get(stage_name), head_stages.get(stage_name)
+            rows.append((scale, stage_name, before, after))
+            change = "{:+.0%}".format(after / before - 1) if before and after is not None else ""
+            print("{:<8}{:<28}{:>12}{:>12}{:>10}".format(
+                "{}x".format(scale), stage_name, "" if before is None else "{:.2f}s".format(before),
+                "" if after is None else "{:.2f}s".format(after), change))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmarks the etl pipeline on a local postgres")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="scale factors")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                        help="prints stage times of two benchmarked commits instead of running the benchmark")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read_file(open("dwh.cfg"))
+
+    if args.compare:
+        compare_commits(config.get("BENCHMARK", "RESULTS_FILE"), *args.compare)
+    else:
+        benchmark(config, args.scales)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import uuid
+from datetime import datetime
+from manifest import list_objects
+from sql_queries import run_step_insert, run_steps_select, unfinished_run_select, insert_table_steps
+
+
+# step recorded when a run starts (so a run stopped before its first step can be resumed too)
+START_STEP = "start"
+
+# step recorded once a run is complete (runs without it can be resumed)
+FINAL_STEP = "done"
+
+# ETL options that change how fast a run is, not what it loads
+TUNING_OPTIONS = {"copy_workers", "insert_workers", "metrics_file"}
+
+# run being checkpointed, set by start_run()
+RUN_ID = None
+FINGERPRINT = None
+COMPLETED = set()
+
+
+def input_signature(config, s3):
+    """
+    hashes the objects under the s3 sources (keys & sizes), so files added, removed or rewritten since
+    a run started make it a different run.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :return: md5 hex digest
+    """
+    listing = hashlib.md5()
+    for source in ("log_data", "song_data"):
+        for key, size in list_objects(s3, config.get("S3", source)):
+            listing.update("{}:{}\n".format(key, size).encode("utf-8"))
+    return listing.hexdigest()
+
+
+def run_fingerprint(config, mode="full", s3=None):
+    """
+    hashes the inputs of a run: cluster, s3 sources (& the objects under them) & ETL options
+    (except tuning ones) & insert statements.
+    :param config: parsed dwh.cfg
+    :param mode: load mode (full or shadow)
+    :param s3: s3 resource to sign the source objects with (none: only their prefixes)
+    :return: md5 hex digest
+    """
+    inputs = [mode, config.get("CLUSTER", "DWH_HOST")]
+    inputs += ["{}={}".format(key, value) for key, value in sorted(config.items("S3"))]
+    inputs += ["{}={}".format(key, value) for key, value in sorted(config.items("ETL")) if key not in TUNING_OPTIONS]
+    inputs += [step["query"] for step in insert_table_steps]
+    if s3 is not None:
+        inputs.append(input_signature(config, s3))
+    return hashlib.md5("\n".join(inputs).encode("utf-8")).hexdigest()
+
+
+def start_run(cur, config, resume=False, mode="full", s3=None, run_id=None):
+    """
+    starts checkpointing a run: a new one (its start recorded, committed by caller), or (resume) the
+    latest started unfinished run with the same inputs, whose completed steps are then skipped.
+    :param cur: postgres cursor
+    :param config: parsed dwh.cfg
+    :param resume: resumes the latest unfinished run
+    :param mode: load mode (full or shadow); only runs of the same mode are resumed
+    :param s3: s3 resource; only runs over the same source objects are resumed (see run_fingerprint)
+    :param run_id: id of a new run (default: new uuid)
+    :return: run id (none: resume asked but no unfinished run)
+    """
+    global RUN_ID, FINGERPRINT, COMPLETED
+    FINGERPRINT = run_fingerprint(config, mode, s3)
+    RUN_ID, COMPLETED = run_id or uuid.uuid4().hex, set()
+
+    if not resume:
+        mark_completed(cur, START_STEP)
+    else:
+        cur.execute(unfinished_run_select, {"fingerprint": FINGERPRINT, "final_step": FINAL_STEP})
+        row = cur.fetchone()
+        if row is None:
+            RUN_ID = None
+            return None
+        RUN_ID = row[0]
+        cur.execute(run_steps_select, (RUN_ID,))
+        COMPLETED = {step for step, in cur.fetchall()}
+        print("\nresuming run {}, completed steps: {}".format(RUN_ID, sorted(COMPLETED)))
+
+    return RUN_ID
+
+
+def is_completed(step):
+    """
+    checks if a step was completed by the run (resumed runs only).
+    :param step: step name
+    :return: bool
+    """
+    return step in COMPLETED
+
+
+def mark_completed(cur, step):
+    """
+    records that a step is completed (committed by caller, with the step itself).
+    :param cur: postgres cursor
+    :param step: step name
+    :return: none
+    """
+    if RUN_ID is None:
+        return
+    cur.execute(run_step_insert, {"run_id": RUN_ID, "fingerprint": FINGERPRINT, "step": step,
+                                  "completed_at": datetime.utcnow()})
+    COMPLETED.add(step)
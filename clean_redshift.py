@@ -7,19 +7,25 @@ from time import sleep
 from setup_cluster import create_client
 
 
-def delete_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER):
+def delete_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER, DWH_SNAPSHOT_IDENTIFIER=None):
     """
     deletes running redshift cluster.
     :param redshift: redshift client
     :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :param DWH_SNAPSHOT_IDENTIFIER: final snapshot taken before deletion (none: no snapshot)
     :return: none or cluster info/section
     """
 
     print("\ndeleting cluster {}...".format(DWH_CLUSTER_IDENTIFIER))
+    if DWH_SNAPSHOT_IDENTIFIER:
+        snapshot = {'FinalClusterSnapshotIdentifier': DWH_SNAPSHOT_IDENTIFIER}
+    else:
+        snapshot = {'SkipFinalClusterSnapshot': True}
+
     try:
         response = redshift.delete_cluster(
             ClusterIdentifier=DWH_CLUSTER_IDENTIFIER,
-            SkipFinalClusterSnapshot=True
+            **snapshot
         )
     except ClientError as err:
         if 'ClusterNotFound' in str(err):
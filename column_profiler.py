@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import configparser
+import re
+from converter import table_columns
+from sql_queries import (staging_events_table_create, staging_songs_table_create, songplay_table_create,
+                         user_table_create, song_table_create, artist_table_create, time_table_create)
+
+
+# tables profiled & the DDL tightened for each one
+TABLE_DDL = {
+    "staging_events": staging_events_table_create,
+    "staging_songs": staging_songs_table_create,
+    "songplays": songplay_table_create,
+    "users": user_table_create,
+    "songs": song_table_create,
+    "artists": artist_table_create,
+    "time": time_table_create,
+}
+
+# room left over the longest value seen (new data can be longer)
+LENGTH_HEADROOM = 1.25
+
+MAX_VARCHAR = 65535
+
+
+def varchar_size(max_length):
+    """
+    sizes VARCHAR from the longest value seen: headroom added, rounded up to a power of two.
+    :param max_length: longest value (bytes)
+    :return: VARCHAR size
+    """
+    size = 16
+    while size < (max_length or 0) * LENGTH_HEADROOM:
+        size *= 2
+    return min(size, MAX_VARCHAR)
+
+
+def profile_table(cur, table, sample=0.1, comprows=100000):
+    """
+    samples a table: longest value of each string column, & ANALYZE COMPRESSION encodings.
+    (ANALYZE COMPRESSION does not run in a transaction block: connection should be in autocommit)
+    :param cur: postgres cursor
+    :param table: table name
+    :param sample: fraction of rows sampled for lengths
+    :param comprows: rows analyzed for compression
+    :return: dict of column -> dict with max_length (none: not a string) & encoding
+    """
+    columns = table_columns(TABLE_DDL[table])
+    profile = {name: {"max_length": None, "encoding": None} for name, _ in columns}
+
+    strings = [name for name, sql_type in columns if sql_type in ("VARCHAR", "CHAR")]
+    if strings:
+        cur.execute("SELECT {} FROM {} WHERE RANDOM() < %s;".format(
+            ", ".join("MAX(OCTET_LENGTH({}))".format(name) for name in strings), table), (sample,))
+        for name, max_length in zip(strings, cur.fetchone()):
+            profile[name]["max_length"] = max_length
+
+    cur.execute("ANALYZE COMPRESSION {} COMPROWS {};".format(table, comprows))
+    for _, column, encoding, _ in cur.fetchall():
+        if column in profile:
+            profile[column]["encoding"] = encoding
+
+    return profile
+
+
+def tighten_ddl(create_sql, profile):
+    """
+    rewrites CREATE TABLE statement with right-sized VARCHARs & per-column encodings.
+    sort key columns stay RAW (compressing them makes range-restricted scans read more blocks).
+    :param create_sql: CREATE TABLE statement (sql_queries.py)
+    :param profile: dict of column -> dict with max_length & encoding (from profile_table)
+    :return: CREATE TABLE statement
+    """
+    lines = []
+    for line in create_sql.strip().splitlines():
+        words = line.split()
+        column = profile.get(words[0]) if words else None
+        if column is not None:
+            match = re.match(r"(\s*\w+\s+)(VARCHAR(?:\(\d+\))?|\w+(?:\(\d+(?:,\s*\d+)?\))?)(\s+IDENTITY\(\d+,\s*\d+\))?",
+                             line)
+            sql_type = match.group(2)
+            if sql_type.upper().startswith("VARCHAR") and column["max_length"] is not None:
+                sql_type = "VARCHAR({})".format(varchar_size(column["max_length"]))
+            encoding = "RAW" if "SORTKEY" in line.upper() else column["encoding"]
+            line = "{}{}{}{}{}".format(match.group(1), sql_type, match.group(3) or "",
+                                       " ENCODE {}".format(encoding) if encoding else "", line[match.end():])
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def tighten_all(cur, tables=TABLE_DDL):
+    """
+    profiles each table & prints its tightened DDL.
+    :param cur: postgres cursor (autocommit connection)
+    :param tables: table names
+    :return: dict of table -> tightened CREATE TABLE statement
+    """
+    ddl = {}
+    for table in tables:
+        print("\nprofiling {}...".format(table))
+        ddl[table] = tighten_ddl(TABLE_DDL[table], profile_table(cur, table))
+        print(ddl[table])
+    return ddl
+
+
+if __name__ == "__main__":
+    from db import connect
+
+    config = configparser.ConfigParser()
+    config.read_file(open("dwh.cfg"))
+
+    conn = connect(config)
+    conn.autocommit = True
+    tighten_all(conn.cursor())
+    conn.close()
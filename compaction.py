@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import math
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from manifest import parse_s3_url, list_objects, balance_keys, get_slice_count, manifest_copy_queries
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for CODEC = zstd
+    zstandard = None
+
+
+# COPY option matching each codec
+CODEC_OPTIONS = {"gzip": "\nGZIP", "zstd": "\nZSTD"}
+
+# bytes read from s3 at a time (memory used per worker)
+READ_SIZE = 1024 * 1024
+
+
+def chunk_size(chunk):
+    """
+    gets total size of a chunk.
+    :param chunk: list of (key, size) tuples
+    :return: bytes
+    """
+    return sum(size for _, size in chunk)
+
+
+def plan_chunks(keys, num_slices, max_chunk_size, min_chunk_size=0):
+    """
+    groups small objects into chunks within a size range: as many chunks as needed to stay under
+    max_chunk_size, rounded up to a multiple of the slice count, with about the same size each.
+    with too little data for that many chunks of min_chunk_size, fewer chunks are made (a multiple of
+    the slice count while there is enough for one per slice); a chunk still under min_chunk_size (left
+    by a few large objects) is merged into the next smallest one, unless that goes over max_chunk_size.
+    :param keys: list of (key, size) tuples
+    :param num_slices: number of slices of the cluster
+    :param max_chunk_size: max (uncompressed) bytes per chunk
+    :param min_chunk_size: min (uncompressed) bytes per chunk (0: no minimum)
+    :return: list of chunks, each one a list of (key, size) tuples, largest first
+    """
+    total = sum(size for _, size in keys)
+    n_chunks = num_slices * max(1, math.ceil(total / float(num_slices * max_chunk_size)))
+    if min_chunk_size and total < n_chunks * min_chunk_size:
+        n_chunks = total // min_chunk_size
+        if n_chunks >= num_slices:
+            n_chunks -= n_chunks % num_slices
+    chunks = sorted((chunk for chunk in balance_keys(keys, max(1, n_chunks)) if chunk), key=chunk_size)
+
+    while len(chunks) > 1 and chunk_size(chunks[0]) < min_chunk_size and \
+            chunk_size(chunks[0]) + chunk_size(chunks[1]) <= max_chunk_size:
+        chunks = sorted([chunks[0] + chunks[1]] + chunks[2:], key=chunk_size)
+    return chunks[::-1]
+
+
+def open_compressed(fileobj, codec):
+    """
+    wraps file object in a compressing writer.
+    :param fileobj: binary file object (compressed output)
+    :param codec: gzip or zstd
+    :return: writable file object
+    """
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="wb")
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("codec zstd needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False)
+    raise ValueError("unknown codec: {}".format(codec))
+
+
+def compact_chunk(s3, bucket, keys, out_url, codec="gzip"):
+    """
+    streams objects one block at a time into one compressed file & uploads it.
+    json documents are separated by a new line; memory stays at one block whatever the input size
+    (compressed output is spooled to a temporary file).
+    :param s3: s3 resource
+    :param bucket: bucket of the source objects
+    :param keys: list of (key, size) tuples
+    :param out_url: s3 url of the compacted file
+    :param codec: gzip or zstd
+    :return: (key, size) of the compacted file
+    """
+    out_bucket, out_key = parse_s3_url(out_url)
+    with tempfile.TemporaryFile() as spool:
+        writer = open_compressed(spool, codec)
+        for key, _ in keys:
+            body = s3.Object(bucket, key).get()["Body"]
+            last = b"\n"
+            for block in iter(lambda: body.read(READ_SIZE), b""):
+                writer.write(block)
+                last = block[-1:]
+            if last != b"\n":
+                writer.write(b"\n")
+        writer.close()
+
+        size = spool.tell()
+        spool.seek(0)
+        s3.Bucket(out_bucket).upload_fileobj(spool, out_key)
+
+    return out_key, size
+
+
+def compact_source(config, s3, source, codec="gzip", max_workers=4):
+    """
+    compacts every object of a source into compressed chunks under STAGING_PREFIX.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param source: log_data or song_data
+    :param codec: gzip or zstd
+    :param max_workers: chunks compacted at the same time
+    :return: (bucket, list of (key, size) tuples) of the compacted files
+    """
+    url = config.get("S3", source)
+    bucket, _ = parse_s3_url(url)
+    keys = list_objects(s3, url)
+
+    num_slices = get_slice_count(config.get("CLUSTER", "DWH_NODE_TYPE"), config.get("CLUSTER", "DWH_NUM_NODES"))
+    max_chunk_size = config.getint("ETL", "COMPACT_CHUNK_MB", fallback=256) * 1024 * 1024
+    min_chunk_size = config.getint("ETL", "COMPACT_MIN_CHUNK_MB", fallback=64) * 1024 * 1024
+    chunks = plan_chunks(keys, num_slices, max_chunk_size, min_chunk_size)
+
+    staging_prefix = config.get("S3", "STAGING_PREFIX").strip("'\"")
+    out_urls = ["{}/{}/part-{:05d}.json.{}".format(staging_prefix, source, i, "gz" if codec == "gzip" else codec)
+                for i in range(len(chunks))]
+
+    print("\ncompacting {} files of {} into {} chunks...".format(len(keys), source, len(chunks)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        compacted = list(executor.map(lambda args: compact_chunk(s3, bucket, args[0], args[1], codec),
+                                      zip(chunks, out_urls)))
+
+    return parse_s3_url(staging_prefix)[0], compacted
+
+
+def compacted_copy_queries(config, s3):
+    """
+    compacts both sources & builds their COPYs (manifest of the compacted files, compression option).
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource
+    :return: list of COPY queries (same order as sql_queries.copy_table_queries)
+    """
+    codec = config.get("ETL", "COMPACT_CODEC", fallback="gzip")
+    keys_by_source = {source: compact_source(config, s3, source, codec) for source in ("log_data", "song_data")}
+    return manifest_copy_queries(config, s3, keys_by_source, options=CODEC_OPTIONS[codec])
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import configparser
+import csv
+import gzip
+import hashlib
+import io
+import json
+import re
+import tempfile
+from datetime import datetime
+from time import perf_counter
+from compaction import plan_chunks
+from manifest import parse_s3_url, list_objects, get_slice_count, write_manifest, full_copy_queries
+from sql_queries import (staging_events_table_create, staging_songs_table_create, truncate_staging_queries,
+                         staging_csv_copy_template, staging_parquet_copy_template)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional: only needed for FORMAT parquet
+    pyarrow = None
+
+
+# rows held in memory before writing a parquet row group
+BATCH_SIZE = 50000
+
+
+def table_columns(create_sql):
+    """
+    gets column names & types of CREATE TABLE statement, in table order.
+    :param create_sql: CREATE TABLE statement (sql_queries.py)
+    :return: list of (column, type) tuples, e.g. ('ts', 'TIMESTAMP')
+    """
+    body = create_sql[create_sql.index("(") + 1:create_sql.rindex(")")]
+    return [(column, sql_type.upper()) for column, sql_type in re.findall(r"^\s*(\w+)\s+(\w+)", body, re.M)
+            if column.upper() not in ("PRIMARY", "FOREIGN", "UNIQUE", "CONSTRAINT")]
+
+
+def parse_jsonpaths(document):
+    """
+    gets field names of a COPY jsonpaths document (e.g. LOG_JSONPATH), in column order.
+    :param document: jsonpaths json text, {"jsonpaths": ["$['artist']", "$.auth", ...]}
+    :return: list of field names
+    """
+    return [re.sub(r"^\$(\['|\.)|'\]$", "", path) for path in json.loads(document)["jsonpaths"]]
+
+
+def iter_documents(stream):
+    """
+    yields json documents of a text stream (one or many per line, or one over many lines),
+    reading it one block at a time.
+    :param stream: text file object
+    :return: generator of dicts
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    for block in iter(lambda: stream.read(1024 * 1024), ""):
+        buffer = (buffer + block).lstrip()
+        while buffer:
+            try:
+                document, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break  # incomplete document: needs next block
+            yield document
+            buffer = buffer[end:].lstrip()
+    if buffer.strip():
+        raise ValueError("incomplete json document at end of stream")
+
+
+def join_key(title, artist):
+    """
+    computes join key as the staging inserts do (MD5 of normalized title & artist).
+    :param title: song title
+    :param artist: artist name
+    :return: hex digest or none
+    """
+    if title is None or artist is None:
+        return None
+    return hashlib.md5("{}|{}".format(title.strip(" ").lower(), artist.strip(" ").lower()).encode("utf-8")).hexdigest()
+
+
+def cast_value(value, sql_type):
+    """
+    casts a json value to its column type (as COPY does): empty values are null, integer columns
+    accept numbers written as floats or strings (e.g. '39', 1540919166796.0), timestamps stay epoch milliseconds.
+    :param value: json value
+    :param sql_type: column type (from table_columns)
+    :return: value of the column type or none
+    """
+    if value is None or value == "":
+        return None
+    if sql_type in ("INT", "INTEGER", "SMALLINT", "BIGINT", "TIMESTAMP"):
+        return value if isinstance(value, int) and not isinstance(value, bool) else int(float(value))
+    if sql_type in ("FLOAT", "REAL", "DOUBLE", "DECIMAL", "NUMERIC"):
+        return float(value)
+    return value if isinstance(value, str) else str(value)
+
+
+def convert_records(documents, fields, key_fields=None, types=None):
+    """
+    maps json documents to rows, one value per field (as COPY does with jsonpaths / 'auto').
+    :param documents: iterable of dicts
+    :param fields: field names in table column order
+    :param key_fields: (title, artist) field names to append the join key, if given
+    :param types: column type of each field (from table_columns) to cast values to, if given
+    :return: generator of tuples
+    """
+    for document in documents:
+        if types:
+            row = tuple(cast_value(document.get(field), sql_type) for field, sql_type in zip(fields, types))
+        else:
+            row = tuple(document.get(field) for field in fields)
+        if key_fields:
+            row += (join_key(*(document.get(field) for field in key_fields)),)
+        yield row
+
+
+def write_csv(rows, fileobj, compress=True):
+    """
+    writes rows as CSV (null as empty value), gzipped by default.
+    :param rows: iterable of tuples
+    :param fileobj: binary file object
+    :param compress: gzips output
+    :return: number of rows
+    """
+    n_rows = 0
+    output = gzip.GzipFile(fileobj=fileobj, mode="wb") if compress else fileobj
+    text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+    writer = csv.writer(text, lineterminator="\n")
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        n_rows += 1
+    text.flush()
+    text.detach()
+    if compress:
+        output.close()
+    return n_rows
+
+
+def parquet_schema(columns):
+    """
+    builds parquet schema matching table columns.
+    :param columns: list of (column, type) tuples (from table_columns)
+    :return: pyarrow schema
+    """
+    types = {"INT": pyarrow.int32(), "BIGINT": pyarrow.int64(), "FLOAT": pyarrow.float64(),
+             "TIMESTAMP": pyarrow.timestamp("ms")}
+    return pyarrow.schema([(name, types.get(sql_type, pyarrow.string())) for name, sql_type in columns])
+
+
+def write_parquet(rows, fileobj, columns):
+    """
+    writes rows as parquet, one row group per BATCH_SIZE rows.
+    :param rows: iterable of tuples
+    :param fileobj: binary file object
+    :param columns: list of (column, type) tuples (from table_columns)
+    :return: number of rows
+    """
+    if pyarrow is None:
+        raise ImportError("format parquet needs the pyarrow package (pip install pyarrow)")
+
+    schema = parquet_schema(columns)
+    timestamps = [i for i, (_, sql_type) in enumerate(columns) if sql_type == "TIMESTAMP"]
+
+    def to_table(batch):
+        # epoch milliseconds (as in the source json) to timestamps
+        batch = [tuple(datetime.utcfromtimestamp(value / 1000.0) if i in timestamps and value is not None else value
+                       for i, value in enumerate(row)) for row in batch]
+        return pyarrow.Table.from_arrays([pyarrow.array(list(values), type=field.type)
+                                          for values, field in zip(zip(*batch), schema)], schema=schema)
+
+    n_rows, batch = 0, []
+    with pyarrow.parquet.ParquetWriter(fileobj, schema) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                writer.write_table(to_table(batch))
+                n_rows, batch = n_rows + len(batch), []
+        if batch:
+            writer.write_table(to_table(batch))
+            n_rows += len(batch)
+    return n_rows
+
+
+def source_layout(config, s3, source):
+    """
+    gets raw staging table, columns & json fields (in column order) of a source.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource
+    :param source: log_data or song_data
+    :return: table name, list of (column, type) tuples, list of field names, join key fields
+    """
+    if source == "log_data":
+        bucket, key = parse_s3_url(config.get("S3", "LOG_JSONPATH"))
+        fields = parse_jsonpaths(s3.Object(bucket, key).get()["Body"].read().decode("utf-8"))
+        return "staging_events_raw", table_columns(staging_events_table_create), fields, ("song", "artist")
+
+    # FORMAT AS JSON 'auto': fields named as the columns (join_key computed)
+    columns = table_columns(staging_songs_table_create)
+    return "staging_songs_raw", columns, [name for name, _ in columns if name != "join_key"], ("title", "artist_name")
+
+
+def convert_file(s3, bucket, keys, out_url, fields, key_fields, columns, fmt="csv"):
+    """
+    converts json objects into one CSV or parquet file, streaming rows (spooled to a temporary file).
+    :param s3: s3 resource
+    :param bucket: bucket of the source objects
+    :param keys: list of (key, size) tuples
+    :param out_url: s3 url of the converted file
+    :param fields: json field names in column order
+    :param key_fields: (title, artist) field names of the join key
+    :param columns: list of (column, type) tuples
+    :param fmt: csv or parquet
+    :return: (key, size) of the converted file
+    """
+    def rows():
+        for key, _ in keys:
+            stream = codecs.getreader("utf-8")(s3.Object(bucket, key).get()["Body"])
+            for row in convert_records(iter_documents(stream), fields, key_fields,
+                                       [sql_type for _, sql_type in columns[:len(fields)]]):
+                yield row
+
+    out_bucket, out_key = parse_s3_url(out_url)
+    with tempfile.TemporaryFile() as spool:
+        if fmt == "csv":
+            write_csv(rows(), spool)
+        else:
+            write_parquet(rows(), spool, columns)
+        size = spool.tell()
+        spool.seek(0)
+        s3.Bucket(out_bucket).upload_fileobj(spool, out_key)
+
+    return out_key, size
+
+
+def converted_copy_queries(config, s3, fmt="csv"):
+    """
+    converts both sources into one file per slice & builds their COPYs in the given format.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param fmt: csv or parquet
+    :return: list of COPY queries (same order as sql_queries.copy_table_queries)
+    """
+    num_slices = get_slice_count(config.get("CLUSTER", "DWH_NODE_TYPE"), config.get("CLUSTER", "DWH_NUM_NODES"))
+    max_chunk_size = config.getint("ETL", "COMPACT_CHUNK_MB", fallback=256) * 1024 * 1024
+    min_chunk_size = config.getint("ETL", "COMPACT_MIN_CHUNK_MB", fallback=64) * 1024 * 1024
+    staging_prefix = config.get("S3", "STAGING_PREFIX").strip("'\"")
+    template = staging_csv_copy_template if fmt == "csv" else staging_parquet_copy_template
+
+    queries = []
+    for source in ("log_data", "song_data"):
+        table, columns, fields, key_fields = source_layout(config, s3, source)
+        bucket, _ = parse_s3_url(config.get("S3", source))
+        chunks = plan_chunks(list_objects(s3, config.get("S3", source)), num_slices, max_chunk_size, min_chunk_size)
+
+        print("\nconverting {} into {} {} files...".format(source, len(chunks), fmt))
+        converted = [convert_file(s3, bucket, keys,
+                                  "{}/{}/{}/part-{:05d}.{}".format(staging_prefix, fmt, source, i,
+                                                                   "csv.gz" if fmt == "csv" else "parquet"),
+                                  fields, key_fields, columns, fmt)
+                     for i, keys in enumerate(chunks)]
+
+        manifest_url = "{}/{}.{}.manifest".format(config.get("S3", "MANIFEST_PREFIX").strip("'\""), source, fmt)
+        queries.append(template.format(
+            table=table,
+            source=write_manifest(s3, parse_s3_url(staging_prefix)[0], converted, manifest_url),
+            role_arn=config.get("IAM_ROLE", "IAM_ROLE_ARN"),
+            region=config.get("CLUSTER", "DWH_REGION"),
+            options="\nMANIFEST" + ("\nGZIP" if fmt == "csv" else "")))
+
+    return queries
+
+
+def benchmark_formats(config, s3, cur, conn, formats=("json", "csv", "parquet")):
+    """
+    times loading of staging tables from the source json & from each converted format.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource
+    :param cur: postgres cursor
+    :param conn: postgres connection
+    :param formats: formats to compare
+    :return: dict of format -> seconds per staging table
+    """
+    results = {}
+    for fmt in formats:
+        queries = full_copy_queries(config, s3) if fmt == "json" else converted_copy_queries(config, s3, fmt)
+        for query in truncate_staging_queries:
+            cur.execute(query)
+        conn.commit()
+
+        results[fmt] = []
+        for query in queries:
+            start = perf_counter()
+            cur.execute(query)
+            conn.commit()
+            results[fmt].append(perf_counter() - start)
+
+    print("\n{:<10}{:>22}{:>22}".format("format", "staging_events_raw", "staging_songs_raw"))
+    for fmt, timings in results.items():
+        print("{:<10}{:>21.2f}s{:>21.2f}s".format(fmt, *timings))
+
+    return results
+
+
+if __name__ == "__main__":
+    from db import connect
+    from setup_cluster import create_client
+
+    config = configparser.ConfigParser()
+    config.read_file(open("dwh.cfg"))
+
+    ec2, s3, iam, redshift = create_client(config.get("CLUSTER", "DWH_REGION"),
+                                           config.get("AWS", "AWS_KEY"),
+                                           config.get("AWS", "AWS_SECRET"))
+    conn = connect(config)
+    benchmark_formats(config, s3, conn.cursor(), conn)
+    conn.close()
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
 import configparser
-import psycopg2
+import db
+import metrics
 from sql_queries import create_table_queries, drop_table_queries
 
 
@@ -15,7 +17,7 @@ def drop_tables(cur, conn):
     """
     for query in drop_table_queries:
         print("\nexecuting: {}".format(query))
-        cur.execute(query)
+        metrics.execute(cur, query)
         conn.commit()
     print("\ntables dropped.")
 
@@ -29,18 +31,18 @@ def create_tables(cur, conn):
     """
     for query in create_table_queries:
         print("\nexecuting: {}".format(query))
-        cur.execute(query)
+        metrics.execute(cur, query)
         conn.commit()
     print("\ntables created.")
 
 
-def create_tables_main():
+def create_tables_main(drop=True):
     """
     - Loads configuration parameters (dwh.cfg)
 
     - Establishes connection with database.
 
-    - Drops all the tables.
+    - Drops all the tables (unless drop is False: incremental loading keeps them).
 
     - Creates all tables needed.
 
@@ -50,19 +52,15 @@ def create_tables_main():
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    #conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    # per-statement metrics (json lines) to trend etl performance across runs
+    metrics.configure(config.get("ETL", "METRICS_FILE", fallback=None))
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(
-        config.get("CLUSTER", "DWH_HOST"),
-        config.get("CLUSTER", "DWH_DB_NAME"),
-        config.get("CLUSTER", "DWH_DB_USER"),
-        config.get("CLUSTER", "DWH_DB_PASSWORD"),
-        config.get("CLUSTER", "DWH_PORT")
-    ))
+    conn = db.connect(config, config.get("WLM", "ETL_QUERY_GROUP", fallback="etl"))
 
     cur = conn.cursor()
 
-    drop_tables(cur, conn)
+    if drop:
+        drop_tables(cur, conn)
 
     create_tables(cur, conn)
 
@@ -70,4 +68,9 @@ def create_tables_main():
 
 
 if __name__ == "__main__":
-    create_tables_main()
+    parser = argparse.ArgumentParser(description="creates sparkify staging & production tables")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keeps existing tables & data, only creates the missing tables")
+    args = parser.parse_args()
+
+    create_tables_main(drop=not args.incremental)
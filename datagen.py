@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import configparser
+import io
+import json
+import os
+import random
+import string
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from manifest import parse_s3_url
+
+
+# eventsim log fields, in staging_events column order (written as log_json_path.json)
+LOG_FIELDS = ["artist", "auth", "firstName", "gender", "itemInSession", "lastName", "length", "level", "location",
+              "method", "page", "registration", "sessionId", "song", "status", "ts", "userAgent", "userId"]
+
+# pages other than NextSong & their weights
+OTHER_PAGES = [("Home", 40), ("Logout", 10), ("Login", 10), ("Settings", 5), ("Thumbs Up", 20),
+               ("Thumbs Down", 5), ("Add to Playlist", 10)]
+
+USER_AGENTS = [
+    '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+    '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.78.2 (KHTML, like Gecko) Version/7.0.6 Safari/537.78.2"',
+    "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0",
+]
+
+LOCATIONS = ["San Francisco-Oakland-Hayward, CA", "New York-Newark-Jersey City, NY-NJ-PA", "Chicago-Naperville-Elgin, IL-IN-WI",
+             "Atlanta-Sandy Springs-Roswell, GA", "Seattle-Tacoma-Bellevue, WA", "Houston-The Woodlands-Sugar Land, TX"]
+
+
+def word(rng, length=None):
+    """
+    makes a random capitalized word.
+    :param rng: random generator
+    :param length: word length (default: random)
+    :return: string
+    """
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length or rng.randint(3, 9))).capitalize()
+
+
+def artist(seed, i):
+    """
+    builds artist i (same seed & index: same artist, so nothing is kept in memory).
+    :param seed: generator seed
+    :param i: artist index
+    :return: dict with artist fields
+    """
+    rng = random.Random("artist-{}-{}".format(seed, i))
+    located = rng.random() < 0.5
+    return {
+        "artist_id": "AR{:016X}".format(rng.getrandbits(64)),
+        "artist_name": " ".join(word(rng) for _ in range(rng.randint(1, 3))),
+        "artist_location": rng.choice(LOCATIONS) if located else "",
+        "artist_latitude": round(rng.uniform(-60, 60), 5) if located else None,
+        "artist_longitude": round(rng.uniform(-180, 180), 5) if located else None,
+    }
+
+
+def song(seed, i, n_artists):
+    """
+    builds song i of the catalog (json as in song_data).
+    :param seed: generator seed
+    :param i: song index
+    :param n_artists: number of artists
+    :return: dict with song fields
+    """
+    rng = random.Random("song-{}-{}".format(seed, i))
+    document = {"num_songs": 1}
+    document.update(artist(seed, i % n_artists))
+    document.update({
+        "song_id": "SO{:016X}".format(rng.getrandbits(64)),
+        "title": " ".join(word(rng) for _ in range(rng.randint(1, 4))),
+        "duration": round(rng.uniform(90, 420), 5),
+        "year": rng.choice([0] + list(range(1960, 2019))),
+    })
+    return document
+
+
+def user(seed, i):
+    """
+    builds user i (eventsim user fields).
+    :param seed: generator seed
+    :param i: user index
+    :return: dict with user fields
+    """
+    rng = random.Random("user-{}-{}".format(seed, i))
+    return {
+        "userId": str(i + 1),
+        "firstName": word(rng),
+        "lastName": word(rng),
+        "gender": rng.choice("MF"),
+        "location": rng.choice(LOCATIONS),
+        "userAgent": rng.choice(USER_AGENTS),
+        "registration": 1540000000000 + rng.randint(0, 10 ** 9),
+        "paid_from_day": rng.choice([None, None, rng.randint(0, 60)]),  # day switching to paid level
+    }
+
+
+def zipf_index(rng, n, skew):
+    """
+    draws an index in [0, n) with zipf-like popularity (skew 0: uniform), without building a table.
+    :param rng: random generator
+    :param n: number of items
+    :param skew: zipf exponent
+    :return: index
+    """
+    if skew <= 0:
+        return rng.randrange(n)
+    u = rng.random()
+    if abs(skew - 1.0) < 1e-9:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+    return min(int(rank) - 1, n - 1)
+
+
+def day_events(seed, day, start, events_per_day, n_users, n_songs, n_artists, match_rate, skew):
+    """
+    yields log events of one day in ts order (json as in log_data).
+    :param seed: generator seed
+    :param day: day index
+    :param start: first day (datetime)
+    :param events_per_day: number of events per day
+    :param n_users: number of users
+    :param n_songs: number of songs of the catalog
+    :param n_artists: number of artists
+    :param match_rate: fraction of played songs that are in the catalog (match staging_songs)
+    :param skew: zipf exponent of song & user popularity
+    :return: generator of dicts
+    """
+    rng = random.Random("day-{}-{}".format(seed, day))
+    day_start = int((start + timedelta(days=day) - datetime(1970, 1, 1)).total_seconds() * 1000)
+    step = 24 * 3600 * 1000 // max(events_per_day, 1)
+    sessions = {}
+    pages, weights = zip(*OTHER_PAGES)
+
+    for n in range(events_per_day):
+        u = zipf_index(rng, n_users, skew)
+        profile = user(seed, u)
+        session = sessions.setdefault(u, [day * n_users + u, 0])
+        session[1] += 1
+
+        event = {
+            "auth": "Logged In",
+            "firstName": profile["firstName"],
+            "gender": profile["gender"],
+            "itemInSession": session[1] - 1,
+            "lastName": profile["lastName"],
+            "level": "paid" if profile["paid_from_day"] is not None and day >= profile["paid_from_day"] else "free",
+            "location": profile["location"],
+            "method": "PUT",
+            "registration": profile["registration"],
+            "sessionId": session[0],
+            "status": 200,
+            "ts": day_start + n * step + rng.randrange(step or 1),
+            "userAgent": profile["userAgent"],
+            "userId": profile["userId"],
+            "artist": None,
+            "length": None,
+            "song": None,
+            "page": "NextSong",
+        }
+        if rng.random() < 0.8:
+            if rng.random() < match_rate:
+                played = song(seed, zipf_index(rng, n_songs, skew), n_artists)
+                event.update({"artist": played["artist_name"], "song": played["title"], "length": played["duration"]})
+            else:
+                event.update({"artist": word(rng), "song": word(rng), "length": round(rng.uniform(90, 420), 5)})
+        else:
+            event.update({"page": rng.choices(pages, weights)[0], "method": "GET"})
+        yield event
+
+
+@contextmanager
+def open_local(root, key):
+    """
+    opens local file for writing (directories created).
+    :param root: output directory
+    :param key: relative path
+    :return: text file object
+    """
+    path = os.path.join(root, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as output:
+        yield output
+
+
+@contextmanager
+def open_s3(s3, url, key):
+    """
+    opens s3 object for writing: spooled to a temporary file & uploaded on close.
+    :param s3: s3 resource
+    :param url: output s3 prefix url
+    :param key: key relative to the prefix
+    :return: text file object
+    """
+    bucket, prefix = parse_s3_url(url)
+    with tempfile.TemporaryFile() as spool:
+        text = io.TextIOWrapper(spool, encoding="utf-8")
+        yield text
+        text.flush()
+        text.detach()  # before the upload, which closes the spool
+        spool.seek(0)
+        s3.Bucket(bucket).upload_fileobj(spool, "{}/{}".format(prefix.rstrip("/"), key).lstrip("/"))
+
+
+def generate(opener, seed=0, n_users=100, n_songs=10000, n_artists=5000, n_days=30, events_per_day=10000,
+             match_rate=0.5, skew=1.1, songs_per_file=1, start=datetime(2018, 11, 1)):
+    """
+    writes song_data, log_data & log_json_path.json; one file at a time, so memory does not grow with output size.
+    :param opener: function of relative key returning a context manager of a writable text file
+    :param seed: generator seed (same seed & parameters: same data)
+    :param n_users: number of users
+    :param n_songs: number of songs of the catalog
+    :param n_artists: number of artists
+    :param n_days: number of days of logs
+    :param events_per_day: number of events per day
+    :param match_rate: fraction of played songs that are in the catalog
+    :param skew: zipf exponent of song & user popularity
+    :param songs_per_file: songs per song_data file (1 as in the million song dataset)
+    :param start: first day of logs
+    :return: number of songs, number of events
+    """
+    with opener("log_json_path.json") as output:
+        json.dump({"jsonpaths": ["$['{}']".format(field) for field in LOG_FIELDS]}, output)
+
+    for first in range(0, n_songs, songs_per_file):
+        first_song = song(seed, first, n_artists)
+        key = "song_data/{}/{}/{}/{}.json".format(*(list(first_song["song_id"][2:5]) + [first_song["song_id"]]))
+        with opener(key) as output:
+            for i in range(first, min(first + songs_per_file, n_songs)):
+                output.write(json.dumps(song(seed, i, n_artists)) + "\n")
+
+    for day in range(n_days):
+        date = start + timedelta(days=day)
+        with opener("log_data/{:%Y/%m/%Y-%m-%d}-events.json".format(date)) as output:
+            for event in day_events(seed, day, start, events_per_day, n_users, n_songs, n_artists, match_rate, skew):
+                output.write(json.dumps(event) + "\n")
+
+    print("\n{} songs & {} events written.".format(n_songs, n_days * events_per_day))
+    return n_songs, n_days * events_per_day
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generates song & eventsim-style log data")
+    parser.add_argument("output", help="local directory or s3://bucket/prefix")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--songs", type=int, default=10000)
+    parser.add_argument("--artists", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--events-per-day", type=int, default=10000)
+    parser.add_argument("--match-rate", type=float, default=0.5, help="fraction of played songs in the catalog")
+    parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent of song & user popularity")
+    parser.add_argument("--songs-per-file", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.output.startswith("s3://"):
+        from setup_cluster import create_client
+
+        config = configparser.ConfigParser()
+        config.read_file(open("dwh.cfg"))
+        ec2, s3, iam, redshift = create_client(config.get("CLUSTER", "DWH_REGION"),
+                                               config.get("AWS", "AWS_KEY"),
+                                               config.get("AWS", "AWS_SECRET"))
+        opener = lambda key: open_s3(s3, args.output, key)
+    else:
+        opener = lambda key: open_local(args.output, key)
+
+    generate(opener, args.seed, args.users, args.songs, args.artists, args.days, args.events_per_day,
+             args.match_rate, args.skew, args.songs_per_file)
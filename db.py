@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+from time import sleep
+import psycopg2
+import psycopg2.pool
+
+
+# errors worth retrying: lost/refused connections (not sql errors)
+RETRYABLE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# operational errors not retried: statement cancelled or over statement timeout
+NOT_RETRYABLE_ERRORS = (psycopg2.extensions.QueryCanceledError,)
+
+
+def connection_params(config, DWH_ENDPOINT=None):
+    """
+    gets connection parameters of redshift database (dwh.cfg), with TCP keepalives so idle
+    connections survive long statements & dead ones are detected.
+    :param config: parsed dwh.cfg
+    :param DWH_ENDPOINT: cluster endpoint (default: DWH_HOST)
+    :return: dict of psycopg2.connect keyword arguments
+    """
+    return {
+        "host": DWH_ENDPOINT or config.get("CLUSTER", "DWH_HOST"),
+        "dbname": config.get("CLUSTER", "DWH_DB_NAME"),
+        "user": config.get("CLUSTER", "DWH_DB_USER"),
+        "password": config.get("CLUSTER", "DWH_DB_PASSWORD"),
+        "port": config.get("CLUSTER", "DWH_PORT"),
+        "connect_timeout": config.getint("CONNECTION", "CONNECT_TIMEOUT", fallback=10),
+        "keepalives": 1,
+        "keepalives_idle": config.getint("CONNECTION", "KEEPALIVES_IDLE", fallback=60),
+        "keepalives_interval": config.getint("CONNECTION", "KEEPALIVES_INTERVAL", fallback=10),
+        "keepalives_count": config.getint("CONNECTION", "KEEPALIVES_COUNT", fallback=5),
+    }
+
+
+def retry(func, attempts=3, delay=2, max_delay=30):
+    """
+    calls function, retrying with exponential backoff on retryable (connection) errors.
+    :param func: function without arguments
+    :param attempts: number of calls before the error is raised
+    :param delay: first delay between calls (seconds)
+    :param max_delay: longest delay between calls (seconds)
+    :return: function result
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except RETRYABLE_ERRORS as err:
+            if attempt == attempts or isinstance(err, NOT_RETRYABLE_ERRORS):
+                raise
+            print("\nretryable error (attempt {}/{}), retrying in {}s: {}".format(attempt, attempts, delay, err))
+            sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+
+def set_statement_timeout(conn, statement_timeout):
+    """
+    sets statement timeout of a connection.
+    :param conn: postgres connection
+    :param statement_timeout: seconds (0: no timeout)
+    :return: none
+    """
+    cur = conn.cursor()
+    cur.execute("SET statement_timeout TO %s;", (int(statement_timeout * 1000),))
+    conn.commit()
+
+
+def set_query_group(conn, query_group):
+    """
+    sets query group of a connection: its statements run in the WLM queue of that group.
+    :param conn: postgres connection
+    :param query_group: query group (e.g. [WLM] ETL_QUERY_GROUP)
+    :return: none
+    """
+    cur = conn.cursor()
+    cur.execute("SET query_group TO %s;", (query_group,))
+    conn.commit()
+
+
+def connect(config, query_group=None):
+    """
+    opens a new connection to redshift database (keepalives, statement timeout, retried).
+    :param config: parsed dwh.cfg
+    :param query_group: WLM query group of its statements (none: default queue)
+    :return: postgres connection
+    """
+    params = connection_params(config)
+
+    def open_connection():
+        conn = psycopg2.connect(**params)
+        set_statement_timeout(conn, config.getint("CONNECTION", "STATEMENT_TIMEOUT", fallback=0))
+        if query_group:
+            set_query_group(conn, query_group)
+        return conn
+
+    return retry(open_connection, attempts=config.getint("CONNECTION", "RETRIES", fallback=3))
+
+
+def connect_to(config, DWH_ENDPOINT):
+    """
+    opens a connection to a given endpoint (before it is written in dwh.cfg), with the other
+    connection parameters of dwh.cfg, retried.
+    :param config: parsed dwh.cfg
+    :param DWH_ENDPOINT: cluster endpoint
+    :return: postgres connection
+    """
+    params = connection_params(config, DWH_ENDPOINT)
+    return retry(lambda: psycopg2.connect(**params), attempts=config.getint("CONNECTION", "RETRIES", fallback=3))
+
+
+class ConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    thread-safe pool of connections to redshift database, each one opened with keepalives,
+    statement timeout & retry (as connect).
+    """
+
+    def __init__(self, config, maxconn, query_group=None):
+        """
+        :param config: parsed dwh.cfg
+        :param maxconn: most connections open at the same time
+        :param query_group: WLM query group of their statements (none: default queue)
+        """
+        self.config = config
+        self.query_group = query_group
+        super().__init__(0, maxconn)
+
+    def _connect(self, key=None):
+        # same bookkeeping as psycopg2.pool.AbstractConnectionPool._connect, connection opened by connect()
+        conn = connect(self.config, self.query_group)
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        borrows a connection: rolled back on error; broken connections are closed instead of reused.
+        :return: postgres connection
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except RETRYABLE_ERRORS:
+                pass  # broken connection: closed by putconn
+            raise
+        finally:
+            self.putconn(conn, close=bool(conn.closed))
+
+
+class RunningStatements:
+    """
+    connections running statements in parallel, cancelled together at the first failure: a statement
+    registered after the cancel is not started, one that ran anyway is not committed.
+    """
+
+    def __init__(self):
+        self.conns = {}
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def register(self, query, conn):
+        """
+        records the connection about to run a statement.
+        :param query: sql statement
+        :param conn: postgres connection
+        :return: none
+        """
+        with self._lock:
+            self.check()
+            self.conns[query] = conn
+
+    def unregister(self, query):
+        """
+        forgets the connection of a finished statement.
+        :param query: sql statement
+        :return: none
+        """
+        with self._lock:
+            self.conns.pop(query, None)
+
+    def check(self):
+        """
+        raises an error once the statements are cancelled.
+        :return: none
+        """
+        if self.cancelled:
+            raise CancelledError("statement cancelled: another statement failed")
+
+    def cancel(self):
+        """
+        cancels the statements running & the ones not started yet.
+        :return: none
+        """
+        with self._lock:
+            self.cancelled = True
+            for conn in self.conns.values():
+                conn.cancel()
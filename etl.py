@@ -1,61 +1,327 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
 import configparser
-import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+import checkpoint
+import db
+import metrics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from time import perf_counter
+from sql_queries import copy_table_queries, staging_insert_queries, insert_table_steps, truncate_staging_queries
+from scheduler import run_dag
+from incremental import load_incremental, source_watermarks, set_watermark
+from manifest import full_copy_queries
+from compaction import compacted_copy_queries
+from converter import converted_copy_queries
+from setup_cluster import create_client
+from query_cache import bump_table_versions
+from aggregates import refresh_aggregates
+from maintenance import maintain
+from shadow import build_shadow_tables, shadow_steps, shadow_aggregates, swap_shadow_tables, drop_old_tables
 
 
-def load_staging_tables(cur, conn):
+# checkpointed step: staging tables emptied (rows of an earlier run are not loaded again)
+TRUNCATE_STEP = "truncate staging"
+
+
+def truncate_staging_tables(cur, conn):
     """
-    loads/copies song & log data from S3 into staging tables.
+    empties staging tables before a full load (skipped by a resumed run that already did it).
     :param cur: postgres cursor
     :param conn: postgres connection
     :return: none
     """
+    if checkpoint.is_completed(TRUNCATE_STEP):
+        return
+    for query in truncate_staging_queries:
+        print("\nexecuting: {}".format(query))
+        metrics.execute(cur, query)
+    checkpoint.mark_completed(cur, TRUNCATE_STEP)
+    conn.commit()
+    print("\nstaging tables emptied.")
+
 
-    for query in copy_table_queries:
+def load_staging_tables(cur, conn, queries=copy_table_queries):
+    """
+    loads/copies song & log data from S3 into raw staging tables, then into staging tables with their
+    join keys (statements completed by a resumed run are skipped).
+    :param cur: postgres cursor
+    :param conn: postgres connection
+    :param queries: COPY queries (default: straight from the S3 prefixes)
+    :return: none
+    """
+
+    for query in queries + staging_insert_queries:
+        step = metrics.statement_label(query)
+        if checkpoint.is_completed(step):
+            continue
         print("\nexecuting: {}".format(query))
-        cur.execute(query)
+        metrics.execute(cur, query)
+        checkpoint.mark_completed(cur, step)
         conn.commit()
     print("\ndata loaded into staging tables.")
 
 
-def insert_tables(cur, conn):
+def run_statement(pool, query, running, step=None):
+    """
+    runs one statement on a pooled connection & commits it.
+    opening the connection is retried (db.connect), the statement is not: a COPY or INSERT may have been
+    applied when the connection was lost, so a failed run is resumed instead (--resume).
+    :param pool: db.ConnectionPool
+    :param query: sql statement
+    :param running: db.RunningStatements (cancelled together on failure)
+    :param step: step name checkpointed with the commit (default: statement label)
+    :return: elapsed seconds
+    """
+
+    print("\nexecuting: {}".format(query))
+    with pool.connection() as conn:
+        running.register(query, conn)
+        try:
+            start = perf_counter()
+            cur = conn.cursor()
+            metrics.execute(cur, query)
+            checkpoint.mark_completed(cur, step or metrics.statement_label(query))
+            running.check()  # cancelled while it ran: rolled back
+            conn.commit()
+            return perf_counter() - start
+        finally:
+            running.unregister(query)
+
+
+def run_concurrently(pool, queries, max_workers):
+    """
+    runs statements concurrently, each one over a separate connection (thread pool).
+    stops at the first error: pending statements are skipped & running ones are cancelled.
+    statements completed by a resumed run are skipped.
+    :param pool: db.ConnectionPool
+    :param queries: list of sql statements
+    :param max_workers: degree of parallelism
+    :return: list of (query, elapsed seconds)
+    """
+    queries = [query for query in queries if not checkpoint.is_completed(metrics.statement_label(query))]
+    running = db.RunningStatements()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_statement, pool, query, running): query for query in queries}
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+        failed = [future for future in done if future.exception() is not None]
+        if failed:
+            for future in not_done:
+                future.cancel()
+            running.cancel()
+            raise failed[0].exception()
+
+    timings = [(futures[future], future.result()) for future in futures]
+    for query, elapsed in timings:
+        print("\n{:.2f}s: {}".format(elapsed, query.strip().splitlines()[0]))
+    return timings
+
+
+def load_staging_tables_concurrently(pool, max_workers=2, queries=copy_table_queries):
+    """
+    loads/copies song & log data from S3 into raw staging tables (one connection per COPY),
+    then into staging tables with their join keys.
+    :param pool: db.ConnectionPool
+    :param max_workers: number of COPYs running at the same time
+    :param queries: COPY queries (default: straight from the S3 prefixes)
+    :return: list of (query, elapsed seconds)
+    """
+    timings = run_concurrently(pool, queries, max_workers)
+    timings += run_concurrently(pool, staging_insert_queries, max_workers)
+    print("\ndata loaded into staging tables.")
+    return timings
+
+
+def insert_tables(cur, conn, steps=insert_table_steps, bump_versions=True):
     """
-    inserts data from staging tables into analytics tables (star-schema).
+    inserts data from staging tables into analytics tables (star-schema)
+    (steps completed by a resumed run are skipped).
     :param cur: postgres cursor
     :param conn: postgres connection
+    :param steps: insert steps (default: into the production tables)
+    :param bump_versions: bumps load versions of written tables (false: shadow tables)
     :return: none
     """
-    for query in insert_table_queries:
-        print("\nexecuting: {}".format(query))
-        cur.execute(query)
+    for step in steps:
+        if checkpoint.is_completed(step["name"]):
+            continue
+        print("\nexecuting: {}".format(step["query"]))
+        metrics.execute(cur, step["query"])
+        if bump_versions:
+            bump_table_versions(cur, step["writes"])
+        checkpoint.mark_completed(cur, step["name"])
         conn.commit()
     print("\ndata inserted into analytics tables.")
 
 
-def etl():
+def insert_tables_concurrently(pool, max_workers=3, steps=insert_table_steps):
+    """
+    inserts data from staging tables into analytics tables (star-schema), running independent
+    inserts in parallel (one connection each) in the order the tables they read & write allow
+    (steps completed by a resumed run are skipped).
+    load versions of the written tables are not bumped: parallel transactions updating the same
+    etl_table_versions rows would fail (serializable isolation), the caller bumps them once.
+    :param pool: db.ConnectionPool
+    :param max_workers: number of inserts running at the same time
+    :param steps: insert steps (default: into the production tables)
+    :return: dict of step name -> elapsed seconds
+    """
+    steps = [step for step in steps if not checkpoint.is_completed(step["name"])]
+    running = db.RunningStatements()
+    try:
+        durations = run_dag(steps, lambda step: run_statement(pool, step["query"], running, step["name"]),
+                            max_workers)
+    except Exception:
+        running.cancel()
+        raise
+    print("\ndata inserted into analytics tables.")
+    return durations
+
+
+def load_full(config, s3, conn, pool, copy_workers=1, insert_workers=1, resume=False, shadow=False, run_id=None):
+    """
+    (re)loads every S3 object into staging tables & the star schema, checkpointing each step.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param conn: postgres connection
+    :param pool: db.ConnectionPool (statements running in parallel)
+    :param copy_workers: number of COPYs running at the same time (1: sequential load)
+    :param insert_workers: number of inserts running at the same time (1: sequential inserts)
+    :param resume: resumes the latest unfinished run
+    :param shadow: loads shadow tables & swaps them in at the end
+    :param run_id: id of a new run (default: new uuid)
+    :return: run id (none: resume asked but no unfinished run)
+    """
+    cur = conn.cursor()
+
+    # steps are checkpointed in etl_run_steps as they complete; a resumed run skips them
+    run_id = checkpoint.start_run(cur, config, resume, "shadow" if shadow else "full", s3, run_id)
+    conn.commit()
+    if run_id is None:
+        print("\nno unfinished run to resume.")
+        return None
+    metrics.configure(config.get("ETL", "METRICS_FILE", fallback=None), run_id)
+
+    # COPY from source json converted to csv/parquet, from compressed chunks compacted
+    # from the small source files, or from size-balanced manifests instead of the bare S3 prefixes
+    COPY_FORMAT = config.get("ETL", "COPY_FORMAT", fallback="json")
+    if all(checkpoint.is_completed(metrics.statement_label(query)) for query in copy_table_queries):
+        queries = []  # resumed after the load: nothing to list, compact or convert
+    elif COPY_FORMAT != "json":
+        queries = converted_copy_queries(config, s3, COPY_FORMAT)
+    elif config.getboolean("ETL", "COMPACT", fallback=False):
+        queries = compacted_copy_queries(config, s3)
+    elif config.getboolean("ETL", "USE_MANIFEST", fallback=False):
+        queries = full_copy_queries(config, s3)
+    else:
+        queries = copy_table_queries
+
+    # everything under the sources before the load: later incremental runs only load what is added after it
+    watermarks = source_watermarks(config, s3)
+
+    # blue/green: production tables are kept (& read) while their shadow copies are loaded
+    # (staging tables emptied with them)
+    if shadow:
+        build_shadow_tables(cur, conn)
+    else:
+        truncate_staging_tables(cur, conn)
+    steps = shadow_steps(insert_table_steps) if shadow else insert_table_steps
+
+    if copy_workers > 1:
+        load_staging_tables_concurrently(pool, copy_workers, queries)
+    else:
+        load_staging_tables(cur, conn, queries)
+
+    if insert_workers > 1:
+        insert_tables_concurrently(pool, insert_workers, steps)
+        if not shadow:
+            # every written table bumped once, from this connection (steps skipped by a resume included)
+            bump_table_versions(cur, sorted({table for step in steps for table in step["writes"]}))
+            conn.commit()
+    else:
+        insert_tables(cur, conn, steps, bump_versions=not shadow)
+
+    # aggregates are refreshed with the run marked as done (one transaction);
+    # shadow tables are swapped in by the same transaction
+    if shadow:
+        drop_old_tables(cur, conn)  # left by an earlier run stopped after its swap
+        refresh_aggregates(cur, shadow_aggregates(), bump_versions=False)
+        swap_shadow_tables(cur)
+    else:
+        refresh_aggregates(cur)
+    for source, watermark in watermarks.items():
+        set_watermark(cur, source, watermark)
+    checkpoint.mark_completed(cur, checkpoint.FINAL_STEP)
+    conn.commit()
+    print("\naggregate tables refreshed, watermarks: {}".format(watermarks))
+
+    if shadow:
+        drop_old_tables(cur, conn)
+
+    return run_id
+
+
+def etl(incremental=False, resume=False, shadow=False, run_id=None):
     # gets parameters from config file dwh.cfg
     config = configparser.ConfigParser()
     config.read_file(open("dwh.cfg"))
 
-    # connection to redshift database
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(
-        config.get("CLUSTER", "DWH_HOST"),
-        config.get("CLUSTER", "DWH_DB_NAME"),
-        config.get("CLUSTER", "DWH_DB_USER"),
-        config.get("CLUSTER", "DWH_DB_PASSWORD"),
-        config.get("CLUSTER", "DWH_PORT")
-    ))
-    cur = conn.cursor()
+    # per-statement metrics (json lines) to trend etl performance across runs
+    # (run_id: given by a caller recording its own metrics under it, e.g. autoscale.py)
+    run_id = metrics.configure(config.get("ETL", "METRICS_FILE", fallback=None), run_id)
+
+    # s3 resource (from setup_cluster) to list source objects & write manifests
+    ec2, s3, iam, redshift = create_client(config.get("CLUSTER", "DWH_REGION"),
+                                           config.get("AWS", "AWS_KEY"),
+                                           config.get("AWS", "AWS_SECRET"))
 
-    load_staging_tables(cur, conn)
+    # etl statements run in their own WLM queue ([WLM] of dwh.cfg, setup_cluster.py)
+    ETL_QUERY_GROUP = config.get("WLM", "ETL_QUERY_GROUP", fallback="etl")
 
-    insert_tables(cur, conn)
+    if incremental:
+        conn = db.connect(config, ETL_QUERY_GROUP)
+        try:
+            load_incremental(config, s3, conn.cursor(), conn)
+        finally:
+            conn.close()
+        if config.getboolean("MAINTENANCE", "ENABLED", fallback=False):
+            maintain(config)
+        return
 
-    conn.close()
+    # number of COPYs running at the same time (1: sequential load)
+    COPY_WORKERS = config.getint("ETL", "COPY_WORKERS", fallback=1)
+    # number of inserts running at the same time (1: sequential inserts)
+    INSERT_WORKERS = config.getint("ETL", "INSERT_WORKERS", fallback=1)
+
+    # connection to redshift database & pooled connections for statements running in parallel
+    # (opened when first borrowed); both closed whatever happens
+    conn = db.connect(config, ETL_QUERY_GROUP)
+    pool = db.ConnectionPool(config, max(COPY_WORKERS, INSERT_WORKERS), ETL_QUERY_GROUP)
+    try:
+        if not load_full(config, s3, conn, pool, COPY_WORKERS, INSERT_WORKERS, resume, shadow, run_id):
+            return
+    finally:
+        conn.close()
+        pool.closeall()
+
+    # vacuum & analyze tables degraded by the load (own autocommit connection)
+    if config.getboolean("MAINTENANCE", "ENABLED", fallback=False):
+        maintain(config)
 
 
 if __name__ == "__main__":
-    etl()
+    parser = argparse.ArgumentParser(description="loads sparkify data from S3 into redshift")
+    parser.add_argument("--incremental", action="store_true",
+                        help="loads only the S3 objects added since the last run (see etl_watermarks)")
+    parser.add_argument("--resume", action="store_true",
+                        help="resumes the last unfinished run, skipping its completed steps (see etl_run_steps)")
+    parser.add_argument("--shadow", action="store_true",
+                        help="reloads into shadow tables & swaps them in at the end (tables stay readable)")
+    args = parser.parse_args()
+    if args.incremental and args.resume:
+        # incremental runs are not checkpointed: a failed one is simply re-run (watermarks not moved)
+        parser.error("--resume applies to full loads only: re-run a failed --incremental load instead")
+
+    etl(incremental=args.incremental, resume=args.resume, shadow=args.shadow)
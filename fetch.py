@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from manifest import parse_s3_url, list_objects
+from sql_queries import unload_template
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional: only needed for arrow chunks & unloaded extracts
+    pyarrow = None
+
+
+# rows held in client memory per batch
+BATCH_SIZE = 50000
+
+
+def require_pyarrow():
+    """
+    raises an error if pyarrow (optional) is not installed.
+    :return: none
+    """
+    if pyarrow is None:
+        raise ImportError("arrow chunks & unloaded extracts need the pyarrow package (pip install pyarrow)")
+
+
+def iter_batches(conn, sql, params=None, batch_size=BATCH_SIZE):
+    """
+    streams query result in fixed-size batches through a named (server-side) cursor, so client
+    memory is bounded by batch_size whatever the result size.
+    the cursor lives in the current transaction (conn must not be in autocommit mode).
+    usage (notebook or python):
+        for columns, rows in iter_batches(conn, "SELECT * FROM songplays"):
+            ...
+    :param conn: postgres connection
+    :param sql: sql query
+    :param params: query parameters
+    :param batch_size: rows per batch
+    :return: generator of (column names, list of rows) tuples
+    """
+    cur = conn.cursor(name="fetch_{}".format(uuid.uuid4().hex))
+    cur.itersize = batch_size
+    try:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [column[0] for column in cur.description], rows
+    finally:
+        cur.close()
+
+
+def iter_dataframes(conn, sql, params=None, batch_size=BATCH_SIZE):
+    """
+    streams query result as pandas dataframes of at most batch_size rows (see iter_batches).
+    :param conn: postgres connection
+    :param sql: sql query
+    :param params: query parameters
+    :param batch_size: rows per dataframe
+    :return: generator of pandas dataframes
+    """
+    import pandas
+
+    for columns, rows in iter_batches(conn, sql, params, batch_size):
+        yield pandas.DataFrame.from_records(rows, columns=columns)
+
+
+def iter_arrow(conn, sql, params=None, batch_size=BATCH_SIZE):
+    """
+    streams query result as arrow record batches of at most batch_size rows (see iter_batches).
+    :param conn: postgres connection
+    :param sql: sql query
+    :param params: query parameters
+    :param batch_size: rows per record batch
+    :return: generator of pyarrow record batches
+    """
+    require_pyarrow()
+
+    for columns, rows in iter_batches(conn, sql, params, batch_size):
+        yield pyarrow.RecordBatch.from_arrays([pyarrow.array(values) for values in zip(*rows)], names=columns)
+
+
+def unload(cur, config, sql, parallel=True, max_file_mb=128):
+    """
+    unloads query result to s3 as parquet files (written by every slice in parallel) under a new
+    prefix of UNLOAD_PREFIX.
+    :param cur: postgres cursor
+    :param config: parsed dwh.cfg
+    :param sql: sql query (no parameters; a LIMIT must be in a subquery)
+    :param parallel: one file set per slice (false: files written in ORDER BY order)
+    :param max_file_mb: largest file written (bounds memory used to read each file back)
+    :return: s3 url of the extract
+    """
+    url = "{}/{}/".format(config.get("S3", "UNLOAD_PREFIX").strip("'\"").rstrip("/"), uuid.uuid4().hex)
+    metrics.execute(cur, unload_template.format(
+        query=sql.strip().rstrip(";").replace("'", "''"),
+        destination=url,
+        role_arn=config.get("IAM_ROLE", "IAM_ROLE_ARN"),
+        region=config.get("CLUSTER", "DWH_REGION"),
+        parallel="ON" if parallel else "OFF",
+        max_file_mb=max_file_mb
+    ))
+    return url
+
+
+def read_object(s3, bucket, key):
+    """
+    downloads an s3 object into memory.
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param bucket: bucket name
+    :param key: object key
+    :return: file-like object
+    """
+    return io.BytesIO(s3.Object(bucket, key).get()["Body"].read())
+
+
+def iter_unloaded(s3, url, batch_size=BATCH_SIZE, workers=4):
+    """
+    streams an unloaded extract as arrow record batches, downloading the next files while the
+    current one is read (at most workers files held in memory).
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param url: s3 url of the extract (as returned by unload)
+    :param batch_size: rows per record batch
+    :param workers: files downloaded in parallel
+    :return: generator of pyarrow record batches
+    """
+    require_pyarrow()
+
+    bucket, _ = parse_s3_url(url)
+    keys = deque(key for key, size in list_objects(s3, url, suffix="") if size > 0)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        downloads = deque()
+        while keys or downloads:
+            while keys and len(downloads) < workers:
+                downloads.append(executor.submit(read_object, s3, bucket, keys.popleft()))
+
+            parquet_file = pyarrow.parquet.ParquetFile(downloads.popleft().result())
+            for batch in parquet_file.iter_batches(batch_size=batch_size):
+                yield batch
+
+
+def delete_unloaded(s3, url):
+    """
+    deletes the files of an unloaded extract.
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param url: s3 url of the extract
+    :return: none
+    """
+    bucket, prefix = parse_s3_url(url)
+    s3.Bucket(bucket).objects.filter(Prefix=prefix).delete()
+
+
+def iter_extract(cur, s3, config, sql, batch_size=BATCH_SIZE, workers=4, keep=False):
+    """
+    streams a very large query result as pandas dataframes: unloaded in parallel to s3, then read
+    back file by file (see unload & iter_unloaded); the extract is deleted once read unless kept.
+    :param cur: postgres cursor
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param config: parsed dwh.cfg
+    :param sql: sql query
+    :param batch_size: rows per dataframe
+    :param workers: files downloaded in parallel
+    :param keep: keeps the extract in s3
+    :return: generator of pandas dataframes
+    """
+    url = unload(cur, config, sql)
+    try:
+        for batch in iter_unloaded(s3, url, batch_size, workers):
+            yield batch.to_pandas()
+    finally:
+        if not keep:
+            delete_unloaded(s3, url)
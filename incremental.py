@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import metrics
+from query_cache import bump_table_versions
+from aggregates import refresh_aggregates
+from manifest import parse_s3_url, list_objects, manifest_copy_queries
+from sql_queries import (truncate_staging_queries, staging_insert_queries, watermark_select, watermark_upsert,
+                         incremental_insert_table_steps)
+
+
+def get_watermark(cur, source):
+    """
+    gets watermark of a source: last s3 key (log_data) or modification time (song_data) loaded.
+    :param cur: postgres cursor
+    :param source: source name (log_data or song_data)
+    :return: watermark or none (nothing loaded yet)
+    """
+    cur.execute(watermark_select, (source,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(cur, source, watermark):
+    """
+    records watermark of a source (committed by caller).
+    :param cur: postgres cursor
+    :param source: source name (log_data or song_data)
+    :param watermark: s3 key (log_data) or iso modification time (song_data)
+    :return: none
+    """
+    cur.execute(watermark_upsert, {"source": source, "watermark": watermark, "updated_at": datetime.utcnow()})
+
+
+def list_new_objects(s3, url, source, watermark=None):
+    """
+    lists objects of a source added since its watermark:
+    - log_data: keys are date-named (log_data/2018/11/2018-11-01-events.json), so new files sort after
+      the last key loaded;
+    - song_data: keys are not chronological (song_data/A/B/C/TR...json), so new files are those modified at
+      or after the last modification time loaded (files at that time are loaded again: songs & artists are upserted).
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param url: s3 prefix url
+    :param source: log_data or song_data
+    :param watermark: last key (log_data) or iso modification time (song_data) loaded, none: everything
+    :return: list of (key, size) tuples, new watermark (none: no new objects)
+    """
+    if source == "log_data":
+        keys = list_objects(s3, url, start_after=watermark)
+        return keys, keys[-1][0] if keys else None
+
+    bucket, prefix = parse_s3_url(url)
+    try:
+        since = datetime.fromisoformat(watermark) if watermark else None
+    except ValueError:  # key watermark of an earlier version: every song is loaded (upserted) again
+        since = None
+    objects = [obj for obj in s3.Bucket(bucket).objects.filter(Prefix=prefix)
+               if obj.key.endswith(".json") and (since is None or obj.last_modified >= since)]
+    if not objects:
+        return [], None
+    return [(obj.key, obj.size) for obj in objects], max(obj.last_modified for obj in objects).isoformat()
+
+
+def source_watermarks(config, s3):
+    """
+    gets watermark of everything currently under each source (recorded by a full load, so the next
+    incremental run only loads what is added after it).
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :return: dict of source -> watermark
+    """
+    watermarks = {}
+    for source in ("log_data", "song_data"):
+        _, watermark = list_new_objects(s3, config.get("S3", source), source)
+        if watermark:
+            watermarks[source] = watermark
+    return watermarks
+
+
+def incremental_copy_queries(config, s3, cur):
+    """
+    lists objects added after each source watermark & builds the COPY (manifest) of the new ones.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param cur: postgres cursor
+    :return: list of COPY queries, dict of source -> new watermark
+    """
+    keys_by_source, watermarks = {}, {}
+    for source in ("log_data", "song_data"):
+        watermark = get_watermark(cur, source)
+        keys, new_watermark = list_new_objects(s3, config.get("S3", source), source, watermark)
+        print("\n{}: {} new files since {}".format(source, len(keys), watermark))
+        if keys:
+            keys_by_source[source] = (parse_s3_url(config.get("S3", source))[0], keys)
+            watermarks[source] = new_watermark
+
+    queries = manifest_copy_queries(config, s3, keys_by_source)
+    return queries, watermarks
+
+
+def load_incremental(config, s3, cur, conn):
+    """
+    loads only the s3 objects added since the last run & appends the new rows to the star schema.
+    inserts, aggregate refresh & watermarks are committed in one transaction, so a failed run is simply re-run.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource
+    :param cur: postgres cursor
+    :param conn: postgres connection
+    :return: dict of source -> new watermark
+    """
+    queries, watermarks = incremental_copy_queries(config, s3, cur)
+    if not watermarks:
+        print("\nno new data to load.")
+        return watermarks
+
+    for query in truncate_staging_queries + queries + staging_insert_queries:
+        print("\nexecuting: {}".format(query))
+        metrics.execute(cur, query)
+        conn.commit()
+    print("\nnew data loaded into staging tables.")
+
+    for step in incremental_insert_table_steps:
+        print("\nexecuting: {}".format(step["query"]))
+        metrics.execute(cur, step["query"])
+        bump_table_versions(cur, step["writes"])
+    refresh_aggregates(cur)
+    for source, watermark in watermarks.items():
+        set_watermark(cur, source, watermark)
+    conn.commit()
+    print("\nnew data inserted into analytics tables, watermarks: {}".format(watermarks))
+
+    return watermarks
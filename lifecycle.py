@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import configparser
+from datetime import datetime
+from time import sleep, perf_counter
+from botocore.exceptions import ClientError
+from clean_redshift import delete_redshift_cluster, check_cluster_delete
+from setup_cluster import (create_client, create_iam_role, config_parameter_group, wait_for_cluster, get_cluster,
+                           open_tcp_port, update_config, check_cluster_conn)
+
+
+def pause_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER):
+    """
+    pauses cluster (compute is not billed, data is kept).
+    :param redshift: redshift client
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :return: none
+    """
+
+    print("\npausing cluster {}...".format(DWH_CLUSTER_IDENTIFIER))
+    try:
+        redshift.pause_cluster(ClusterIdentifier=DWH_CLUSTER_IDENTIFIER)
+    except ClientError as err:
+        print("\nerror pausing cluster: {}".format(err))
+        return
+
+    wait_for_cluster(redshift, DWH_CLUSTER_IDENTIFIER, status='paused')
+
+
+def resume_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER):
+    """
+    resumes paused cluster.
+    :param redshift: redshift client
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :return: none
+    """
+
+    print("\nresuming cluster {}...".format(DWH_CLUSTER_IDENTIFIER))
+    try:
+        redshift.resume_cluster(ClusterIdentifier=DWH_CLUSTER_IDENTIFIER)
+    except ClientError as err:
+        print("\nerror resuming cluster: {}".format(err))
+
+
+def snapshot_identifier(DWH_CLUSTER_IDENTIFIER):
+    """
+    builds a new (timestamped) snapshot id, so a final snapshot never replaces the previous one.
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :return: snapshot id, e.g. dwhcluster-20210701-183000
+    """
+    return "{}-{}".format(DWH_CLUSTER_IDENTIFIER, datetime.utcnow().strftime("%Y%m%d-%H%M%S"))
+
+
+def wait_for_snapshot(redshift, DWH_SNAPSHOT_IDENTIFIER, timeout=3600, delay=5, max_delay=60):
+    """
+    polls snapshot status with adaptive backoff until it is no longer being created.
+    :param redshift: redshift client
+    :param DWH_SNAPSHOT_IDENTIFIER: snapshot id
+    :param timeout: total seconds before giving up
+    :param delay: first delay between polls (seconds)
+    :param max_delay: longest delay between polls (seconds)
+    :return: snapshot status (available, failed, ... or not found / timeout)
+    """
+
+    deadline = perf_counter() + timeout
+    while True:
+        try:
+            response = redshift.describe_cluster_snapshots(SnapshotIdentifier=DWH_SNAPSHOT_IDENTIFIER)
+        except ClientError as err:
+            if 'ClusterSnapshotNotFound' not in str(err):
+                raise
+            status = 'not found'
+        else:
+            status = response['Snapshots'][0]['Status']
+            if status != 'creating':
+                return status
+
+        if perf_counter() + delay > deadline:
+            return 'timeout ({})'.format(status)
+
+        print("\nsnapshot {} is {}, wait {}s...".format(DWH_SNAPSHOT_IDENTIFIER, status, delay))
+        sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def delete_snapshot(redshift, DWH_SNAPSHOT_IDENTIFIER):
+    """
+    deletes snapshot (once a newer one is available).
+    :param redshift: redshift client
+    :param DWH_SNAPSHOT_IDENTIFIER: config parameter
+    :return: none
+    """
+
+    try:
+        redshift.delete_cluster_snapshot(SnapshotIdentifier=DWH_SNAPSHOT_IDENTIFIER)
+        print("\nprevious snapshot {} deleted.".format(DWH_SNAPSHOT_IDENTIFIER))
+    except ClientError as err:
+        if 'ClusterSnapshotNotFound' not in str(err):
+            print("\nerror deleting snapshot: {}".format(err))
+
+
+def restore_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER, DWH_SNAPSHOT_IDENTIFIER,
+                             DWH_NODE_TYPE, DWH_NUM_NODES, DWH_PORT, IAM_ROLE_ARN, DWH_PARAMETER_GROUP=None):
+    """
+    launches cluster from snapshot (tables & data as when it was taken, no reload needed), with the parameter
+    group of a new cluster (snapshots do not keep it: the default group would have a single WLM queue).
+    :param redshift: redshift client
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :param DWH_SNAPSHOT_IDENTIFIER: config parameter
+    :param DWH_NODE_TYPE: config parameter
+    :param DWH_NUM_NODES: config parameter
+    :param DWH_PORT: config parameter
+    :param IAM_ROLE_ARN: role_arn object (from func create_iam_role)
+    :param DWH_PARAMETER_GROUP: parameter group name (from func setup_cluster.config_parameter_group),
+                                none: default parameter group
+    :return: cluster info/section
+    """
+
+    # default parameter group (single WLM queue) unless one is given, as setup_cluster.create_redshift_cluster
+    parameter_group = {'ClusterParameterGroupName': DWH_PARAMETER_GROUP} if DWH_PARAMETER_GROUP else {}
+
+    print("\nrestoring cluster from snapshot {}...".format(DWH_SNAPSHOT_IDENTIFIER))
+    try:
+        response = redshift.restore_from_cluster_snapshot(
+            ClusterIdentifier=DWH_CLUSTER_IDENTIFIER,
+            SnapshotIdentifier=DWH_SNAPSHOT_IDENTIFIER,
+            NodeType=DWH_NODE_TYPE,
+            NumberOfNodes=int(DWH_NUM_NODES),
+            Port=int(DWH_PORT),
+            IamRoles=[IAM_ROLE_ARN],
+            **parameter_group
+        )
+    except ClientError as err:
+        print("\nexception restoring cluster, error: {}".format(err))
+        return None
+
+    else:
+        return response['Cluster']
+
+
+def teardown(config, redshift, DWH_CLUSTER_IDENTIFIER, DWH_SNAPSHOT_IDENTIFIER):
+    """
+    deletes cluster after a final snapshot under a new id; only once it is available, the id is written
+    in dwh.cfg (restore uses it) & the previous snapshot is deleted.
+    :param config: parsed dwh.cfg
+    :param redshift: redshift client
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :param DWH_SNAPSHOT_IDENTIFIER: config parameter (previous snapshot)
+    :return: snapshot status
+    """
+    new_snapshot = snapshot_identifier(DWH_CLUSTER_IDENTIFIER)
+    if delete_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER, new_snapshot) is None:
+        print("\ncluster not deleted, snapshot {} kept.".format(DWH_SNAPSHOT_IDENTIFIER))
+        return None
+
+    status = wait_for_snapshot(redshift, new_snapshot)
+    if status != 'available':
+        print("\nsnapshot {} is {}: previous snapshot {} kept.".format(new_snapshot, status, DWH_SNAPSHOT_IDENTIFIER))
+        return status
+
+    config.set("CLUSTER", "DWH_SNAPSHOT_IDENTIFIER", new_snapshot)
+    with open("dwh.cfg", 'w') as configfile:
+        config.write(configfile)
+    print("\nsnapshot {} taken (DWH_SNAPSHOT_IDENTIFIER updated in configuration file).".format(new_snapshot))
+
+    if DWH_SNAPSHOT_IDENTIFIER and DWH_SNAPSHOT_IDENTIFIER != new_snapshot:
+        delete_snapshot(redshift, DWH_SNAPSHOT_IDENTIFIER)
+
+    check_cluster_delete(redshift, DWH_CLUSTER_IDENTIFIER)
+    return status
+
+
+def lifecycle(command):
+    # gets parameters from config file dwh.cfg
+    config = configparser.ConfigParser()
+    config.read_file(open("dwh.cfg"))
+
+    #####
+    # pair of individual access keys
+    AWS_KEY                 = config.get("AWS", "AWS_KEY")
+    AWS_SECRET              = config.get("AWS", "AWS_SECRET")
+
+    # config dwh parameters
+    DWH_NUM_NODES           = config.get("CLUSTER", "DWH_NUM_NODES")
+    DWH_NODE_TYPE           = config.get("CLUSTER", "DWH_NODE_TYPE")
+    DWH_REGION              = config.get("CLUSTER", "DWH_REGION")
+    DWH_CLUSTER_IDENTIFIER  = config.get("CLUSTER", "DWH_CLUSTER_IDENTIFIER")
+    DWH_IAM_ROLE_NAME       = config.get("CLUSTER", "DWH_IAM_ROLE_NAME")
+    DWH_PORT                = config.get("CLUSTER", "DWH_PORT")
+    DWH_SNAPSHOT_IDENTIFIER = config.get("CLUSTER", "DWH_SNAPSHOT_IDENTIFIER")
+    #####
+
+
+    ec2, s3, iam, redshift = create_client(DWH_REGION, AWS_KEY, AWS_SECRET)
+
+    if command == "pause":
+        pause_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER)
+        return
+
+    if command == "teardown":
+        # iam role is kept: restore needs it
+        teardown(config, redshift, DWH_CLUSTER_IDENTIFIER, DWH_SNAPSHOT_IDENTIFIER)
+        return
+
+    if command == "resume":
+        resume_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER)
+
+    elif command == "restore":
+        role_arn = create_iam_role(iam, DWH_IAM_ROLE_NAME)
+        restore_redshift_cluster(redshift, DWH_CLUSTER_IDENTIFIER, DWH_SNAPSHOT_IDENTIFIER,
+                                 DWH_NODE_TYPE, DWH_NUM_NODES, DWH_PORT, role_arn,
+                                 config_parameter_group(redshift, config))
+
+    cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN = get_cluster(redshift, DWH_CLUSTER_IDENTIFIER)
+
+    IAM_SG = open_tcp_port(ec2, cluster_info, DWH_PORT)
+
+    update_config(config, DWH_ENDPOINT, IAM_ROLE_ARN, IAM_SG)
+
+    check_cluster_conn(config, DWH_ENDPOINT)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="pauses/resumes the cluster or tears it down to a snapshot & restores it")
+    parser.add_argument("command", choices=["pause", "resume", "teardown", "restore"])
+    args = parser.parse_args()
+
+    lifecycle(args.command)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import configparser
+from time import perf_counter
+import psycopg2.extensions
+import db
+import metrics
+from sql_queries import table_health_select
+
+
+def table_health(cur):
+    """
+    gets health of each table from svv_table_info.
+    :param cur: postgres cursor
+    :return: list of dicts with table, unsorted, stats_off & deleted (percentages) & rows
+    """
+    cur.execute(table_health_select)
+    tables = []
+    for table, unsorted, stats_off, tbl_rows, visible_rows in cur.fetchall():
+        deleted = 100.0 * (tbl_rows - visible_rows) / tbl_rows if tbl_rows and visible_rows is not None else 0.0
+        tables.append({"table": table, "unsorted": float(unsorted or 0), "stats_off": float(stats_off or 0),
+                       "deleted": max(deleted, 0.0), "rows": tbl_rows or 0})
+    return tables
+
+
+def plan_maintenance(tables, unsorted_pct=10, deleted_pct=10, stats_off_pct=10, min_rows=10000):
+    """
+    picks the maintenance each table needs (tables over a threshold only), worst first:
+    VACUUM DELETE ONLY (deleted rows), VACUUM SORT ONLY (unsorted rows), VACUUM FULL (both),
+    ANALYZE PREDICATE COLUMNS (stale statistics).
+    :param tables: table health (table_health)
+    :param unsorted_pct: unsorted rows above which a table is sorted
+    :param deleted_pct: deleted rows above which space is reclaimed
+    :param stats_off_pct: stale statistics above which a table is analyzed
+    :param min_rows: smaller tables are left alone
+    :return: list of (priority, table, sql statement, reason) tuples
+    """
+    actions = []
+    for health in tables:
+        if health["rows"] < min_rows:
+            continue
+        table = health["table"]
+
+        sort, delete = health["unsorted"] > unsorted_pct, health["deleted"] > deleted_pct
+        if sort or delete:
+            mode = "FULL" if sort and delete else "SORT ONLY" if sort else "DELETE ONLY"
+            worst = max(health["unsorted"] if sort else 0, health["deleted"] if delete else 0)
+            actions.append((worst * health["rows"], table, "VACUUM {} {};".format(mode, table),
+                            "unsorted {:.1f}%, deleted {:.1f}%".format(health["unsorted"], health["deleted"])))
+
+        if health["stats_off"] > stats_off_pct:
+            actions.append((health["stats_off"] * health["rows"], table,
+                            "ANALYZE {} PREDICATE COLUMNS;".format(table),
+                            "stats off {:.1f}%".format(health["stats_off"])))
+
+    return sorted(actions, key=lambda action: action[0], reverse=True)
+
+
+def run_maintenance(cur, actions, time_budget=1800):
+    """
+    runs maintenance statements in order within the time budget: each one runs with the remaining budget
+    as statement timeout; once a statement is cancelled by it (or the budget is spent), the remaining
+    ones are skipped.
+    :param cur: postgres cursor (autocommit: VACUUM cannot run in a transaction)
+    :param actions: planned actions (plan_maintenance)
+    :param time_budget: seconds
+    :return: list of dicts with table, statement, reason, status & elapsed seconds
+    """
+    start = perf_counter()
+    report = []
+    over_budget = False
+    for _, table, query, reason in actions:
+        remaining = time_budget - (perf_counter() - start)
+        if over_budget or remaining < 1:  # under a second: a statement timeout of 0 would mean none
+            report.append({"table": table, "statement": query, "reason": reason, "status": "skipped (budget)",
+                           "elapsed": 0.0})
+            continue
+
+        print("\nexecuting: {} ({})".format(query, reason))
+        db.set_statement_timeout(cur.connection, remaining)
+        statement_start = perf_counter()
+        try:
+            metric = metrics.execute(cur, query)
+        except psycopg2.extensions.QueryCanceledError:
+            over_budget = True
+            report.append({"table": table, "statement": query, "reason": reason, "status": "cancelled (budget)",
+                           "elapsed": perf_counter() - statement_start})
+            continue
+        report.append({"table": table, "statement": query, "reason": reason, "status": "done",
+                       "elapsed": metric["elapsed"]})
+    return report
+
+
+def maintain(config):
+    """
+    vacuums & analyzes the tables whose health is over the [MAINTENANCE] thresholds of dwh.cfg,
+    within its time budget, & prints what ran & how long it took (in the etl WLM queue).
+    :param config: parsed dwh.cfg
+    :return: report (run_maintenance)
+    """
+    conn = db.connect(config, config.get("WLM", "ETL_QUERY_GROUP", fallback="etl"))
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        actions = plan_maintenance(table_health(cur),
+                                   unsorted_pct=config.getfloat("MAINTENANCE", "UNSORTED_PCT", fallback=10),
+                                   deleted_pct=config.getfloat("MAINTENANCE", "DELETED_PCT", fallback=10),
+                                   stats_off_pct=config.getfloat("MAINTENANCE", "STATS_OFF_PCT", fallback=10),
+                                   min_rows=config.getint("MAINTENANCE", "MIN_ROWS", fallback=10000))
+        report = run_maintenance(cur, actions, config.getint("MAINTENANCE", "TIME_BUDGET", fallback=1800))
+    finally:
+        conn.close()
+
+    print("\nmaintenance:" if report else "\nmaintenance: every table is healthy.")
+    for step in report:
+        print("{:>8.2f}s  {:<18} {} ({})".format(step["elapsed"], step["status"], step["statement"], step["reason"]))
+    return report
+
+
+if __name__ == "__main__":
+    config = configparser.ConfigParser()
+    config.read_file(open("dwh.cfg"))
+
+    # per-statement metrics (json lines) to trend etl performance across runs
+    metrics.configure(config.get("ETL", "METRICS_FILE", fallback=None))
+
+    maintain(config)
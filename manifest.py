@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+from sql_queries import staging_events_copy_template, staging_songs_copy_template
+
+
+# slices per node for each redshift node type
+# ref: https://docs.aws.amazon.com/redshift/latest/mgmt/working-with-clusters.html#rs-node-type-info
+NODE_SLICES = {
+    "dc2.large": 2,
+    "dc2.8xlarge": 16,
+    "ds2.xlarge": 2,
+    "ds2.8xlarge": 16,
+    "ra3.xlplus": 2,
+    "ra3.4xlarge": 4,
+    "ra3.16xlarge": 16,
+}
+
+
+def get_slice_count(DWH_NODE_TYPE, DWH_NUM_NODES):
+    """
+    gets number of slices of the cluster (files are loaded in parallel, one per slice).
+    :param DWH_NODE_TYPE: config parameter
+    :param DWH_NUM_NODES: config parameter
+    :return: number of slices
+    """
+    return NODE_SLICES.get(DWH_NODE_TYPE.lower(), 2) * int(DWH_NUM_NODES)
+
+
+def parse_s3_url(url):
+    """
+    splits s3 url (as written in dwh.cfg, quotes allowed) into bucket & key prefix.
+    :param url: e.g. 's3://udacity-dend/log_data'
+    :return: bucket name, key prefix
+    """
+    url = url.strip().strip("'\"")
+    if not url.startswith("s3://"):
+        raise ValueError("not an s3 url: {}".format(url))
+    bucket, _, prefix = url[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def list_objects(s3, url, start_after=None, suffix=".json"):
+    """
+    lists objects under s3 prefix in key order, optionally only those after a given key.
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param url: s3 prefix url
+    :param start_after: key to start after (exclusive)
+    :param suffix: keeps only keys ending with it
+    :return: list of (key, size) tuples
+    """
+    bucket, prefix = parse_s3_url(url)
+    params = {"Prefix": prefix}
+    if start_after:
+        params["Marker"] = start_after
+
+    return [(obj.key, obj.size) for obj in s3.Bucket(bucket).objects.filter(**params)
+            if obj.key.endswith(suffix)]
+
+
+def balance_keys(keys, n_buckets):
+    """
+    groups objects into buckets of about the same total size (largest files first, each one
+    into the lightest bucket).
+    :param keys: list of (key, size) tuples
+    :param n_buckets: number of buckets (slices)
+    :return: list of buckets, each one a list of (key, size) tuples
+    """
+    buckets = [[] for _ in range(max(1, n_buckets))]
+    sizes = [0] * len(buckets)
+    for key, size in sorted(keys, key=lambda item: item[1], reverse=True):
+        i = sizes.index(min(sizes))
+        buckets[i].append((key, size))
+        sizes[i] += size
+    return buckets
+
+
+def interleave(buckets):
+    """
+    orders objects taking one from each bucket in turn, so large & small files are spread evenly
+    over the manifest. redshift does not guarantee which slice loads which entry: this only balances
+    file sizes across the manifest, it does not assign files to slices.
+    :param buckets: list of buckets (from balance_keys)
+    :return: list of (key, size) tuples
+    """
+    keys = []
+    for i in range(max(len(bucket) for bucket in buckets)):
+        keys.extend(bucket[i] for bucket in buckets if i < len(bucket))
+    return keys
+
+
+def write_manifest(s3, bucket, keys, url):
+    """
+    writes a COPY manifest listing the given objects.
+    :param s3: s3 resource
+    :param bucket: bucket of the listed objects
+    :param keys: list of (key, size) tuples
+    :param url: s3 url of the manifest file
+    :return: manifest url (quoted, ready for COPY)
+    """
+    manifest = {"entries": [
+        {"url": "s3://{}/{}".format(bucket, key), "mandatory": True, "meta": {"content_length": size}}
+        for key, size in keys
+    ]}
+    manifest_bucket, manifest_key = parse_s3_url(url)
+    s3.Object(manifest_bucket, manifest_key).put(Body=json.dumps(manifest).encode("utf-8"))
+    print("\nmanifest with {} files written: s3://{}/{}".format(len(keys), manifest_bucket, manifest_key))
+
+    return "'s3://{}/{}'".format(manifest_bucket, manifest_key)
+
+
+def manifest_copy_queries(config, s3, keys_by_source, options=""):
+    """
+    writes a manifest for each source (file sizes balanced across it, see interleave) & builds its COPY
+    in MANIFEST mode.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource (from setup_cluster.create_client)
+    :param keys_by_source: dict of source (log_data or song_data) -> (bucket, list of (key, size) tuples)
+    :param options: extra COPY options (e.g. GZIP for compacted files)
+    :return: list of COPY queries
+    """
+    templates = {
+        "log_data": (staging_events_copy_template, {"jsonpath": config.get("S3", "LOG_JSONPATH")}),
+        "song_data": (staging_songs_copy_template, {}),
+    }
+    num_slices = get_slice_count(config.get("CLUSTER", "DWH_NODE_TYPE"), config.get("CLUSTER", "DWH_NUM_NODES"))
+
+    queries = []
+    for source, (bucket, keys) in keys_by_source.items():
+        template, params = templates[source]
+        manifest_url = "{}/{}.manifest".format(config.get("S3", "MANIFEST_PREFIX").strip("'\""), source)
+        keys = interleave(balance_keys(keys, num_slices))
+        queries.append(template.format(
+            source=write_manifest(s3, bucket, keys, manifest_url),
+            role_arn=config.get("IAM_ROLE", "IAM_ROLE_ARN"),
+            region=config.get("CLUSTER", "DWH_REGION"),
+            options="\nMANIFEST" + options,
+            **params))
+
+    return queries
+
+
+def full_copy_queries(config, s3):
+    """
+    lists every object of both sources & builds their COPYs in MANIFEST mode.
+    :param config: parsed dwh.cfg
+    :param s3: s3 resource
+    :return: list of COPY queries (same order as sql_queries.copy_table_queries)
+    """
+    keys_by_source = {}
+    for source in ("log_data", "song_data"):
+        url = config.get("S3", source)
+        keys_by_source[source] = (parse_s3_url(url)[0], list_objects(s3, url))
+    return manifest_copy_queries(config, s3, keys_by_source)
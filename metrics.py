@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import re
+import threading
+import uuid
+from datetime import datetime
+from time import perf_counter
+
+
+# where statement metrics are appended (json lines), set by configure()
+METRICS_FILE = None
+RUN_ID = None
+
+_lock = threading.Lock()
+
+# redshift reports the postgres version it was forked from (8.0.2)
+REDSHIFT_SERVER_VERSION = 80002
+
+load_stats_query = ("""
+SELECT COUNT(*) AS files, SUM(lines_scanned) AS lines_scanned
+FROM stl_load_commits
+WHERE query = %s;
+""")
+
+query_summary_query = ("""
+SELECT MAX(maxtime) AS max_step_time, SUM(rows) AS rows, SUM(bytes) AS bytes,
+       MAX(workmem) AS max_workmem, BOOL_OR(is_diskbased = 't') AS is_diskbased
+FROM svl_query_summary
+WHERE query = %s;
+""")
+
+
+def configure(path, run_id=None):
+    """
+    sets file that statement metrics are appended to.
+    :param path: json lines file (none: metrics are not recorded)
+    :param run_id: id shared by every statement of the run (default: new uuid)
+    :return: run id
+    """
+    global METRICS_FILE, RUN_ID
+    METRICS_FILE = path
+    RUN_ID = run_id or uuid.uuid4().hex
+    return RUN_ID
+
+
+def statement_label(query):
+    """
+    gets short label of a statement, e.g. 'COPY staging_events'.
+    :param query: sql statement
+    :return: label
+    """
+    match = re.search(r"(INSERT INTO|COPY|DROP TABLE IF EXISTS|CREATE TABLE IF NOT EXISTS|DELETE FROM|UPDATE|TRUNCATE)"
+                      r"\s+(\w+)", query, re.I)
+    return "{} {}".format(match.group(1).upper(), match.group(2)) if match else query.strip().split("\n")[0][:60]
+
+
+def redshift_stats(cur, query_id, is_copy):
+    """
+    gets load & execution stats of a statement from redshift system tables.
+    :param cur: postgres cursor
+    :param query_id: query id (pg_last_query_id)
+    :param is_copy: statement is a COPY (stl_load_commits stats)
+    :return: dict of stats
+    """
+    stats = {}
+    if is_copy:
+        cur.execute(load_stats_query, (query_id,))
+        stats.update(zip(("files", "lines_scanned"), cur.fetchone()))
+    cur.execute(query_summary_query, (query_id,))
+    stats.update(zip(("max_step_time", "rows", "bytes", "max_workmem", "is_diskbased"), cur.fetchone()))
+    return stats
+
+
+def record(metric):
+    """
+    appends a metric as one json line to METRICS_FILE.
+    :param metric: dict
+    :return: none
+    """
+    if METRICS_FILE is None:
+        return
+    with _lock, open(METRICS_FILE, "a") as metrics_file:
+        metrics_file.write(json.dumps(metric, default=str) + "\n")
+
+
+def execute(cur, query, params=None):
+    """
+    executes a statement & records its wall time, rows affected, query id &, on redshift,
+    the matching stl_load_commits / svl_query_summary stats.
+    :param cur: postgres cursor
+    :param query: sql statement
+    :param params: query parameters
+    :return: dict of metrics
+    """
+    start = perf_counter()
+    cur.execute(query, params)
+    metric = {
+        "run_id": RUN_ID,
+        "timestamp": datetime.utcnow().isoformat(),
+        "statement": statement_label(query),
+        "elapsed": perf_counter() - start,
+        "rows": cur.rowcount,
+    }
+
+    if METRICS_FILE is not None and cur.connection.server_version == REDSHIFT_SERVER_VERSION:
+        cur.execute("SELECT pg_last_query_id();")
+        metric["query_id"] = cur.fetchone()[0]
+        metric.update(redshift_stats(cur, metric["query_id"], query.lstrip().upper().startswith("COPY")))
+
+    record(metric)
+    return metric
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pickle
+import re
+import threading
+from datetime import datetime
+from time import time
+from sql_queries import table_version_upsert, table_version_select
+
+
+def bump_table_versions(cur, tables):
+    """
+    records that tables got new data (committed by caller, with the data): cached results reading them
+    are not used anymore.
+    :param cur: postgres cursor
+    :param tables: table names
+    :return: none
+    """
+    loaded_at = datetime.utcnow()
+    for table in tables:
+        cur.execute(table_version_upsert, {"table_name": table, "loaded_at": loaded_at})
+
+
+def normalize_sql(sql):
+    """
+    normalizes query text so equivalent queries share a cache entry: whitespace collapsed, trailing ';'
+    removed & lower case outside quoted strings.
+    :param sql: sql query
+    :return: normalized sql
+    """
+    parts = re.split(r"('(?:[^']|'')*')", sql.strip().rstrip(";").strip())
+    return "".join(part if part.startswith("'") else re.sub(r"\s+", " ", part.lower()) for part in parts)
+
+
+def referenced_tables(sql):
+    """
+    gets table names a query reads (after FROM / JOIN).
+    :param sql: normalized sql query
+    :return: sorted list of table names
+    """
+    return sorted(set(re.findall(r"\b(?:from|join)\s+([a-z_][a-z0-9_]*)", sql)))
+
+
+class QueryCache:
+    """
+    client-side, on-disk cache of query results keyed by normalized sql & the load version of each
+    table the query reads; least recently used results are evicted above max_bytes.
+    usage (notebook or python):
+        cache = QueryCache(".query_cache")
+        columns, rows = cache.fetchall(cur, "SELECT ...")
+    """
+
+    def __init__(self, directory=".query_cache", max_bytes=512 * 1024 * 1024, version_ttl=0):
+        """
+        :param directory: where results are stored
+        :param max_bytes: total size of stored results
+        :param version_ttl: seconds table versions are reused before reading them again from the cluster
+                            (0: read on every lookup, so no result older than the last load is served)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._versions = None
+        self._versions_read_at = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def table_versions(self, cur):
+        """
+        gets load version of each table (etl_table_versions), read again once version_ttl seconds are over.
+        :param cur: postgres cursor
+        :return: dict of table -> loaded_at
+        """
+        if self._versions is None or time() - self._versions_read_at >= self.version_ttl:
+            cur.execute(table_version_select)
+            self._versions = {table: str(loaded_at) for table, loaded_at in cur.fetchall()}
+            self._versions_read_at = time()
+        return self._versions
+
+    def key(self, cur, sql, params=None):
+        """
+        builds cache key of a query.
+        :param cur: postgres cursor
+        :param sql: sql query
+        :param params: query parameters
+        :return: hex digest
+        """
+        normalized = normalize_sql(sql)
+        versions = self.table_versions(cur)
+        tables = ["{}={}".format(table, versions.get(table)) for table in referenced_tables(normalized)]
+        return hashlib.sha256(repr((normalized, params, tables)).encode("utf-8")).hexdigest()
+
+    def fetchall(self, cur, sql, params=None):
+        """
+        gets query result from the cache, or runs the query & stores its result.
+        :param cur: postgres cursor
+        :param sql: sql query
+        :param params: query parameters
+        :return: list of column names, list of rows
+        """
+        path = os.path.join(self.directory, self.key(cur, sql, params) + ".pkl")
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)  # most recently used
+                with open(path, "rb") as cached:
+                    return pickle.load(cached)
+
+        cur.execute(sql, params)
+        result = ([column[0] for column in cur.description], cur.fetchall())
+
+        with self._lock:
+            with open(path, "wb") as cached:
+                pickle.dump(result, cached, protocol=pickle.HIGHEST_PROTOCOL)
+            self.evict()
+        return result
+
+    def dataframe(self, cur, sql, params=None):
+        """
+        gets query result as pandas dataframe (cached).
+        :param cur: postgres cursor
+        :param sql: sql query
+        :param params: query parameters
+        :return: pandas dataframe
+        """
+        import pandas
+
+        columns, rows = self.fetchall(cur, sql, params)
+        return pandas.DataFrame.from_records(rows, columns=columns)
+
+    def evict(self):
+        """
+        removes least recently used results until stored results fit in max_bytes.
+        :return: none
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        """
+        removes every stored result.
+        :return: none
+        """
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.directory, name))
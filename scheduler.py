@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import perf_counter
+
+
+def build_dependencies(steps):
+    """
+    finds the steps each step has to wait for, using the tables they read & write.
+    a step depends on an earlier one (list order) if one of them writes a table the other reads or writes.
+    :param steps: list of dicts with name, query, reads & writes
+    :return: dict of step name -> set of step names it depends on
+    """
+    deps = {}
+    for i, step in enumerate(steps):
+        reads, writes = set(step["reads"]), set(step["writes"])
+        deps[step["name"]] = {
+            prev["name"] for prev in steps[:i]
+            if set(prev["writes"]) & (reads | writes) or set(prev["reads"]) & writes
+        }
+    return deps
+
+
+def critical_path(steps, deps, durations):
+    """
+    finds the chain of dependent steps with the longest total duration (bounds the run time).
+    :param steps: list of dicts with name, query, reads & writes
+    :param deps: dict of step name -> set of step names it depends on
+    :param durations: dict of step name -> elapsed seconds
+    :return: (list of step names, total seconds)
+    """
+    finish, previous = {}, {}
+    for step in steps:
+        name = step["name"]
+        before = max(deps[name], key=lambda dep: finish[dep], default=None)
+        previous[name] = before
+        finish[name] = durations[name] + (finish[before] if before else 0.0)
+
+    name = max(finish, key=finish.get)
+    total = finish[name]
+    path = []
+    while name:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], total
+
+
+def run_dag(steps, run, max_workers):
+    """
+    runs steps across a worker pool as soon as the steps they depend on are done.
+    stops at the first error: steps submitted but not started yet are cancelled, no further step is started
+    & the error is raised (steps already running are left to the caller, e.g. to cancel their statements).
+    :param steps: list of dicts with name, query, reads & writes
+    :param run: function called with a step
+    :param max_workers: degree of parallelism
+    :return: dict of step name -> elapsed seconds
+    """
+    deps = build_dependencies(steps)
+    pending = list(steps)
+    done, durations, running = set(), {}, {}
+
+    def timed(step):
+        start = perf_counter()
+        run(step)
+        return perf_counter() - start
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or running:
+            for step in [s for s in pending if deps[s["name"]] <= done]:
+                pending.remove(step)
+                running[executor.submit(timed, step)] = step
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                if future.exception() is not None:
+                    for queued in running:
+                        queued.cancel()  # only futures not started yet are cancelled
+                    raise future.exception()
+                durations[step["name"]] = future.result()
+                done.add(step["name"])
+    finally:
+        executor.shutdown(wait=not running)
+
+    path, total = critical_path(steps, deps, durations)
+    for step in steps:
+        print("\n{:.2f}s: {}".format(durations[step["name"]], step["name"]))
+    print("\ncritical path ({:.2f}s): {}".format(total, " -> ".join(path)))
+
+    return durations
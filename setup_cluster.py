@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
 import configparser
 import json
 import boto3  # AWS SDK (python): allows apps to interact with AWS services.
 from botocore.exceptions import ClientError
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, perf_counter
 from pprint import pprint
-import psycopg2
+import db
 import sys
 
 
@@ -107,10 +109,97 @@ def create_iam_role(iam, DWH_IAM_ROLE_NAME):
         print("\nexception attaching policy: {}".format(e))
 
 
+def wlm_configuration(ETL_QUERY_GROUP, ETL_MEMORY_PCT, ETL_CONCURRENCY, ANALYTICS_MEMORY_PCT,
+                      ANALYTICS_CONCURRENCY, SHORT_QUERY_ACCELERATION, MAX_SQA_RUNTIME=0):
+    """
+    builds manual WLM configuration: an ETL queue (statements run with query_group ETL_QUERY_GROUP),
+    the default queue for analytics & optionally short query acceleration.
+    :param ETL_QUERY_GROUP: query group routed to the ETL queue
+    :param ETL_MEMORY_PCT: memory percentage of the ETL queue
+    :param ETL_CONCURRENCY: slots of the ETL queue
+    :param ANALYTICS_MEMORY_PCT: memory percentage of the analytics (default) queue
+    :param ANALYTICS_CONCURRENCY: slots of the analytics queue
+    :param SHORT_QUERY_ACCELERATION: short queries run in their own queue
+    :param MAX_SQA_RUNTIME: seconds a short query may run (0: set by redshift)
+    :return: list of queues (wlm_json_configuration)
+    """
+    if int(ETL_MEMORY_PCT) + int(ANALYTICS_MEMORY_PCT) > 100:
+        raise ValueError("WLM memory percentages add up to more than 100")
+
+    queues = [
+        {"name": "etl", "query_group": [ETL_QUERY_GROUP], "query_group_wild_card": 0, "user_group": [],
+         "query_concurrency": int(ETL_CONCURRENCY), "memory_percent_to_use": int(ETL_MEMORY_PCT)},
+        {"name": "analytics", "query_group": [], "user_group": [],
+         "query_concurrency": int(ANALYTICS_CONCURRENCY), "memory_percent_to_use": int(ANALYTICS_MEMORY_PCT)},
+    ]
+    if SHORT_QUERY_ACCELERATION:
+        short_queries = {"short_query_queue": True}
+        if int(MAX_SQA_RUNTIME):
+            short_queries["max_execution_time"] = int(MAX_SQA_RUNTIME) * 1000
+        queues.append(short_queries)
+    return queues
+
+
+def create_parameter_group(redshift, DWH_PARAMETER_GROUP, wlm_config):
+    """
+    creates (or updates) cluster parameter group with given WLM configuration.
+    :param redshift: redshift client
+    :param DWH_PARAMETER_GROUP: parameter group name
+    :param wlm_config: list of queues (from func wlm_configuration)
+    :return: parameter group name (none on error)
+    """
+
+    print("\ncreating parameter group {}...".format(DWH_PARAMETER_GROUP))
+    try:
+        redshift.create_cluster_parameter_group(
+            ParameterGroupName=DWH_PARAMETER_GROUP,
+            ParameterGroupFamily='redshift-1.0',
+            Description="sparkify WLM: etl & analytics queues"
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ClusterParameterGroupAlreadyExists':
+            print("\nexception creating parameter group, error: {}".format(err))
+            return None
+
+    try:
+        redshift.modify_cluster_parameter_group(
+            ParameterGroupName=DWH_PARAMETER_GROUP,
+            Parameters=[{'ParameterName': 'wlm_json_configuration',
+                         'ParameterValue': json.dumps(wlm_config),
+                         'ApplyType': 'static'}]
+        )
+    except ClientError as err:
+        print("\nexception setting WLM configuration, error: {}".format(err))
+        return None
+
+    return DWH_PARAMETER_GROUP
+
+
+def config_parameter_group(redshift, config):
+    """
+    creates (or updates) the parameter group of [WLM] in dwh.cfg, with separate etl & analytics queues.
+    :param redshift: redshift client
+    :param config: parsed dwh.cfg
+    :return: parameter group name (empty: default parameter group, none on error)
+    """
+    DWH_PARAMETER_GROUP = config.get("WLM", "PARAMETER_GROUP", fallback="")
+    if not DWH_PARAMETER_GROUP:
+        return DWH_PARAMETER_GROUP
+
+    return create_parameter_group(redshift, DWH_PARAMETER_GROUP, wlm_configuration(
+        config.get("WLM", "ETL_QUERY_GROUP", fallback="etl"),
+        config.getint("WLM", "ETL_MEMORY_PCT"),
+        config.getint("WLM", "ETL_CONCURRENCY"),
+        config.getint("WLM", "ANALYTICS_MEMORY_PCT"),
+        config.getint("WLM", "ANALYTICS_CONCURRENCY"),
+        config.getboolean("WLM", "SHORT_QUERY_ACCELERATION", fallback=True),
+        config.getint("WLM", "MAX_SQA_RUNTIME", fallback=0)))
+
+
 def create_redshift_cluster(redshift,
                             DWH_CLUSTER_IDENTIFIER, DWH_CLUSTER_TYPE, DWH_NODE_TYPE, DWH_NUM_NODES,
                             DWH_DB_NAME, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT,
-                            IAM_ROLE_ARN):
+                            IAM_ROLE_ARN, DWH_PARAMETER_GROUP=None):
     """
     launchs Redshift cluster with given config parameters (cfg file).
     :param redshift: redshift client
@@ -123,9 +212,13 @@ def create_redshift_cluster(redshift,
     :param DWH_DB_PASSWORD: config parameter
     :param DWH_PORT: config parameter
     :param IAM_ROLE_ARN: role_arn object (from func create_iam_role)
+    :param DWH_PARAMETER_GROUP: parameter group (from func create_parameter_group; none: default group)
     :return: cluster info/section
     """
 
+    # default parameter group (single WLM queue) unless one is given
+    parameter_group = {'ClusterParameterGroupName': DWH_PARAMETER_GROUP} if DWH_PARAMETER_GROUP else {}
+
     print("\ncreating cluster...")
     try:
         response = redshift.create_cluster(
@@ -141,7 +234,8 @@ def create_redshift_cluster(redshift,
             MasterUserPassword=DWH_DB_PASSWORD,
             Port=int(DWH_PORT),
 
-            IamRoles=[IAM_ROLE_ARN]
+            IamRoles=[IAM_ROLE_ARN],
+            **parameter_group
             )
 
     except ClientError as err:
@@ -152,25 +246,45 @@ def create_redshift_cluster(redshift,
         return response['Cluster']
 
 
-def get_cluster(redshift, DWH_CLUSTER_IDENTIFIER):
+def wait_for_cluster(redshift, DWH_CLUSTER_IDENTIFIER, status='available', timeout=1800, delay=5, max_delay=60):
     """
-    checks cluster status & gets info (important: HOST & ARN).
-    :param redshift:
-    :param DWH_CLUSTER_IDENTIFIER:
-    :return: cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN
+    polls cluster status with adaptive backoff (delay doubles up to max_delay) until it reaches status.
+    :param redshift: redshift client
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :param status: cluster status waited for
+    :param timeout: total seconds before giving up
+    :param delay: first delay between polls (seconds)
+    :param max_delay: longest delay between polls (seconds)
+    :return: cluster info/section
     """
 
+    deadline = perf_counter() + timeout
     while True:
         response = redshift.describe_clusters(
             ClusterIdentifier=DWH_CLUSTER_IDENTIFIER)
 
         cluster_info = response['Clusters'][0]
-        if cluster_info['ClusterStatus'] == 'available':
-            print("\n{} is available.".format(DWH_CLUSTER_IDENTIFIER))
-            break
+        if cluster_info['ClusterStatus'] == status:
+            print("\n{} is {}.".format(DWH_CLUSTER_IDENTIFIER, status))
+            return cluster_info
+
+        if perf_counter() + delay > deadline:
+            raise TimeoutError("{} not {} after {}s".format(DWH_CLUSTER_IDENTIFIER, status, timeout))
+
+        print("\n{} is {}, wait {}s...".format(DWH_CLUSTER_IDENTIFIER, cluster_info['ClusterStatus'], delay))
+        sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def get_cluster(redshift, DWH_CLUSTER_IDENTIFIER):
+    """
+    checks cluster status & gets info (important: HOST & ARN).
+    :param redshift:
+    :param DWH_CLUSTER_IDENTIFIER:
+    :return: cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN
+    """
 
-        print("\nsetting up {}, wait...".format(DWH_CLUSTER_IDENTIFIER))
-        sleep(60)
+    cluster_info = wait_for_cluster(redshift, DWH_CLUSTER_IDENTIFIER)
 
     try:
         DWH_ENDPOINT = cluster_info['Endpoint']['Address']
@@ -193,9 +307,30 @@ def open_tcp_port(ec2, cluster_info, DWH_PORT):
     :return: defaultSg (EC2 default security group) (IAM_SG dwh.cfg)
     """
 
+    return open_vpc_tcp_port(ec2, cluster_info['VpcId'], DWH_PORT)
+
+
+def get_default_vpc_id(ec2):
+    """
+    gets id of default VPC (where a cluster created without subnet group is launched).
+    :param ec2: aws resource
+    :return: vpc id
+    """
+    return list(ec2.vpcs.filter(Filters=[{'Name': 'isDefault', 'Values': ['true']}]))[0].id
+
+
+def open_vpc_tcp_port(ec2, vpc_id, DWH_PORT):
+    """
+    opens incoming tcp port on default security group of a VPC.
+    :param ec2: aws resource
+    :param vpc_id: VPC id
+    :param DWH_PORT: EC2 port
+    :return: defaultSg id (IAM_SG dwh.cfg)
+    """
+
     print("\nopening tcp port...")
     try:
-        vpc = ec2.Vpc(id=cluster_info['VpcId'])
+        vpc = ec2.Vpc(id=vpc_id)
         defaultSg = list(vpc.security_groups.all())[0]
         print("\nSG: {}".format(str(defaultSg)))
         print("\nSG ID: {}".format(defaultSg.id))
@@ -217,24 +352,103 @@ def open_tcp_port(ec2, cluster_info, DWH_PORT):
     return defaultSg.id
 
 
-def check_cluster_conn(DWH_ENDPOINT, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT, DWH_DB_NAME):
+def check_cluster_conn(config, DWH_ENDPOINT):
     """
     checks if connection to redshift is valid.
+    :param config: parsed dwh.cfg (database, user, password, port & connection options)
     :param DWH_ENDPOINT: cluster endpoint
-    :param DWH_DB_USER: user
-    :param DWH_DB_PASSWORD: password
-    :param DWH_PORT: port
-    :param DWH_DB_NAME: name
     :return: none
     """
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(
-        DWH_ENDPOINT, DWH_DB_NAME, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT))
+    conn = db.connect_to(config, DWH_ENDPOINT)
     print("\nconnection to redshift database is validated.")
     conn.close()
 
 
-def setup_cluster():
+def update_config(config, DWH_ENDPOINT, IAM_ROLE_ARN, IAM_SG):
+    """
+    updates values of launched cluster in configuration file (dwh.cfg).
+    :param config: parsed dwh.cfg
+    :param DWH_ENDPOINT: cluster endpoint
+    :param IAM_ROLE_ARN: role arn
+    :param IAM_SG: security group id
+    :return: none
+    """
+    config.set("CLUSTER", "DWH_HOST", str(DWH_ENDPOINT))
+    config.set("IAM_ROLE", "IAM_ROLE_ARN", str(IAM_ROLE_ARN))
+    config.set("IAM_ROLE", "IAM_SG", str(IAM_SG))
+
+    with open("dwh.cfg", 'w') as configfile:
+        config.write(configfile)
+    print("\nvalues of DWH_HOST, IAM_ROLE_ARN & IAM_SG updated in configuration file.")
+
+
+def timed_phase(phases, name, func, *args):
+    """
+    runs a provisioning phase & records its duration.
+    :param phases: dict of phase name -> seconds
+    :param name: phase name
+    :param func: function of the phase
+    :param args: function arguments
+    :return: function result
+    """
+    start = perf_counter()
+    result = func(*args)
+    phases[name] = perf_counter() - start
+    return result
+
+
+def provision(ec2, iam, redshift,
+              DWH_CLUSTER_IDENTIFIER, DWH_CLUSTER_TYPE, DWH_NODE_TYPE, DWH_NUM_NODES,
+              DWH_DB_NAME, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT, DWH_IAM_ROLE_NAME,
+              DWH_PARAMETER_GROUP=None, timeout=1800):
+    """
+    provisions role, cluster & security group overlapping independent steps: role & security group
+    ingress (default VPC) run at the same time, & the cluster is polled with adaptive backoff.
+    :param ec2: aws resource
+    :param iam: client object for IAM
+    :param redshift: redshift client
+    :param DWH_CLUSTER_IDENTIFIER: config parameter
+    :param DWH_CLUSTER_TYPE: config parameter
+    :param DWH_NODE_TYPE: config parameter
+    :param DWH_NUM_NODES: config parameter
+    :param DWH_DB_NAME: config parameter
+    :param DWH_DB_USER: config parameter
+    :param DWH_DB_PASSWORD: config parameter
+    :param DWH_PORT: config parameter
+    :param DWH_IAM_ROLE_NAME: config parameter
+    :param DWH_PARAMETER_GROUP: parameter group (from func create_parameter_group; none: default group)
+    :param timeout: total seconds waiting for the cluster
+    :return: cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN, IAM_SG
+    """
+
+    phases = {}
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        role_future = executor.submit(timed_phase, phases, "iam role", create_iam_role, iam, DWH_IAM_ROLE_NAME)
+        sg_future = executor.submit(timed_phase, phases, "security group", lambda: open_vpc_tcp_port(
+            ec2, get_default_vpc_id(ec2), DWH_PORT))
+
+        role_arn = role_future.result()
+        timed_phase(phases, "create cluster", create_redshift_cluster, redshift,
+                    DWH_CLUSTER_IDENTIFIER, DWH_CLUSTER_TYPE, DWH_NODE_TYPE, DWH_NUM_NODES,
+                    DWH_DB_NAME, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT,
+                    role_arn, DWH_PARAMETER_GROUP)
+        cluster_info = timed_phase(phases, "wait available", wait_for_cluster, redshift, DWH_CLUSTER_IDENTIFIER,
+                                   'available', timeout)
+        IAM_SG = sg_future.result()
+
+    DWH_ENDPOINT = cluster_info['Endpoint']['Address']
+    IAM_ROLE_ARN = cluster_info['IamRoles'][0]['IamRoleArn']
+
+    for name, elapsed in phases.items():
+        print("\n{:.1f}s: {}".format(elapsed, name))
+    print("\nprovisioned in {:.1f}s.".format(perf_counter() - start))
+
+    return cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN, IAM_SG
+
+
+def setup_cluster(concurrent=False):
     # gets parameters from config file dwh.cfg
     config = configparser.ConfigParser()
     config.read_file(open("dwh.cfg"))
@@ -269,33 +483,43 @@ def setup_cluster():
     ec2, s3, iam, redshift = create_client(DWH_REGION, AWS_KEY, AWS_SECRET)
 
 
-    role_arn = create_iam_role(iam, DWH_IAM_ROLE_NAME)
+    # optional parameter group with separate etl & analytics WLM queues ([WLM] of dwh.cfg)
+    DWH_PARAMETER_GROUP = config_parameter_group(redshift, config)
 
 
-    cluster_info = create_redshift_cluster(redshift,
-                            DWH_CLUSTER_IDENTIFIER, DWH_CLUSTER_TYPE, DWH_NODE_TYPE, DWH_NUM_NODES,
-                            DWH_DB_NAME, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT,
-                            role_arn)
+    if concurrent:
+        cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN, IAM_SG = provision(
+            ec2, iam, redshift,
+            DWH_CLUSTER_IDENTIFIER, DWH_CLUSTER_TYPE, DWH_NODE_TYPE, DWH_NUM_NODES,
+            DWH_DB_NAME, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT, DWH_IAM_ROLE_NAME,
+            DWH_PARAMETER_GROUP)
 
+    else:
+        role_arn = create_iam_role(iam, DWH_IAM_ROLE_NAME)
 
-    cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN = get_cluster(redshift, DWH_CLUSTER_IDENTIFIER)
 
+        cluster_info = create_redshift_cluster(redshift,
+                                DWH_CLUSTER_IDENTIFIER, DWH_CLUSTER_TYPE, DWH_NODE_TYPE, DWH_NUM_NODES,
+                                DWH_DB_NAME, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT,
+                                role_arn, DWH_PARAMETER_GROUP)
 
-    IAM_SG = open_tcp_port(ec2, cluster_info, DWH_PORT)
 
+        cluster_info, DWH_ENDPOINT, IAM_ROLE_ARN = get_cluster(redshift, DWH_CLUSTER_IDENTIFIER)
 
-    # update values in configuration file
-    config.set("CLUSTER", "DWH_HOST", str(DWH_ENDPOINT))
-    config.set("IAM_ROLE", "IAM_ROLE_ARN", str(IAM_ROLE_ARN))
-    config.set("IAM_ROLE", "IAM_SG", str(IAM_SG))
 
-    with open("dwh.cfg", 'w') as configfile:
-        config.write(configfile)
-    print("\nvalues of DWH_HOST, IAM_ROLE_ARN & IAM_SG updated in configuration file.")
+        IAM_SG = open_tcp_port(ec2, cluster_info, DWH_PORT)
 
 
-    check_cluster_conn(DWH_ENDPOINT, DWH_DB_USER, DWH_DB_PASSWORD, DWH_PORT, DWH_DB_NAME)
+    update_config(config, DWH_ENDPOINT, IAM_ROLE_ARN, IAM_SG)
+
+
+    check_cluster_conn(config, DWH_ENDPOINT)
 
 
 if __name__ == '__main__':
-    setup_cluster()
+    parser = argparse.ArgumentParser(description="launches AWS services for the sparkify data warehouse")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="overlaps independent provisioning steps & reports time spent in each phase")
+    args = parser.parse_args()
+
+    setup_cluster(concurrent=args.concurrent)
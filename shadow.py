@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import metrics
+import checkpoint
+from query_cache import bump_table_versions
+from sql_queries import (create_table_queries, aggregate_tables, truncate_staging_queries, production_tables,
+                         existing_tables_select, table_rename)
+
+
+SHADOW_SUFFIX = "_shadow"
+OLD_SUFFIX = "_old"
+
+# checkpointed step: shadow tables created & staging tables emptied
+BUILD_STEP = "shadow tables"
+
+_table_names = re.compile(r"\b({})\b".format("|".join(production_tables)))
+
+
+def shadow_sql(query):
+    """
+    rewrites a statement to read & write the shadow copy of each production table.
+    :param query: sql statement
+    :return: sql statement
+    """
+    return _table_names.sub(lambda match: match.group(1) + SHADOW_SUFFIX, query)
+
+
+def shadow_steps(steps):
+    """
+    rewrites insert steps (sql_queries.insert_table_steps) to load the shadow tables.
+    :param steps: list of dicts with name, query, reads & writes
+    :return: list of steps
+    """
+    return [dict(step, query=shadow_sql(step["query"]),
+                 reads=[shadow_sql(table) for table in step["reads"]],
+                 writes=[shadow_sql(table) for table in step["writes"]]) for step in steps]
+
+
+def shadow_aggregates(aggregates=aggregate_tables):
+    """
+    rewrites aggregates (sql_queries.aggregate_tables) to be refreshed into their shadow tables.
+    :param aggregates: list of aggregates
+    :return: list of aggregates
+    """
+    return [dict(aggregate, name=shadow_sql(aggregate["name"]), create=shadow_sql(aggregate["create"]))
+            for aggregate in aggregates]
+
+
+def shadow_create_queries():
+    """
+    builds statements (re)creating an empty shadow table per production table, with the same ddl.
+    :return: list of sql statements
+    """
+    queries = []
+    for query in create_table_queries:
+        table = re.search(r"CREATE TABLE\s+IF NOT EXISTS\s+(\w+)", query).group(1)
+        if table in production_tables:
+            queries += ["DROP TABLE IF EXISTS {};".format(table + SHADOW_SUFFIX), shadow_sql(query)]
+    return queries
+
+
+def build_shadow_tables(cur, conn):
+    """
+    creates empty shadow tables & empties staging tables for a full reload (skipped by a resumed run
+    that already did it).
+    :param cur: postgres cursor
+    :param conn: postgres connection
+    :return: none
+    """
+    if checkpoint.is_completed(BUILD_STEP):
+        return
+    for query in shadow_create_queries() + truncate_staging_queries:
+        print("\nexecuting: {}".format(query))
+        metrics.execute(cur, query)
+    checkpoint.mark_completed(cur, BUILD_STEP)
+    conn.commit()
+    print("\nshadow tables created.")
+
+
+def swap_shadow_tables(cur):
+    """
+    renames shadow tables into place (production tables renamed to <table>_old) & bumps their load
+    versions; committed by caller, in one transaction, so readers see either the old or the new load.
+    :param cur: postgres cursor
+    :return: none
+    """
+    cur.execute(existing_tables_select, (tuple(production_tables),))
+    existing = {table for table, in cur.fetchall()}
+
+    for table in production_tables:
+        if table in existing:
+            metrics.execute(cur, table_rename.format(table, table + OLD_SUFFIX))
+        metrics.execute(cur, table_rename.format(table + SHADOW_SUFFIX, table))
+    bump_table_versions(cur, production_tables)
+
+
+def drop_old_tables(cur, conn):
+    """
+    drops production tables replaced by a swap (waits for queries still reading them).
+    :param cur: postgres cursor
+    :param conn: postgres connection
+    :return: none
+    """
+    for table in production_tables:
+        metrics.execute(cur, "DROP TABLE IF EXISTS {};".format(table + OLD_SUFFIX))
+        conn.commit()
+    print("\nold tables dropped.")
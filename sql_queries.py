@@ -10,8 +10,11 @@ config.read('dwh.cfg')
 
 
 # DROP TABLES
+staging_events_raw_table_drop = "DROP TABLE IF EXISTS staging_events_raw;"
+staging_songs_raw_table_drop = "DROP TABLE IF EXISTS staging_songs_raw;"
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events;"
 staging_songs_table_drop = "DROP TABLE IF EXISTS staging_songs;"
+staging_songplays_table_drop = "DROP TABLE IF EXISTS staging_songplays;"
 
 songplay_table_drop = "DROP TABLE IF EXISTS songplays;"
 user_table_drop = "DROP TABLE IF EXISTS users;"
@@ -19,6 +22,10 @@ song_table_drop = "DROP TABLE IF EXISTS songs;"
 artist_table_drop = "DROP TABLE IF EXISTS artists;"
 time_table_drop = "DROP TABLE IF EXISTS time;"
 
+watermark_table_drop = "DROP TABLE IF EXISTS etl_watermarks;"
+table_version_table_drop = "DROP TABLE IF EXISTS etl_table_versions;"
+run_step_table_drop = "DROP TABLE IF EXISTS etl_run_steps;"
+
 
 '''
 redshift tables notes:
@@ -33,7 +40,53 @@ fact table: DISTKEY & SORTKEY set to be the same join-column so query optimizer/
 '''
 
 # CREATE TABLES
-# staging tables
+# raw staging tables: rows as COPYed from s3 (spread evenly, so every slice loads its share);
+# join_key only filled by csv/parquet files converted with it (converter.py)
+staging_events_raw_table_create = ("""
+CREATE TABLE IF NOT EXISTS staging_events_raw (
+    artist VARCHAR,
+    auth VARCHAR,
+    first_name VARCHAR,
+    gender CHAR,
+    item_in_session INT,
+    last_name VARCHAR,
+    length FLOAT,
+    level VARCHAR,
+    location VARCHAR,
+    method VARCHAR,
+    page VARCHAR,
+    registration BIGINT,
+    session_id INT,
+    song VARCHAR ,
+    status INT,
+    ts TIMESTAMP,
+    user_agent VARCHAR,
+    user_id INT,
+    join_key CHAR(32)
+    )
+DISTSTYLE EVEN;
+""")
+
+staging_songs_raw_table_create = ("""
+CREATE TABLE IF NOT EXISTS staging_songs_raw (
+    num_songs INT,
+    artist_id VARCHAR,
+    artist_location VARCHAR,
+    artist_latitude FLOAT,
+    artist_longitude FLOAT,
+    artist_name VARCHAR,
+    song_id VARCHAR,
+    title VARCHAR,
+    duration FLOAT,
+    year INT,
+    join_key CHAR(32)
+    )
+DISTSTYLE EVEN;
+""")
+
+# staging tables: filled from the raw ones with their join_key computed by the same statement
+# join_key: MD5 of normalized song title & artist name (same on both sides), so events & songs
+#           that match are stored on the same slice & sorted for a merge join
 staging_events_table_create = ("""
 CREATE TABLE IF NOT EXISTS staging_events (
     artist VARCHAR,
@@ -53,7 +106,8 @@ CREATE TABLE IF NOT EXISTS staging_events (
     status INT,
     ts TIMESTAMP,
     user_agent VARCHAR,
-    user_id INT
+    user_id INT,
+    join_key CHAR(32) DISTKEY SORTKEY
     );
 """)
 
@@ -68,7 +122,23 @@ CREATE TABLE IF NOT EXISTS staging_songs (
     song_id VARCHAR,
     title VARCHAR,
     duration FLOAT,
-    year INT
+    year INT,
+    join_key CHAR(32) DISTKEY SORTKEY
+    );
+""")
+
+# events matched to songs (join computed once, read by songplays & time inserts);
+# distributed & sorted on ts so DISTINCT rows & timestamps are found within each slice
+staging_songplays_table_create = ("""
+CREATE TABLE IF NOT EXISTS staging_songplays (
+    ts TIMESTAMP SORTKEY DISTKEY,
+    user_id INT,
+    level VARCHAR,
+    song_id VARCHAR,
+    artist_id VARCHAR,
+    session_id INT,
+    location VARCHAR,
+    user_agent VARCHAR
     );
 """)
 
@@ -101,13 +171,16 @@ CREATE TABLE IF NOT EXISTS users (
 """)
 
 # dimension table
+# join_key: as in staging_songs (title & the song's own artist name), so incremental loads match new
+#           events to the songs already loaded exactly as a full load does
 song_table_create = ("""
 CREATE TABLE IF NOT EXISTS songs (
     song_id VARCHAR PRIMARY KEY SORTKEY,
     title VARCHAR NOT NULL,
     artist_id VARCHAR NOT NULL,
     year INT,
-    duration FLOAT
+    duration FLOAT,
+    join_key CHAR(32)
     );
 """)
 
@@ -136,6 +209,35 @@ CREATE TABLE IF NOT EXISTS time (
 """)
 
 
+# control table: last s3 key loaded per source (incremental loading)
+watermark_table_create = ("""
+CREATE TABLE IF NOT EXISTS etl_watermarks (
+    source VARCHAR PRIMARY KEY,
+    watermark VARCHAR NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+    );
+""")
+
+# control table: when each table last got new data (invalidates cached query results, query_cache.py)
+table_version_table_create = ("""
+CREATE TABLE IF NOT EXISTS etl_table_versions (
+    table_name VARCHAR PRIMARY KEY,
+    loaded_at TIMESTAMP NOT NULL
+    );
+""")
+
+# control table: steps completed by each etl run (resumed runs skip them, checkpoint.py);
+# fingerprint: hash of the run inputs, a run is only resumed with the same inputs
+run_step_table_create = ("""
+CREATE TABLE IF NOT EXISTS etl_run_steps (
+    run_id VARCHAR(32) NOT NULL,
+    fingerprint CHAR(32) NOT NULL,
+    step VARCHAR(256) NOT NULL,
+    completed_at TIMESTAMP NOT NULL
+    );
+""")
+
+
 '''
 reference to deal with TIMEFORMAT & blank/empty value:
 - https://docs.aws.amazon.com/redshift/latest/dg/copy-parameters-data-conversion.html
@@ -143,36 +245,119 @@ reference to deal with TIMEFORMAT & blank/empty value:
 '''
 
 # STAGING TABLES
-staging_events_copy = ("""
-COPY staging_events FROM {} 
-CREDENTIALS 'aws_iam_role={}' 
-REGION '{}' 
-FORMAT AS JSON {} 
+# {source}: s3 prefix (or manifest file, with options MANIFEST)
+staging_events_copy_template = ("""
+COPY staging_events_raw (artist, auth, first_name, gender, item_in_session, last_name, length, level, location,
+    method, page, registration, session_id, song, status, ts, user_agent, user_id)
+FROM {source} 
+CREDENTIALS 'aws_iam_role={role_arn}' 
+REGION '{region}' 
+FORMAT AS JSON {jsonpath} 
 TIMEFORMAT AS 'epochmillisecs' 
 BLANKSASNULL 
 EMPTYASNULL 
-TRUNCATECOLUMNS;
-""").format(config.get("S3", "LOG_DATA"),
-            config.get("IAM_ROLE", "IAM_ROLE_ARN"),
-            config.get("CLUSTER", 'DWH_REGION'),
-            config.get("S3", "LOG_JSONPATH")
-            )
-
-staging_songs_copy = ("""
-COPY staging_songs FROM {} 
-CREDENTIALS 'aws_iam_role={}' 
-REGION '{}' 
+TRUNCATECOLUMNS{options};
+""")
+
+staging_songs_copy_template = ("""
+COPY staging_songs_raw (num_songs, artist_id, artist_location, artist_latitude, artist_longitude, artist_name,
+    song_id, title, duration, year)
+FROM {source} 
+CREDENTIALS 'aws_iam_role={role_arn}' 
+REGION '{region}' 
 FORMAT AS JSON 'auto' 
 BLANKSASNULL 
 EMPTYASNULL 
-TRUNCATECOLUMNS;
-""").format(config.get('S3', 'SONG_DATA'),
-            config.get('IAM_ROLE', 'IAM_ROLE_ARN'),
-            config.get('CLUSTER', 'DWH_REGION')
-            )
+TRUNCATECOLUMNS{options};
+""")
+
+staging_events_copy = staging_events_copy_template.format(
+    source=config.get("S3", "LOG_DATA"),
+    role_arn=config.get("IAM_ROLE", "IAM_ROLE_ARN"),
+    region=config.get("CLUSTER", 'DWH_REGION'),
+    jsonpath=config.get("S3", "LOG_JSONPATH"),
+    options=""
+)
+
+staging_songs_copy = staging_songs_copy_template.format(
+    source=config.get('S3', 'SONG_DATA'),
+    role_arn=config.get('IAM_ROLE', 'IAM_ROLE_ARN'),
+    region=config.get('CLUSTER', 'DWH_REGION'),
+    options=""
+)
+
+# staging rows with their join_key, computed while they are written (rows loaded from json) or
+# precomputed (csv/parquet files), instead of updating every row after the load
+staging_events_insert = ("""
+INSERT INTO staging_events (artist, auth, first_name, gender, item_in_session, last_name, length, level, location,
+    method, page, registration, session_id, song, status, ts, user_agent, user_id, join_key)
+SELECT artist, auth, first_name, gender, item_in_session, last_name, length, level, location,
+    method, page, registration, session_id, song, status, ts, user_agent, user_id,
+    COALESCE(join_key, MD5(LOWER(TRIM(song)) || '|' || LOWER(TRIM(artist)))) AS join_key
+FROM staging_events_raw
+ORDER BY join_key;
+""")
+
+staging_songs_insert = ("""
+INSERT INTO staging_songs (num_songs, artist_id, artist_location, artist_latitude, artist_longitude, artist_name,
+    song_id, title, duration, year, join_key)
+SELECT num_songs, artist_id, artist_location, artist_latitude, artist_longitude, artist_name,
+    song_id, title, duration, year,
+    COALESCE(join_key, MD5(LOWER(TRIM(title)) || '|' || LOWER(TRIM(artist_name)))) AS join_key
+FROM staging_songs_raw
+ORDER BY join_key;
+""")
+
+# faster formats written by converter.py (same column order as the raw staging tables)
+staging_csv_copy_template = ("""
+COPY {table} FROM {source} 
+CREDENTIALS 'aws_iam_role={role_arn}' 
+REGION '{region}' 
+FORMAT AS CSV 
+TIMEFORMAT AS 'epochmillisecs' 
+BLANKSASNULL 
+EMPTYASNULL 
+TRUNCATECOLUMNS{options};
+""")
+
+staging_parquet_copy_template = ("""
+COPY {table} FROM {source} 
+CREDENTIALS 'aws_iam_role={role_arn}' 
+REGION '{region}' 
+FORMAT AS PARQUET{options};
+""")
 
 
 # FINAL TABLES
+# matched events of the previous run are dropped without leaving deleted rows to vacuum
+# (TRUNCATE commits by itself in redshift, so it is its own step)
+staging_songplays_truncate = "TRUNCATE staging_songplays;"
+
+# staging_songplays only keeps the songplays of the run that are not loaded yet (distinct rows,
+# none with the start_time, user_id & session_id of a loaded songplay): it is what the songplays
+# insert adds, so aggregates are refreshed from it without counting a play twice
+
+staging_songplays_insert = ("""
+INSERT INTO staging_songplays (
+    ts,
+    user_id,
+    level,
+    song_id,
+    artist_id,
+    session_id,
+    location,
+    user_agent
+)
+SELECT DISTINCT s_e.ts, s_e.user_id, s_e.level, s_s.song_id, s_s.artist_id, s_e.session_id, s_e.location,
+    s_e.user_agent
+FROM staging_songs AS s_s
+JOIN staging_events AS s_e
+ON (s_e.join_key = s_s.join_key)
+LEFT JOIN songplays AS sp
+ON (s_e.ts = sp.start_time AND s_e.user_id = sp.user_id AND s_e.session_id = sp.session_id)
+WHERE s_e.page='NextSong' AND sp.songplay_id IS NULL;
+""")
+
 songplay_table_insert = ("""
 INSERT INTO songplays (
     start_time,
@@ -184,14 +369,20 @@ INSERT INTO songplays (
     location,
     user_agent
 )
-SELECT DISTINCT s_e.ts, s_e.user_id, s_e.level, s_s.song_id, s_s.artist_id, s_e.session_id, s_e.location, s_e.user_agent
-FROM staging_songs AS s_s
-JOIN staging_events AS s_e
-ON (s_e.song = s_s.title AND s_e.artist = s_s.artist_name)
-WHERE s_e.page='NextSong';
+SELECT DISTINCT s_sp.ts, s_sp.user_id, s_sp.level, s_sp.song_id, s_sp.artist_id, s_sp.session_id, s_sp.location,
+    s_sp.user_agent
+FROM staging_songplays AS s_sp
+LEFT JOIN songplays AS sp
+ON (s_sp.ts = sp.start_time AND s_sp.user_id = sp.user_id AND s_sp.session_id = sp.session_id)
+WHERE sp.songplay_id IS NULL;
 """)
 
-user_table_insert = ("""
+# dimension tables: upsert (delete-and-insert in one transaction), one row per key;
+# users keep their latest row (e.g. level after switching free/paid) by event ts
+user_table_upsert = ("""
+DELETE FROM users
+USING staging_events AS s_e
+WHERE users.user_id = s_e.user_id;
 INSERT INTO users (
     user_id,
     first_name,
@@ -199,25 +390,38 @@ INSERT INTO users (
     gender,
     level
 )
-SELECT DISTINCT user_id, first_name, last_name, gender, level
-FROM staging_events
-WHERE user_id IS NOT NULL;
+SELECT user_id, first_name, last_name, gender, level
+FROM (SELECT user_id, first_name, last_name, gender, level,
+      ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY ts DESC) AS row_num
+      FROM staging_events
+      WHERE user_id IS NOT NULL) AS latest
+WHERE row_num = 1;
 """)
 
-song_table_insert = ("""
+song_table_upsert = ("""
+DELETE FROM songs
+USING staging_songs AS s_s
+WHERE songs.song_id = s_s.song_id;
 INSERT INTO songs (
     song_id,
     title,
     artist_id,
     year,
-    duration
+    duration,
+    join_key
 )
-SELECT DISTINCT song_id, title, artist_id, year, duration
-FROM staging_songs
-WHERE song_id IS NOT NULL;
+SELECT song_id, title, artist_id, year, duration, join_key
+FROM (SELECT song_id, title, artist_id, year, duration, join_key,
+      ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY year DESC NULLS LAST) AS row_num
+      FROM staging_songs
+      WHERE song_id IS NOT NULL) AS latest
+WHERE row_num = 1;
 """)
 
-artist_table_insert = ("""
+artist_table_upsert = ("""
+DELETE FROM artists
+USING staging_songs AS s_s
+WHERE artists.artist_id = s_s.artist_id;
 INSERT INTO artists (
     artist_id,
     name,
@@ -225,9 +429,12 @@ INSERT INTO artists (
     latitude,
     longitude
 )
-SELECT DISTINCT artist_id, artist_name, artist_location, artist_latitude, artist_longitude
-FROM staging_songs
-WHERE artist_id IS NOT NULL;
+SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude
+FROM (SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude,
+      ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY artist_latitude NULLS LAST) AS row_num
+      FROM staging_songs
+      WHERE artist_id IS NOT NULL) AS latest
+WHERE row_num = 1;
 """)
 
 time_table_insert = ("""
@@ -240,29 +447,285 @@ INSERT INTO time (
     year,
     weekday
 )
-SELECT DISTINCT start_time,
+SELECT start_time,
 EXTRACT(hour FROM start_time) AS hour,
 EXTRACT(day FROM start_time) AS day,
 EXTRACT(week FROM start_time) AS week,
 EXTRACT(month FROM start_time) AS month, 
 EXTRACT(year from start_time) AS year,
 EXTRACT(dow FROM start_time) AS dow 
-FROM (SELECT DISTINCT ts AS start_time 
-FROM staging_events AS s_e 
-JOIN staging_songs AS s_s 
-ON (s_e.song = s_s.title AND s_e.artist = s_s.artist_name) 
-WHERE s_e.page='NextSong');
+FROM (SELECT DISTINCT s_sp.ts AS start_time 
+FROM staging_songplays AS s_sp
+WHERE NOT EXISTS (SELECT 1 FROM time AS t WHERE t.start_time = s_sp.ts)) AS matched;
+""")
+
+
+# TABLE VERSIONS
+table_version_upsert = ("""
+DELETE FROM etl_table_versions WHERE table_name = %(table_name)s;
+INSERT INTO etl_table_versions (table_name, loaded_at)
+VALUES (%(table_name)s, %(loaded_at)s);
+""")
+
+table_version_select = "SELECT table_name, loaded_at FROM etl_table_versions;"
+
+
+# RUN CHECKPOINTS
+run_step_insert = ("""
+INSERT INTO etl_run_steps (run_id, fingerprint, step, completed_at)
+VALUES (%(run_id)s, %(fingerprint)s, %(step)s, %(completed_at)s);
+""")
+
+run_steps_select = "SELECT step FROM etl_run_steps WHERE run_id = %s;"
+
+# latest started run with the same inputs that did not finish (its first row is its start)
+unfinished_run_select = ("""
+SELECT run_id
+FROM etl_run_steps
+WHERE fingerprint = %(fingerprint)s
+GROUP BY run_id
+HAVING SUM(CASE WHEN step = %(final_step)s THEN 1 ELSE 0 END) = 0
+ORDER BY MIN(completed_at) DESC
+LIMIT 1;
+""")
+
+
+# INCREMENTAL LOADING
+# staging tables only hold the new s3 objects; dimension tables are upserted (see above)
+staging_events_raw_truncate = "TRUNCATE staging_events_raw;"
+staging_songs_raw_truncate = "TRUNCATE staging_songs_raw;"
+staging_events_truncate = "TRUNCATE staging_events;"
+staging_songs_truncate = "TRUNCATE staging_songs;"
+
+watermark_select = "SELECT watermark FROM etl_watermarks WHERE source = %s;"
+
+watermark_upsert = ("""
+DELETE FROM etl_watermarks WHERE source = %(source)s;
+INSERT INTO etl_watermarks (source, watermark, updated_at)
+VALUES (%(source)s, %(watermark)s, %(updated_at)s);
+""")
+
+# new events are matched against the songs already loaded (not only the new ones), on the join_key
+# each song got in staging_songs (same match as staging_songplays_insert)
+staging_songplays_insert_incremental = ("""
+INSERT INTO staging_songplays (
+    ts,
+    user_id,
+    level,
+    song_id,
+    artist_id,
+    session_id,
+    location,
+    user_agent
+)
+SELECT DISTINCT s_e.ts, s_e.user_id, s_e.level, s.song_id, s.artist_id, s_e.session_id, s_e.location,
+    s_e.user_agent
+FROM staging_events AS s_e
+JOIN songs AS s
+ON (s_e.join_key = s.join_key)
+LEFT JOIN songplays AS sp
+ON (s_e.ts = sp.start_time AND s_e.user_id = sp.user_id AND s_e.session_id = sp.session_id)
+WHERE s_e.page='NextSong' AND sp.songplay_id IS NULL;
+""")
+
+time_table_insert_incremental = ("""
+INSERT INTO time (
+    start_time,
+    hour,
+    day,
+    week,
+    month,
+    year,
+    weekday
+)
+SELECT DISTINCT s_sp.ts AS start_time,
+EXTRACT(hour FROM s_sp.ts) AS hour,
+EXTRACT(day FROM s_sp.ts) AS day,
+EXTRACT(week FROM s_sp.ts) AS week,
+EXTRACT(month FROM s_sp.ts) AS month,
+EXTRACT(year from s_sp.ts) AS year,
+EXTRACT(dow FROM s_sp.ts) AS dow
+FROM staging_songplays AS s_sp
+LEFT JOIN time AS t
+ON (s_sp.ts = t.start_time)
+WHERE t.start_time IS NULL;
+""")
+
+
+# UNLOAD
+# large extracts written by the cluster to s3 (fetch.py), one or more parquet files per slice;
+# quotes in {query} are doubled
+unload_template = ("""
+UNLOAD ('{query}')
+TO '{destination}'
+CREDENTIALS 'aws_iam_role={role_arn}'
+REGION '{region}'
+FORMAT AS PARQUET
+PARALLEL {parallel}
+MAXFILESIZE {max_file_mb} MB;
 """)
 
 
 # QUERY LISTS
-create_table_queries = [staging_events_table_create, staging_songs_table_create,
-                    songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
+create_table_queries = [staging_events_raw_table_create, staging_songs_raw_table_create,
+                    staging_events_table_create, staging_songs_table_create, staging_songplays_table_create,
+                    songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create,
+                    watermark_table_create, table_version_table_create, run_step_table_create]
 
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop,
-                    songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+drop_table_queries = [staging_events_raw_table_drop, staging_songs_raw_table_drop,
+                    staging_events_table_drop, staging_songs_table_drop, staging_songplays_table_drop,
+                    songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop,
+                    watermark_table_drop, table_version_table_drop, run_step_table_drop]
 
 copy_table_queries = [staging_events_copy, staging_songs_copy]
 
-insert_table_queries = [songplay_table_insert,
-                    user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+staging_insert_queries = [staging_events_insert, staging_songs_insert]
+
+truncate_staging_queries = [staging_events_raw_truncate, staging_songs_raw_truncate,
+                            staging_events_truncate, staging_songs_truncate, staging_songplays_truncate]
+
+insert_table_queries = [staging_songplays_truncate, staging_songplays_insert, songplay_table_insert,
+                    user_table_upsert, song_table_upsert, artist_table_upsert, time_table_insert]
+
+
+# TABLES READ & WRITTEN BY EACH QUERY
+# (scheduler.py runs queries that do not touch each other's tables in parallel)
+insert_table_steps = [
+    {"name": "TRUNCATE staging_songplays", "query": staging_songplays_truncate,
+     "reads": [], "writes": ["staging_songplays"]},
+    {"name": "staging_songplays", "query": staging_songplays_insert,
+     "reads": ["staging_events", "staging_songs", "songplays"], "writes": ["staging_songplays"]},
+    {"name": "songplays", "query": songplay_table_insert,
+     "reads": ["staging_songplays", "songplays"], "writes": ["songplays"]},
+    {"name": "users", "query": user_table_upsert, "reads": ["staging_events", "users"], "writes": ["users"]},
+    {"name": "songs", "query": song_table_upsert, "reads": ["staging_songs", "songs"], "writes": ["songs"]},
+    {"name": "artists", "query": artist_table_upsert, "reads": ["staging_songs", "artists"], "writes": ["artists"]},
+    {"name": "time", "query": time_table_insert, "reads": ["staging_songplays", "time"], "writes": ["time"]},
+]
+
+# songs first: new events are matched against them;
+# no TRUNCATE (it would commit the run half-way): staging_songplays is emptied with the other staging tables
+incremental_insert_table_steps = [
+    {"name": "songs", "query": song_table_upsert, "reads": ["staging_songs", "songs"], "writes": ["songs"]},
+    {"name": "artists", "query": artist_table_upsert, "reads": ["staging_songs", "artists"], "writes": ["artists"]},
+    {"name": "users", "query": user_table_upsert, "reads": ["staging_events", "users"], "writes": ["users"]},
+    {"name": "staging_songplays", "query": staging_songplays_insert_incremental,
+     "reads": ["staging_events", "songs", "songplays"], "writes": ["staging_songplays"]},
+    {"name": "songplays", "query": songplay_table_insert,
+     "reads": ["staging_songplays", "songplays"], "writes": ["songplays"]},
+    {"name": "time", "query": time_table_insert_incremental,
+     "reads": ["staging_songplays", "time"], "writes": ["time"]},
+]
+
+
+# AGGREGATE TABLES
+# summary tables refreshed by aggregates.py from the songplays inserted by each run only (staging_songplays):
+# delta rows (keys, then measures) are added to existing rows or inserted; measures must be additive.
+# new aggregates are declared here.
+new_songplays = "staging_songplays AS sp"
+
+aggregate_tables = [
+    {"name": "plays_by_hour",
+     "create": """
+CREATE TABLE IF NOT EXISTS plays_by_hour (
+    weekday INT NOT NULL,
+    hour INT NOT NULL,
+    plays BIGINT NOT NULL
+    )
+DISTSTYLE ALL;
+""",
+     "keys": ["weekday", "hour"], "measures": ["plays"],
+     "delta": """
+SELECT EXTRACT(dow FROM sp.ts) AS weekday, EXTRACT(hour FROM sp.ts) AS hour, COUNT(*) AS plays
+FROM {}
+GROUP BY 1, 2
+""".format(new_songplays)},
+
+    {"name": "song_plays",
+     "create": """
+CREATE TABLE IF NOT EXISTS song_plays (
+    song_id VARCHAR NOT NULL SORTKEY DISTKEY,
+    plays BIGINT NOT NULL
+    );
+""",
+     "keys": ["song_id"], "measures": ["plays"],
+     "delta": """
+SELECT sp.song_id, COUNT(*) AS plays
+FROM {}
+GROUP BY 1
+""".format(new_songplays)},
+
+    {"name": "artist_plays",
+     "create": """
+CREATE TABLE IF NOT EXISTS artist_plays (
+    artist_id VARCHAR NOT NULL SORTKEY DISTKEY,
+    plays BIGINT NOT NULL
+    );
+""",
+     "keys": ["artist_id"], "measures": ["plays"],
+     "delta": """
+SELECT sp.artist_id, COUNT(*) AS plays
+FROM {}
+GROUP BY 1
+""".format(new_songplays)},
+
+    {"name": "user_plays",
+     "create": """
+CREATE TABLE IF NOT EXISTS user_plays (
+    user_id INT NOT NULL SORTKEY DISTKEY,
+    plays BIGINT NOT NULL
+    );
+""",
+     "keys": ["user_id"], "measures": ["plays"],
+     "delta": """
+SELECT sp.user_id, COUNT(*) AS plays
+FROM {}
+GROUP BY 1
+""".format(new_songplays)},
+
+    {"name": "level_daily_plays",
+     "create": """
+CREATE TABLE IF NOT EXISTS level_daily_plays (
+    day DATE NOT NULL SORTKEY,
+    level VARCHAR NOT NULL,
+    plays BIGINT NOT NULL
+    )
+DISTSTYLE ALL;
+""",
+     "keys": ["day", "level"], "measures": ["plays"],
+     "delta": """
+SELECT CAST(sp.ts AS DATE) AS day, sp.level, COUNT(*) AS plays
+FROM {}
+WHERE sp.level IS NOT NULL
+GROUP BY 1, 2
+""".format(new_songplays)},
+]
+
+create_table_queries += [aggregate["create"] for aggregate in aggregate_tables]
+
+drop_table_queries += ["DROP TABLE IF EXISTS {};".format(aggregate["name"]) for aggregate in aggregate_tables]
+
+
+# TABLE MAINTENANCE
+# health of each table (maintenance.py): unsorted & stats_off are percentages;
+# estimated_visible_rows excludes rows marked for deletion
+table_health_select = ("""
+SELECT "table", unsorted, stats_off, tbl_rows, estimated_visible_rows
+FROM svv_table_info
+WHERE schema = 'public';
+""")
+
+
+# SHADOW TABLES
+# blue/green reload (shadow.py): production tables are rebuilt as <table>_shadow & renamed into place
+# in one transaction, so readers only ever see complete loads
+production_tables = ["songplays", "users", "songs", "artists", "time"] + \
+                    [aggregate["name"] for aggregate in aggregate_tables]
+
+existing_tables_select = ("""
+SELECT tablename
+FROM pg_tables
+WHERE schemaname = 'public' AND tablename IN %s;
+""")
+
+table_rename = "ALTER TABLE {} RENAME TO {};"
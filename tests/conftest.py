@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import configparser
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# scripts are run from the repository root (sql_queries reads dwh.cfg from the working directory)
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+@pytest.fixture
+def config():
+    """
+    dwh.cfg of the repository.
+    """
+    config = configparser.ConfigParser()
+    config.read_file(open(os.path.join(ROOT, "dwh.cfg")))
+    return config
+
+
+@pytest.fixture
+def aws_credentials(monkeypatch):
+    """
+    fake credentials, so moto never reaches a real account.
+    """
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SECURITY_TOKEN", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-west-2")
+
+
+@pytest.fixture
+def s3(aws_credentials):
+    """
+    mocked s3 resource with the source & etl buckets of dwh.cfg.
+    """
+    import boto3
+    from moto import mock_s3
+
+    with mock_s3():
+        s3 = boto3.resource("s3", region_name="us-west-2")
+        for bucket in ("udacity-dend", "sparkify-etl"):
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": "us-west-2"})
+        yield s3
+
+
+@pytest.fixture
+def pg_config(config):
+    """
+    dwh.cfg pointed at a local postgres (SPARKIFY_TEST_DSN, default: [BENCHMARK] dsn); tests using it are
+    skipped when it cannot be reached.
+    """
+    import psycopg2
+    from psycopg2.extensions import parse_dsn
+
+    dsn = parse_dsn(os.environ.get("SPARKIFY_TEST_DSN", config.get("BENCHMARK", "DSN")))
+    for option, key in (("DWH_HOST", "host"), ("DWH_DB_NAME", "dbname"), ("DWH_DB_USER", "user"),
+                        ("DWH_DB_PASSWORD", "password"), ("DWH_PORT", "port")):
+        config.set("CLUSTER", option, dsn.get(key, ""))
+    config.set("CONNECTION", "CONNECT_TIMEOUT", "2")
+    config.set("CONNECTION", "RETRIES", "1")
+
+    import db
+    try:
+        db.connect(config).close()
+    except psycopg2.OperationalError as err:
+        pytest.skip("no local postgres: {}".format(err))
+    return config
+
+
+@pytest.fixture
+def aws(aws_credentials):
+    """
+    mocked ec2, iam & redshift (as returned by setup_cluster.create_client, without s3).
+    """
+    import boto3
+    from moto import mock_ec2, mock_iam, mock_redshift
+
+    with mock_ec2(), mock_iam(), mock_redshift():
+        yield (boto3.resource("ec2", region_name="us-west-2"), boto3.client("iam", region_name="us-west-2"),
+               boto3.client("redshift", region_name="us-west-2"))
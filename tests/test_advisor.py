@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from advisor import (notebook_queries, parse_plan, scanned_tables, find_redistribution, propose, rewrite_ddl,
+                     TABLE_DDL)
+
+
+# redshift EXPLAIN output of a songplays x users join (users not distributed on user_id)
+PLAN = """XN Hash Join DS_DIST_INNER  (cost=0.04..7001.66 rows=333 width=62)
+  Inner Dist Key: u.user_id
+  Hash Cond: ("outer".user_id = "inner".user_id)
+  ->  XN Seq Scan on songplays sp  (cost=0.00..3.33 rows=333 width=30)
+  ->  XN Hash  (cost=0.03..0.03 rows=3 width=36)
+        ->  XN Seq Scan on users u  (cost=0.00..0.03 rows=3 width=36)"""
+
+
+def test_parse_plan():
+    root = parse_plan(PLAN)
+    assert root["step"] == "XN Hash Join DS_DIST_INNER"
+    assert root["details"] == ["Inner Dist Key: u.user_id", 'Hash Cond: ("outer".user_id = "inner".user_id)']
+    assert [child["step"] for child in root["children"]] == ["XN Seq Scan on songplays sp", "XN Hash"]
+    assert scanned_tables(root) == [("songplays", "sp"), ("users", "u")]
+
+
+def test_find_redistribution():
+    finding, = find_redistribution(parse_plan(PLAN))
+    assert finding["kind"] == "DS_DIST_INNER"
+    assert finding["columns"] == [("songplays", "user_id"), ("users", "user_id")]
+    assert finding["outer"] == ["songplays"] and finding["inner"] == ["users"]
+
+
+def test_no_redistribution():
+    assert find_redistribution(parse_plan("XN Seq Scan on users  (cost=0.00..0.03 rows=3 width=36)")) == []
+    assert find_redistribution(parse_plan("")) == []
+
+
+def test_propose():
+    findings = find_redistribution(parse_plan(PLAN)) * 2
+    proposals = propose(findings, {"users": 100, "songplays": 5000000})
+    assert proposals["users"]["diststyle"] == "ALL" and proposals["users"]["sortkey"] == "user_id"
+    assert proposals["songplays"] == {"diststyle": "KEY", "distkey": "user_id", "sortkey": "user_id",
+                                      "reason": "joined on user_id in 2 redistributed steps"}
+
+
+def test_rewrite_ddl_key():
+    ddl = rewrite_ddl(TABLE_DDL["songplays"], {"diststyle": "KEY", "distkey": "user_id", "sortkey": "start_time"})
+    assert "songplay_id INT IDENTITY(0,1) PRIMARY KEY," in ddl
+    assert "start_time TIMESTAMP NOT NULL SORTKEY," in ddl
+    assert "user_id INT NOT NULL DISTKEY," in ddl
+
+
+def test_rewrite_ddl_all():
+    ddl = rewrite_ddl(TABLE_DDL["users"], {"diststyle": "ALL", "distkey": None, "sortkey": "user_id"})
+    assert "user_id INT PRIMARY KEY SORTKEY," in ddl
+    assert ddl.endswith(")\nDISTSTYLE ALL;")
+
+
+def test_notebook_queries():
+    queries = notebook_queries()
+    assert queries
+    assert all(query and not query.startswith("%sql") for query in queries)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import pytest
+from aggregates import merge_queries
+from sql_queries import aggregate_tables, staging_songplays_insert, songplay_table_insert
+
+# aggregates whose delta sqlite can run (no EXTRACT)
+AGGREGATES = [aggregate for aggregate in aggregate_tables
+              if aggregate["name"] in ("song_plays", "artist_plays", "user_plays")]
+
+TABLES = """
+CREATE TABLE staging_events (ts INT, user_id INT, level TEXT, session_id INT, location TEXT, user_agent TEXT,
+    page TEXT, join_key TEXT);
+CREATE TABLE staging_songs (song_id TEXT, artist_id TEXT, join_key TEXT);
+CREATE TABLE staging_songplays (ts INT, user_id INT, level TEXT, song_id TEXT, artist_id TEXT, session_id INT,
+    location TEXT, user_agent TEXT);
+CREATE TABLE songplays (songplay_id INTEGER PRIMARY KEY, start_time INT, user_id INT, level TEXT, song_id TEXT,
+    artist_id TEXT, session_id INT, location TEXT, user_agent TEXT);
+CREATE TABLE song_plays (song_id TEXT, plays INT);
+CREATE TABLE artist_plays (artist_id TEXT, plays INT);
+CREATE TABLE user_plays (user_id INT, plays INT);
+"""
+
+
+@pytest.fixture
+def conn():
+    """
+    in-memory database with the staging, songplays & aggregate tables (sqlite types).
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(TABLES)
+    conn.executemany("INSERT INTO staging_songs VALUES (?, ?, ?);",
+                     [("SO1", "AR1", "key1"), ("SO2", "AR2", "key2")])
+    yield conn
+    conn.close()
+
+
+def load_events(conn, events):
+    """
+    runs a load of the given events: staging tables, songplays & aggregates (as etl.load_full).
+    """
+    conn.execute("DELETE FROM staging_events;")
+    conn.executemany("INSERT INTO staging_events VALUES (?, ?, 'free', ?, NULL, NULL, ?, ?);", events)
+    conn.execute("DELETE FROM staging_songplays;")
+    for query in [staging_songplays_insert, songplay_table_insert] + \
+            [query for aggregate in AGGREGATES for query in merge_queries(aggregate)]:
+        conn.execute(query)
+    conn.commit()
+
+
+def plays(conn, table):
+    return dict(conn.execute("SELECT * FROM {};".format(table)).fetchall())
+
+
+EVENTS = [(1000, 1, 10, "NextSong", "key1"), (2000, 1, 10, "NextSong", "key2"), (3000, 2, 20, "NextSong", "key1"),
+          (3000, 2, 20, "NextSong", "key1"), (4000, 2, 20, "Home", None)]
+
+
+def test_merge_same_batch_twice(conn):
+    load_events(conn, EVENTS)
+    expected = {"song_plays": {"SO1": 2, "SO2": 1}, "artist_plays": {"AR1": 2, "AR2": 1}, "user_plays": {1: 2, 2: 1}}
+    assert {table: plays(conn, table) for table in expected} == expected
+
+    # full reload over the kept tables: nothing new
+    load_events(conn, EVENTS)
+    assert {table: plays(conn, table) for table in expected} == expected
+    assert conn.execute("SELECT COUNT(*) FROM songplays;").fetchone() == (3,)
+
+
+def test_merge_overlapping_batch(conn):
+    load_events(conn, EVENTS[:2])
+    load_events(conn, EVENTS[1:])  # second event already loaded
+
+    assert plays(conn, "song_plays") == {"SO1": 2, "SO2": 1}
+    assert plays(conn, "user_plays") == {1: 2, 2: 1}
+    assert conn.execute("SELECT COUNT(*) FROM songplays;").fetchone() == (3,)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from botocore.exceptions import ClientError
+import autoscale
+from autoscale import source_bytes, nodes_for_load, wait_for_resize, resize_cluster
+
+GB = 1024 ** 3
+
+
+class ResizeClient:
+    """
+    redshift client answering describe_resize with given statuses (none: no resize found yet).
+    """
+
+    def __init__(self, statuses, target=4):
+        self.statuses = list(statuses)
+        self.target = target
+        self.resized = []
+
+    def resize_cluster(self, **params):
+        self.resized.append(params)
+
+    def describe_resize(self, ClusterIdentifier):
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        if status is None:
+            raise ClientError({"Error": {"Code": "ResizeNotFound", "Message": "no resize"}}, "DescribeResize")
+        return {"Status": status, "TargetNumberOfNodes": self.target}
+
+
+@pytest.fixture(autouse=True)
+def no_wait(monkeypatch):
+    """
+    polls without sleeping, cluster always available.
+    """
+    monkeypatch.setattr(autoscale, "sleep", lambda seconds: None)
+    monkeypatch.setattr(autoscale, "wait_for_cluster", lambda redshift, identifier: None)
+
+
+def test_nodes_for_load():
+    assert nodes_for_load(0, 50, 2, 16) == 2
+    assert nodes_for_load(120 * GB, 50, 2, 16) == 3
+    assert nodes_for_load(10000 * GB, 50, 2, 16) == 16
+
+
+def test_source_bytes(s3, config):
+    s3.Object("udacity-dend", "log_data/2018/11/2018-11-01-events.json").put(Body=b"x" * 300)
+    s3.Object("udacity-dend", "song_data/A/A/A/TRAAA.json").put(Body=b"x" * 200)
+    s3.Object("udacity-dend", "song_data/README.txt").put(Body=b"x" * 1000)  # not json
+    assert source_bytes(config, s3) == 500
+
+
+def test_wait_for_resize():
+    redshift = ResizeClient([None, "IN_PROGRESS", "IN_PROGRESS", "SUCCEEDED"])
+    assert wait_for_resize(redshift, "dwhcluster", 4) == "SUCCEEDED"
+    assert redshift.statuses == ["SUCCEEDED"]
+
+
+def test_wait_for_resize_previous_resize():
+    # a finished resize to another size is not the one requested
+    redshift = ResizeClient(["SUCCEEDED"], target=2)
+    assert wait_for_resize(redshift, "dwhcluster", 4, timeout=1, delay=2) == "timeout (SUCCEEDED)"
+
+
+def test_resize_cluster_failed(config, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    redshift = ResizeClient(["IN_PROGRESS", "FAILED"], target=8)
+    nodes = config.get("CLUSTER", "DWH_NUM_NODES")
+
+    assert not resize_cluster(redshift, config, 8)
+    assert redshift.resized[0]["NumberOfNodes"] == 8 and redshift.resized[0]["Classic"] is False
+    assert config.get("CLUSTER", "DWH_NUM_NODES") == nodes
+    assert not (tmp_path / "dwh.cfg").exists()
+
+
+def test_resize_cluster_succeeded(config, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert resize_cluster(ResizeClient(["SUCCEEDED"], target=8), config, 8)
+    assert config.get("CLUSTER", "DWH_NUM_NODES") == "8"
+    assert "dwh_num_nodes = 8" in (tmp_path / "dwh.cfg").read_text()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import datetime
+from benchmark import strip_redshift, local_rows, copy_local, stage, compare_commits
+from converter import table_columns
+from sql_queries import (staging_events_table_create, staging_songs_table_create, songplay_table_create,
+                         staging_events_raw_table_create)
+
+
+def test_strip_redshift():
+    ddl = strip_redshift(songplay_table_create)
+    assert "songplay_id SERIAL PRIMARY KEY," in ddl
+    assert "SORTKEY" not in ddl and "DISTKEY" not in ddl
+    assert "DISTSTYLE" not in strip_redshift(staging_events_raw_table_create)
+
+
+def test_local_rows_casts_values():
+    columns = table_columns(staging_events_table_create)
+    fields = [name for name, _ in columns if name != "join_key"]
+    document = {"artist": "Des'ree", "item_in_session": "3", "session_id": 39.0,
+                "length": "246.3", "ts": 1540344794796, "user_id": "", "registration": 1540919166796.0}
+
+    row, = local_rows([document], fields, columns)
+    values = dict(zip(fields, row))
+    assert values["item_in_session"] == 3
+    assert values["session_id"] == 39
+    assert values["length"] == 246.3
+    assert values["user_id"] is None
+    assert values["registration"] == 1540919166796
+    assert values["ts"] == datetime.utcfromtimestamp(1540344794.796)
+
+
+class CopyCursor:
+    """
+    cursor recording COPY FROM STDIN statements & the csv they read.
+    """
+
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, fileobj):
+        self.copies.append((sql, fileobj.read().decode("utf-8")))
+
+
+def test_local_rows_keeps_artist_name():
+    columns = table_columns(staging_songs_table_create)
+    fields = [name for name, _ in columns if name != "join_key"]
+    document = {"num_songs": 1, "artist_id": "ARD7TVE1187B99BFB1", "artist_latitude": None,
+                "artist_longitude": -71.06, "artist_name": "Casual", "song_id": "SOMZWCG12A8C13C480",
+                "title": "I Didn't Mean To", "duration": 218.93179, "year": 0}
+
+    row, = local_rows([document], fields, columns)
+    values = dict(zip(fields, row))
+    assert values["artist_name"] == "Casual"
+    assert values["artist_longitude"] == -71.06
+    assert values["title"] == "I Didn't Mean To"
+
+    cur = CopyCursor()
+    assert copy_local(cur, "staging_songs_raw", [row]) == 1
+    (sql, csv_text), = cur.copies
+    assert "artist_longitude, artist_name, song_id" in sql
+    assert ",-71.06,Casual,SOMZWCG12A8C13C480," in csv_text
+
+
+def test_stage_records_peak_increase():
+    results = []
+    stage(results, "allocate", lambda: len(bytearray(64 * 1024 * 1024)))
+
+    result, = results
+    assert result["rows"] == 64 * 1024 * 1024
+    assert result["peak_rss_increase_mb"] >= 0
+    assert result["peak_rss_mb"] >= result["peak_rss_increase_mb"]
+
+
+def test_compare_commits(tmp_path):
+    results_file = tmp_path / "results.jsonl"
+    runs = [
+        {"commit": "aaaa1111", "scale": 1, "stages": [{"stage": "songplays", "elapsed": 4.0},
+                                                      {"stage": "time", "elapsed": 2.0}]},
+        {"commit": "bbbb2222", "scale": 1, "stages": [{"stage": "staging_songplays", "elapsed": 3.0},
+                                                      {"stage": "songplays", "elapsed": 1.0},
+                                                      {"stage": "time", "elapsed": 0.5}]},
+    ]
+    results_file.write_text("".join(json.dumps(run) + "\n" for run in runs))
+
+    rows = compare_commits(str(results_file), "aaaa", "bbbb")
+    assert rows == [(1, "songplays", 4.0, 1.0), (1, "time", 2.0, 0.5), (1, "staging_songplays", None, 3.0)]
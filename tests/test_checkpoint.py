@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import checkpoint
+
+
+@pytest.fixture(autouse=True)
+def no_run(monkeypatch):
+    """
+    restores the checkpointed run (module state) after each test.
+    """
+    monkeypatch.setattr(checkpoint, "RUN_ID", None)
+    monkeypatch.setattr(checkpoint, "FINGERPRINT", None)
+    monkeypatch.setattr(checkpoint, "COMPLETED", set())
+
+
+class RecordingCursor:
+    """
+    cursor recording statements, answering fetches with given rows.
+    """
+
+    def __init__(self, rows=()):
+        self.executed = []
+        self.rows = list(rows)
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        return self.rows.pop(0) if self.rows else []
+
+
+def put(s3, key, body="{}"):
+    s3.Object("udacity-dend", key).put(Body=body.encode("utf-8"))
+
+
+def test_fingerprint_changes_with_source_objects(s3, config):
+    put(s3, "log_data/2018/11/2018-11-01-events.json")
+    before = checkpoint.run_fingerprint(config, "full", s3)
+    assert checkpoint.run_fingerprint(config, "full", s3) == before
+
+    put(s3, "song_data/A/A/A/TRAAA.json")
+    assert checkpoint.run_fingerprint(config, "full", s3) != before
+
+
+def test_fingerprint_ignores_tuning_options(config):
+    before = checkpoint.run_fingerprint(config)
+    config.set("ETL", "COPY_WORKERS", "8")
+    assert checkpoint.run_fingerprint(config) == before
+    assert checkpoint.run_fingerprint(config, "shadow") != before
+
+
+def test_new_run_records_its_start(config):
+    cur = RecordingCursor()
+    run_id = checkpoint.start_run(cur, config)
+
+    assert run_id is not None
+    (query, params), = cur.executed
+    assert params["run_id"] == run_id and params["step"] == checkpoint.START_STEP
+
+
+def test_resume_skips_completed_steps(config):
+    cur = RecordingCursor([("abc",), [("start",), ("COPY staging_events_raw",)]])
+    assert checkpoint.start_run(cur, config, resume=True) == "abc"
+    assert checkpoint.is_completed("COPY staging_events_raw")
+    assert not checkpoint.is_completed("COPY staging_songs_raw")
+
+
+def test_resume_without_unfinished_run(config):
+    assert checkpoint.start_run(RecordingCursor(), config, resume=True) is None
+    assert checkpoint.RUN_ID is None
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from column_profiler import varchar_size, profile_table, tighten_ddl, TABLE_DDL, MAX_VARCHAR
+
+
+class StagingSongsCursor:
+    """
+    cursor answering the sampling query & ANALYZE COMPRESSION of the staging_songs table.
+    """
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchone(self):
+        # max length per string column: artist_id, artist_location, artist_name, song_id, title, join_key
+        return (18, 40, 120, 18, 90, 32)
+
+    def fetchall(self):
+        return [("staging_songs", "artist_longitude", "raw", 0.0), ("staging_songs", "artist_name", "lzo", 40.0)]
+
+
+class ProfileCursor:
+    """
+    cursor answering the sampling query & ANALYZE COMPRESSION of the artists table.
+    """
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchone(self):
+        # max length per string column: artist_id, name, location
+        return (18, 90, 40)
+
+    def fetchall(self):
+        return [("artists", "artist_id", "lzo", 20.0), ("artists", "name", "zstd", 35.0),
+                ("artists", "location", "bytedict", 60.0), ("artists", "latitude", "az64", 10.0),
+                ("artists", "longitude", "az64", 10.0)]
+
+
+def test_varchar_size():
+    assert varchar_size(None) == 16
+    assert varchar_size(12) == 16
+    assert varchar_size(13) == 32
+    assert varchar_size(90) == 128
+    assert varchar_size(100000) == MAX_VARCHAR
+
+
+def test_profile_table():
+    cur = ProfileCursor()
+    profile = profile_table(cur, "artists", sample=0.5)
+
+    assert profile["name"] == {"max_length": 90, "encoding": "zstd"}
+    assert profile["latitude"] == {"max_length": None, "encoding": "az64"}
+    (sample_query, params), (compression_query, _) = cur.executed
+    assert "MAX(OCTET_LENGTH(name))" in sample_query and params == (0.5,)
+    assert "latitude" not in sample_query and "DISTINCT" not in sample_query
+    assert compression_query.startswith("ANALYZE COMPRESSION artists")
+
+
+def test_profile_staging_songs():
+    profile = profile_table(StagingSongsCursor(), "staging_songs")
+
+    assert profile["artist_name"] == {"max_length": 120, "encoding": "lzo"}
+    assert profile["artist_longitude"] == {"max_length": None, "encoding": "raw"}
+    ddl = tighten_ddl(TABLE_DDL["staging_songs"], profile)
+    assert "artist_longitude FLOAT ENCODE raw," in ddl
+    assert "artist_name VARCHAR(256) ENCODE lzo," in ddl
+
+
+def test_tighten_ddl():
+    ddl = tighten_ddl(TABLE_DDL["artists"], profile_table(ProfileCursor(), "artists"))
+
+    assert "artist_id VARCHAR(32) ENCODE RAW PRIMARY KEY SORTKEY," in ddl  # sort key stays raw
+    assert "name VARCHAR(128) ENCODE zstd NOT NULL," in ddl
+    assert "location VARCHAR(64) ENCODE bytedict," in ddl
+    assert "latitude FLOAT ENCODE az64," in ddl
+
+
+def test_tighten_ddl_identity():
+    profile = {"songplay_id": {"max_length": None, "encoding": "az64"}}
+    ddl = tighten_ddl(TABLE_DDL["songplays"], profile)
+    assert "songplay_id INT IDENTITY(0,1) ENCODE RAW PRIMARY KEY SORTKEY DISTKEY," in ddl
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+from compaction import plan_chunks, chunk_size, compact_chunk
+
+MB = 1024 * 1024
+
+
+def sizes(chunks):
+    return [chunk_size(chunk) for chunk in chunks]
+
+
+def test_plan_chunks_multiple_of_slices():
+    keys = [("log_data/{:04d}.json".format(i), MB) for i in range(1000)]
+    chunks = plan_chunks(keys, num_slices=4, max_chunk_size=100 * MB, min_chunk_size=10 * MB)
+
+    assert len(chunks) == 12  # 1000 MB in chunks of at most 100 MB, rounded up to a multiple of 4
+    assert all(80 * MB <= size <= 100 * MB for size in sizes(chunks))
+    assert sorted(key for chunk in chunks for key, _ in chunk) == sorted(key for key, _ in keys)
+
+
+def test_plan_chunks_largest_first():
+    keys = [("song_data/{:04d}.json".format(i), (i % 7 + 1) * MB) for i in range(50)]
+    chunks = plan_chunks(keys, num_slices=4, max_chunk_size=64 * MB)
+    assert sizes(chunks) == sorted(sizes(chunks), reverse=True)
+
+
+def test_plan_chunks_fewer_chunks_under_minimum():
+    keys = [("log_data/{:04d}.json".format(i), MB) for i in range(30)]
+
+    # 30 MB over 8 slices would make 8 chunks of about 4 MB
+    assert len(plan_chunks(keys, num_slices=8, max_chunk_size=256 * MB)) == 8
+    chunks = plan_chunks(keys, num_slices=8, max_chunk_size=256 * MB, min_chunk_size=10 * MB)
+    assert sizes(chunks) == [10 * MB] * 3
+
+    chunks = plan_chunks(keys, num_slices=2, max_chunk_size=256 * MB, min_chunk_size=64 * MB)
+    assert sizes(chunks) == [30 * MB]  # everything in one chunk
+
+
+def test_plan_chunks_merges_tiny_chunks():
+    # one large object: the other chunks only get the small ones
+    keys = [("big.json", 90 * MB)] + [("small{}.json".format(i), MB) for i in range(6)]
+    chunks = plan_chunks(keys, num_slices=2, max_chunk_size=100 * MB, min_chunk_size=20 * MB)
+    assert sizes(chunks) == [96 * MB]
+
+    # merged only while under the maximum
+    chunks = plan_chunks(keys, num_slices=2, max_chunk_size=90 * MB, min_chunk_size=20 * MB)
+    assert sizes(chunks) == [90 * MB, 6 * MB]
+
+
+def test_plan_chunks_empty_source():
+    assert plan_chunks([], num_slices=4, max_chunk_size=MB, min_chunk_size=MB) == []
+
+
+def test_compact_chunk(s3):
+    bucket = s3.Bucket("udacity-dend")
+    bucket.put_object(Key="log_data/a.json", Body=b'{"a": 1}\n{"a": 2}')  # no final new line
+    bucket.put_object(Key="log_data/b.json", Body=b'{"b": 3}\n')
+
+    key, size = compact_chunk(s3, "udacity-dend", [("log_data/a.json", 17), ("log_data/b.json", 9)],
+                              "s3://sparkify-etl/staging/log_data/part-00000.json.gz")
+
+    assert key == "staging/log_data/part-00000.json.gz"
+    body = s3.Object("sparkify-etl", key).get()["Body"].read()
+    assert len(body) == size
+    assert gzip.decompress(body) == b'{"a": 1}\n{"a": 2}\n{"b": 3}\n'
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from converter import table_columns, cast_value, convert_records, join_key
+from sql_queries import (staging_events_table_create, staging_songs_table_create, staging_events_raw_table_create,
+                         staging_songs_raw_table_create)
+
+
+def test_table_columns_staging_songs():
+    assert table_columns(staging_songs_table_create) == [
+        ("num_songs", "INT"), ("artist_id", "VARCHAR"), ("artist_location", "VARCHAR"),
+        ("artist_latitude", "FLOAT"), ("artist_longitude", "FLOAT"), ("artist_name", "VARCHAR"),
+        ("song_id", "VARCHAR"), ("title", "VARCHAR"), ("duration", "FLOAT"), ("year", "INT"), ("join_key", "CHAR")]
+
+
+def test_table_columns_staging_events():
+    columns = table_columns(staging_events_table_create)
+    assert [name for name, _ in columns] == [
+        "artist", "auth", "first_name", "gender", "item_in_session", "last_name", "length", "level", "location",
+        "method", "page", "registration", "session_id", "song", "status", "ts", "user_agent", "user_id", "join_key"]
+    assert dict(columns)["song"] == "VARCHAR"
+    assert dict(columns)["registration"] == "BIGINT"
+    assert dict(columns)["ts"] == "TIMESTAMP"
+
+
+@pytest.mark.parametrize("staging, raw", [(staging_events_table_create, staging_events_raw_table_create),
+                                          (staging_songs_table_create, staging_songs_raw_table_create)])
+def test_table_columns_raw_match_staging(staging, raw):
+    # converted files are COPYed into the raw tables, then inserted into the staging ones
+    assert table_columns(raw) == table_columns(staging)
+
+
+def test_table_columns_skips_constraints():
+    ddl = "CREATE TABLE t (\n    a INT NOT NULL,\n    b VARCHAR(10) ,  \n    PRIMARY KEY (a)\n    );"
+    assert table_columns(ddl) == [("a", "INT"), ("b", "VARCHAR")]
+
+
+def test_cast_value():
+    assert cast_value("", "INT") is None
+    assert cast_value(None, "VARCHAR") is None
+    assert cast_value("39", "INT") == 39
+    assert cast_value(1540919166796.0, "BIGINT") == 1540919166796
+    assert cast_value(1540344794796, "TIMESTAMP") == 1540344794796
+    assert cast_value("-93.1", "FLOAT") == -93.1
+    assert cast_value(1969, "VARCHAR") == "1969"
+
+
+def test_convert_records_staging_songs():
+    columns = table_columns(staging_songs_table_create)
+    fields = [name for name, _ in columns if name != "join_key"]
+    document = {"num_songs": 1, "artist_id": "ARJIE2Y1187B994AB7", "artist_location": "",
+                "artist_latitude": None, "artist_longitude": "-93.1", "artist_name": "Line Renaud",
+                "song_id": "SOUPIRU12A6D4FA1E1", "title": "Der Kleine Dompfaff ", "duration": 152.92036, "year": 0}
+
+    row, = convert_records([document], fields, ("title", "artist_name"), [sql_type for _, sql_type in columns])
+    assert len(row) == len(columns)
+    values = dict(zip([name for name, _ in columns], row))
+    assert values["artist_name"] == "Line Renaud"
+    assert values["artist_location"] is None
+    assert values["artist_longitude"] == -93.1
+    assert values["join_key"] == join_key("der kleine dompfaff", "LINE RENAUD")
+
+
+def test_convert_records_staging_events():
+    columns = table_columns(staging_events_table_create)
+    fields = [name for name, _ in columns if name != "join_key"]
+    document = {"artist": "Des'ree", "song": "You Gotta Be", "page": "NextSong",
+                "user_id": "39", "ts": 1540344794796}
+
+    row, = convert_records([document], fields, ("song", "artist"), [sql_type for _, sql_type in columns])
+    values = dict(zip([name for name, _ in columns], row))
+    assert values["user_id"] == 39
+    assert values["session_id"] is None
+    assert values["join_key"] == join_key("You Gotta Be", "Des'ree")
+
+
+def test_join_key_needs_both_values():
+    assert join_key("title", None) is None
+    assert join_key(" Title", "Artist ") == join_key("title", "artist")
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+from datetime import datetime
+from converter import parse_jsonpaths, table_columns
+from datagen import zipf_index, song, day_events, generate, open_local, open_s3
+from sql_queries import staging_events_table_create
+
+
+def read_tree(root):
+    return {str(path.relative_to(root)): path.read_text() for path in root.rglob("*") if path.is_file()}
+
+
+def test_zipf_index():
+    rng = random.Random(0)
+    draws = [zipf_index(rng, 100, 1.1) for _ in range(10000)]
+    assert 0 <= min(draws) and max(draws) < 100
+    assert draws.count(0) > draws.count(50) * 10  # popular items drawn far more often
+    assert zipf_index(random.Random(0), 1, 1.0) == 0
+
+
+def test_same_seed_same_data(tmp_path):
+    for name in ("a", "b"):
+        generate(lambda key, name=name: open_local(str(tmp_path / name), key), seed=7, n_songs=20, n_artists=5,
+                 n_days=2, events_per_day=50)
+    assert read_tree(tmp_path / "a") == read_tree(tmp_path / "b")
+
+    generate(lambda key: open_local(str(tmp_path / "c"), key), seed=8, n_songs=20, n_artists=5, n_days=2,
+             events_per_day=50)
+    assert read_tree(tmp_path / "a") != read_tree(tmp_path / "c")
+
+
+def test_generate_layout(tmp_path):
+    songs, events = generate(lambda key: open_local(str(tmp_path), key), n_songs=10, n_artists=3, n_days=3,
+                             events_per_day=20, songs_per_file=4)
+    assert (songs, events) == (10, 60)
+
+    fields = parse_jsonpaths((tmp_path / "log_json_path.json").read_text())
+    assert len(fields) == len(table_columns(staging_events_table_create)) - 1  # all but join_key
+
+    files = read_tree(tmp_path)
+    assert sorted(key for key in files if key.startswith("log_data")) == [
+        "log_data/2018/11/2018-11-01-events.json", "log_data/2018/11/2018-11-02-events.json",
+        "log_data/2018/11/2018-11-03-events.json"]
+    song_files = [key for key in files if key.startswith("song_data")]
+    assert len(song_files) == 3
+    assert sum(len(files[key].splitlines()) for key in song_files) == 10
+
+
+def test_day_events_match_catalog():
+    start = datetime(2018, 11, 1)
+    events = list(day_events(0, 0, start, 500, n_users=10, n_songs=50, n_artists=10, match_rate=1.0, skew=1.1))
+    catalog = {(played["title"], played["artist_name"]) for played in (song(0, i, 10) for i in range(50))}
+
+    plays = [event for event in events if event["page"] == "NextSong"]
+    assert plays and all((event["song"], event["artist"]) in catalog for event in plays)
+    assert [event["ts"] for event in events] == sorted(event["ts"] for event in events)
+    assert all(event["userId"] in {str(i + 1) for i in range(10)} for event in events)
+
+
+def test_open_s3(s3):
+    with open_s3(s3, "s3://sparkify-etl/generated/", "log_data/day.json") as output:
+        output.write(json.dumps({"page": "NextSong"}) + "\n")
+    body = s3.Object("sparkify-etl", "generated/log_data/day.json").get()["Body"].read()
+    assert json.loads(body) == {"page": "NextSong"}
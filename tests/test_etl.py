@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import CancelledError
+from datetime import datetime
+from time import perf_counter
+import psycopg2
+import pytest
+import checkpoint
+import db
+from etl import run_statement, run_concurrently, truncate_staging_tables, TRUNCATE_STEP
+from benchmark import strip_redshift
+from sql_queries import truncate_staging_queries, staging_events_table_create, user_table_create, user_table_upsert
+
+
+@pytest.fixture
+def pool(pg_config):
+    """
+    pooled connections to the local postgres, with an empty test table.
+    """
+    conn = db.connect(pg_config)
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS etl_test; CREATE TABLE etl_test (id INT);")
+    conn.commit()
+
+    pool = db.ConnectionPool(pg_config, 3)
+    yield pool
+    pool.closeall()
+
+    cur.execute("DROP TABLE IF EXISTS etl_test;")
+    conn.commit()
+    conn.close()
+
+
+def count_rows(pg_config, where="TRUE"):
+    conn = db.connect(pg_config)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM etl_test WHERE {};".format(where))
+    rows = cur.fetchone()[0]
+    conn.close()
+    return rows
+
+
+def test_run_statement_commits(pool, pg_config):
+    running = db.RunningStatements()
+    assert run_statement(pool, "INSERT INTO etl_test VALUES (1);", running) >= 0
+    assert running.conns == {}
+    assert count_rows(pg_config) == 1
+
+
+def test_run_statement_not_started_once_cancelled(pool, pg_config):
+    running = db.RunningStatements()
+    running.cancel()
+    with pytest.raises(CancelledError):
+        run_statement(pool, "INSERT INTO etl_test VALUES (1);", running)
+    assert count_rows(pg_config) == 0
+
+
+def test_run_concurrently(pool, pg_config):
+    queries = ["INSERT INTO etl_test VALUES ({});".format(i) for i in range(4)]
+    timings = run_concurrently(pool, queries, max_workers=2)
+    assert [query for query, _ in timings] == queries
+    assert count_rows(pg_config) == 4
+
+
+def test_run_concurrently_cancels_on_failure(pool, pg_config):
+    queries = ["INSERT INTO etl_test SELECT 1 FROM pg_sleep(30);",
+               "INSERT INTO missing_table VALUES (1);",
+               "INSERT INTO etl_test VALUES (2);"]
+
+    start = perf_counter()
+    with pytest.raises(psycopg2.Error):
+        run_concurrently(pool, queries, max_workers=2)
+    assert perf_counter() - start < 30  # running statement cancelled
+    assert count_rows(pg_config, "id = 1") == 0
+
+
+class RecordingConnection:
+    """
+    connection & cursor recording statements & commits (no database).
+    """
+
+    def __init__(self):
+        self.executed = []
+        self.commits = 0
+        self.connection = self
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_truncate_staging_tables(monkeypatch):
+    monkeypatch.setattr(checkpoint, "RUN_ID", "abc")
+    monkeypatch.setattr(checkpoint, "COMPLETED", set())
+    conn = RecordingConnection()
+
+    truncate_staging_tables(conn, conn)
+    assert conn.executed[:-1] == truncate_staging_queries  # then its checkpoint
+    assert checkpoint.is_completed(TRUNCATE_STEP) and conn.commits == 1
+
+    # resumed after it: staging rows already loaded are kept
+    conn.executed = []
+    truncate_staging_tables(conn, conn)
+    assert conn.executed == []
+
+
+@pytest.fixture
+def upsert_conn(pg_config):
+    """
+    connection to the local postgres with temporary (per connection) staging_events & users tables.
+    """
+    conn = db.connect(pg_config)
+    cur = conn.cursor()
+    for query in (staging_events_table_create, user_table_create):
+        cur.execute(strip_redshift(query).replace("CREATE TABLE IF NOT EXISTS", "CREATE TEMP TABLE"))
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def load_users(conn, events):
+    """
+    loads events (user_id, level, ts) into staging_events & upserts users from them.
+    """
+    cur = conn.cursor()
+    cur.execute("TRUNCATE staging_events;")
+    for user_id, level, ts in events:
+        cur.execute("INSERT INTO staging_events (user_id, first_name, last_name, gender, level, ts) "
+                    "VALUES (%s, 'Lily', 'Koch', 'F', %s, %s);", (user_id, level, ts))
+    cur.execute(user_table_upsert)
+    conn.commit()
+    cur.execute("SELECT user_id, level FROM users ORDER BY user_id;")
+    return cur.fetchall()
+
+
+def test_user_upsert_keeps_latest_level(upsert_conn):
+    assert load_users(upsert_conn, [(15, "free", datetime(2018, 11, 1, 10)), (16, "free", datetime(2018, 11, 1, 11))]) \
+        == [(15, "free"), (16, "free")]
+
+    # user 15 switched to paid: one row, with the level of its latest event
+    assert load_users(upsert_conn, [(15, "free", datetime(2018, 11, 2, 9)), (15, "paid", datetime(2018, 11, 2, 10))]) \
+        == [(15, "paid"), (16, "free")]
+
+    # same batch again: still one row per user
+    assert load_users(upsert_conn, [(15, "free", datetime(2018, 11, 2, 9)), (15, "paid", datetime(2018, 11, 2, 10))]) \
+        == [(15, "paid"), (16, "free")]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import io
+import pytest
+import fetch
+from fetch import iter_batches, unload, iter_unloaded, delete_unloaded, require_pyarrow
+
+
+class NamedCursor:
+    """
+    server-side cursor over given rows.
+    """
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = list(rows)
+        self.description = [("user_id",), ("level",)]
+        self.executed = []
+        self.closed = False
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FetchConnection:
+    """
+    connection handing out one named cursor over given rows.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.cursors = []
+
+    def cursor(self, name=None):
+        self.cursors.append(NamedCursor(name, self.rows))
+        return self.cursors[-1]
+
+
+class RecordingCursor:
+    """
+    cursor recording statements.
+    """
+
+    def __init__(self):
+        self.executed = []
+        self.rowcount = -1
+        self.connection = self
+        self.server_version = 80002
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+
+
+def test_iter_batches():
+    conn = FetchConnection([(i, "free") for i in range(5)])
+    batches = list(iter_batches(conn, "SELECT user_id, level FROM users WHERE level = %s", ("free",), batch_size=2))
+
+    assert [len(rows) for _, rows in batches] == [2, 2, 1]
+    assert batches[0][0] == ["user_id", "level"]
+    cur, = conn.cursors
+    assert cur.name.startswith("fetch_") and cur.executed == [("SELECT user_id, level FROM users WHERE level = %s",
+                                                               ("free",))]
+    assert cur.closed
+
+
+def test_iter_batches_closes_cursor_when_stopped():
+    conn = FetchConnection([(i, "free") for i in range(5)])
+    batches = iter_batches(conn, "SELECT user_id, level FROM users", batch_size=2)
+    next(batches)
+    batches.close()
+    assert conn.cursors[0].closed
+
+
+def test_unload(config):
+    cur = RecordingCursor()
+    url = unload(cur, config, "SELECT * FROM users WHERE level = 'paid';", parallel=False, max_file_mb=64)
+
+    assert url.startswith("s3://sparkify-etl/unload/") and url.endswith("/")
+    query, = cur.executed
+    assert "UNLOAD ('SELECT * FROM users WHERE level = ''paid''')" in query
+    assert "TO '{}'".format(url) in query
+    assert "PARALLEL OFF" in query and "MAXFILESIZE 64 MB" in query
+
+
+def test_require_pyarrow(monkeypatch):
+    monkeypatch.setattr(fetch, "pyarrow", None)
+    with pytest.raises(ImportError):
+        require_pyarrow()
+
+
+def put_parquet(s3, key, values):
+    import pyarrow
+    import pyarrow.parquet
+
+    output = io.BytesIO()
+    pyarrow.parquet.write_table(pyarrow.table({"user_id": values}), output)
+    s3.Object("sparkify-etl", key).put(Body=output.getvalue())
+
+
+def test_iter_unloaded(s3):
+    pytest.importorskip("pyarrow")
+    put_parquet(s3, "unload/run/0000_part_00.parquet", [1, 2, 3])
+    put_parquet(s3, "unload/run/0001_part_00.parquet", [4, 5])
+    s3.Object("sparkify-etl", "unload/run/0002_part_00.parquet").put(Body=b"")  # slice without rows
+
+    batches = list(iter_unloaded(s3, "s3://sparkify-etl/unload/run/", batch_size=2, workers=2))
+    assert [batch.column(0).to_pylist() for batch in batches] == [[1, 2], [3], [4, 5]]
+
+    delete_unloaded(s3, "s3://sparkify-etl/unload/run/")
+    assert list(s3.Bucket("sparkify-etl").objects.all()) == []
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+import incremental
+from incremental import list_new_objects, source_watermarks, incremental_copy_queries
+from sql_queries import staging_songplays_insert, staging_songplays_insert_incremental
+
+
+LOG_URL = "s3://udacity-dend/log_data"
+SONG_URL = "s3://udacity-dend/song_data"
+
+
+class WatermarkCursor:
+    """
+    cursor answering watermark_select from a dict.
+    """
+
+    def __init__(self, watermarks):
+        self.watermarks = watermarks
+        self.row = None
+
+    def execute(self, query, params=None):
+        self.row = (self.watermarks[params[0]],) if params[0] in self.watermarks else None
+
+    def fetchone(self):
+        return self.row
+
+
+def put(s3, key, body="{}"):
+    s3.Object("udacity-dend", key).put(Body=body.encode("utf-8"))
+
+
+def test_log_data_watermark_is_last_key(s3):
+    put(s3, "log_data/2018/11/2018-11-01-events.json")
+    put(s3, "log_data/2018/11/2018-11-02-events.json")
+
+    keys, watermark = list_new_objects(s3, LOG_URL, "log_data")
+    assert [key for key, _ in keys] == ["log_data/2018/11/2018-11-01-events.json",
+                                        "log_data/2018/11/2018-11-02-events.json"]
+    assert watermark == "log_data/2018/11/2018-11-02-events.json"
+
+    put(s3, "log_data/2018/11/2018-11-03-events.json")
+    keys, watermark = list_new_objects(s3, LOG_URL, "log_data", watermark)
+    assert [key for key, _ in keys] == ["log_data/2018/11/2018-11-03-events.json"]
+    assert watermark == "log_data/2018/11/2018-11-03-events.json"
+
+
+def test_song_data_watermark_is_modification_time(s3):
+    put(s3, "song_data/B/B/B/TRBBB.json")
+    _, watermark = list_new_objects(s3, SONG_URL, "song_data")
+
+    # sorts before the last key loaded: missed by a key watermark
+    put(s3, "song_data/A/A/A/TRAAA.json")
+    obj = s3.Object("udacity-dend", "song_data/A/A/A/TRAAA.json")
+    keys, new_watermark = list_new_objects(s3, SONG_URL, "song_data", watermark)
+    assert "song_data/A/A/A/TRAAA.json" in [key for key, _ in keys]
+    assert new_watermark == obj.last_modified.isoformat()
+
+
+def test_song_data_legacy_key_watermark_reloads_everything(s3):
+    put(s3, "song_data/A/A/A/TRAAA.json")
+    keys, _ = list_new_objects(s3, SONG_URL, "song_data", "song_data/Z/Z/Z/TRZZZ.json")
+    assert [key for key, _ in keys] == ["song_data/A/A/A/TRAAA.json"]
+
+
+def test_source_watermarks(s3, config):
+    put(s3, "log_data/2018/11/2018-11-01-events.json")
+    put(s3, "song_data/A/A/A/TRAAA.json")
+
+    watermarks = source_watermarks(config, s3)
+    assert watermarks["log_data"] == "log_data/2018/11/2018-11-01-events.json"
+    assert watermarks["song_data"] == s3.Object("udacity-dend", "song_data/A/A/A/TRAAA.json").last_modified.isoformat()
+
+
+def test_incremental_copy_queries_only_new_files(s3, config):
+    put(s3, "log_data/2018/11/2018-11-01-events.json")
+    put(s3, "log_data/2018/11/2018-11-02-events.json")
+    put(s3, "song_data/A/A/A/TRAAA.json")
+    watermarks = source_watermarks(config, s3)
+
+    cur = WatermarkCursor({"log_data": "log_data/2018/11/2018-11-01-events.json",
+                           "song_data": watermarks["song_data"]})
+    queries, new_watermarks = incremental_copy_queries(config, s3, cur)
+
+    assert new_watermarks["log_data"] == "log_data/2018/11/2018-11-02-events.json"
+    manifest = json.loads(s3.Object("sparkify-etl", "manifests/log_data.manifest").get()["Body"].read())
+    assert [entry["url"] for entry in manifest["entries"]] == [
+        "s3://udacity-dend/log_data/2018/11/2018-11-02-events.json"]
+    assert all("MANIFEST" in query for query in queries)
+
+
+def test_load_incremental_nothing_new(s3, config, monkeypatch):
+    monkeypatch.setattr(incremental, "incremental_copy_queries", lambda config, s3, cur: ([], {}))
+    assert incremental.load_incremental(config, s3, None, None) == {}
+
+
+def test_incremental_match_same_as_full():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+CREATE TABLE staging_events (ts INT, user_id INT, level TEXT, session_id INT, location TEXT, user_agent TEXT,
+    page TEXT, join_key TEXT);
+CREATE TABLE staging_songs (song_id TEXT, title TEXT, artist_id TEXT, year INT, duration REAL, join_key TEXT);
+CREATE TABLE songs (song_id TEXT, title TEXT, artist_id TEXT, year INT, duration REAL, join_key TEXT);
+CREATE TABLE artists (artist_id TEXT, name TEXT);
+CREATE TABLE songplays (songplay_id INTEGER PRIMARY KEY, start_time INT, user_id INT, session_id INT);
+CREATE TABLE staging_songplays (ts INT, user_id INT, level TEXT, song_id TEXT, artist_id TEXT, session_id INT,
+    location TEXT, user_agent TEXT);
+""")
+    # the artist row kept another spelling of the name than this song's artist_name
+    conn.execute("INSERT INTO staging_songs VALUES ('SO1', 'Intro', 'AR1', 2004, 160.0, 'key-intro-casual');")
+    conn.execute("INSERT INTO artists VALUES ('AR1', 'Casual feat. Nobody');")
+    conn.execute("INSERT INTO songs SELECT * FROM staging_songs;")  # as song_table_upsert
+    conn.executemany("INSERT INTO staging_events VALUES (?, 7, 'free', 1, NULL, NULL, 'NextSong', ?);",
+                     [(1000, "key-intro-casual"), (2000, "key-other")])
+
+    matched = []
+    for query in (staging_songplays_insert, staging_songplays_insert_incremental):
+        conn.execute("DELETE FROM staging_songplays;")
+        conn.execute(query)
+        matched.append(conn.execute("SELECT ts, song_id, artist_id FROM staging_songplays;").fetchall())
+    assert matched[0] == matched[1] == [(1000, "SO1", "AR1")]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from botocore.exceptions import ClientError
+import lifecycle
+from clean_redshift import delete_redshift_cluster
+from lifecycle import wait_for_snapshot, teardown, restore_redshift_cluster
+
+
+class SnapshotClient:
+    """
+    redshift client answering describe_cluster_snapshots with given statuses (none: not found yet).
+    """
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def describe_cluster_snapshots(self, SnapshotIdentifier):
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        if status is None:
+            raise ClientError({"Error": {"Code": "ClusterSnapshotNotFound", "Message": "not found"}},
+                              "DescribeClusterSnapshots")
+        return {"Snapshots": [{"SnapshotIdentifier": SnapshotIdentifier, "Status": status}]}
+
+
+@pytest.fixture
+def cluster(aws, config, tmp_path, monkeypatch):
+    """
+    mocked cluster with a previous snapshot; dwh.cfg written to a temporary directory.
+    """
+    ec2, iam, redshift = aws
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(lifecycle, "sleep", lambda seconds: None)
+    redshift.create_cluster(ClusterIdentifier="dwhcluster", NodeType="dc2.large", MasterUsername="dwhuser",
+                            MasterUserPassword="Passw0rd", ClusterType="single-node")
+    redshift.create_cluster_snapshot(SnapshotIdentifier="dwhcluster-previous", ClusterIdentifier="dwhcluster")
+    config.set("CLUSTER", "DWH_SNAPSHOT_IDENTIFIER", "dwhcluster-previous")
+    return redshift
+
+
+def snapshots(redshift):
+    return sorted(snapshot["SnapshotIdentifier"] for snapshot in redshift.describe_cluster_snapshots()["Snapshots"])
+
+
+def test_wait_for_snapshot(monkeypatch):
+    monkeypatch.setattr(lifecycle, "sleep", lambda seconds: None)
+    assert wait_for_snapshot(SnapshotClient([None, "creating", "available"]), "dwhcluster-1") == "available"
+    assert wait_for_snapshot(SnapshotClient(["creating"]), "dwhcluster-1", timeout=1, delay=2) == \
+        "timeout (creating)"
+
+
+def test_teardown_replaces_previous_snapshot(cluster, config, tmp_path, monkeypatch):
+    def delete_with_final_snapshot(redshift, identifier, snapshot):
+        # moto does not take the final snapshot of a deleted cluster
+        redshift.create_cluster_snapshot(SnapshotIdentifier=snapshot, ClusterIdentifier=identifier)
+        return delete_redshift_cluster(redshift, identifier)
+
+    monkeypatch.setattr(lifecycle, "delete_redshift_cluster", delete_with_final_snapshot)
+    assert teardown(config, cluster, "dwhcluster", "dwhcluster-previous") == "available"
+
+    new_snapshot = config.get("CLUSTER", "DWH_SNAPSHOT_IDENTIFIER")
+    assert new_snapshot.startswith("dwhcluster-") and new_snapshot != "dwhcluster-previous"
+    assert snapshots(cluster) == [new_snapshot]
+    assert "dwh_snapshot_identifier = {}".format(new_snapshot) in (tmp_path / "dwh.cfg").read_text()
+    assert cluster.describe_clusters()["Clusters"] == []
+
+
+def test_teardown_keeps_previous_snapshot(cluster, config, tmp_path, monkeypatch):
+    monkeypatch.setattr(lifecycle, "wait_for_snapshot", lambda redshift, identifier: "failed")
+
+    assert teardown(config, cluster, "dwhcluster", "dwhcluster-previous") == "failed"
+    assert "dwhcluster-previous" in snapshots(cluster)
+    assert config.get("CLUSTER", "DWH_SNAPSHOT_IDENTIFIER") == "dwhcluster-previous"
+    assert not (tmp_path / "dwh.cfg").exists()
+
+
+def test_teardown_without_cluster(aws, config):
+    ec2, iam, redshift = aws
+    assert teardown(config, redshift, "missing", "dwhcluster-previous") is None
+
+
+def test_restore_with_parameter_group(cluster):
+    cluster.create_cluster_parameter_group(ParameterGroupName="dwhcluster-wlm", ParameterGroupFamily="redshift-1.0",
+                                           Description="test")
+    cluster.delete_cluster(ClusterIdentifier="dwhcluster", SkipFinalClusterSnapshot=True)
+
+    info = restore_redshift_cluster(cluster, "dwhcluster", "dwhcluster-previous", "dc2.large", "2", "5439",
+                                    "arn:aws:iam::123456789012:role/dwhRole", "dwhcluster-wlm")
+    assert [group["ParameterGroupName"] for group in info["ClusterParameterGroups"]] == ["dwhcluster-wlm"]
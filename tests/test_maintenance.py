@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import psycopg2.extensions
+from maintenance import plan_maintenance, run_maintenance
+
+
+class MaintenanceConnection:
+    """
+    autocommit connection recording the statement timeouts set on it.
+    """
+
+    def __init__(self, cancelled=()):
+        self.timeouts = []
+        self.executed = []
+        self.cancelled = set(cancelled)
+        self.server_version = 80002
+
+    def cursor(self):
+        return MaintenanceCursor(self)
+
+    def commit(self):
+        pass
+
+
+class MaintenanceCursor:
+    """
+    cursor raising QueryCanceledError (as a statement timeout does) for the given statements.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        if query.startswith("SET statement_timeout"):
+            self.connection.timeouts.append(params[0])
+            return
+        if query in self.connection.cancelled:
+            raise psycopg2.extensions.QueryCanceledError("canceling statement due to statement timeout")
+        self.connection.executed.append(query)
+
+
+def health(table, rows=100000, unsorted=0.0, deleted=0.0, stats_off=0.0):
+    return {"table": table, "rows": rows, "unsorted": unsorted, "deleted": deleted, "stats_off": stats_off}
+
+
+def test_plan_maintenance():
+    actions = plan_maintenance([health("songplays", unsorted=50, deleted=20), health("users", stats_off=30),
+                                health("time", rows=10, unsorted=90), health("songs")])
+    assert [query for _, _, query, _ in actions] == ["VACUUM FULL songplays;", "ANALYZE users PREDICATE COLUMNS;"]
+
+
+def test_run_maintenance_sets_remaining_budget():
+    conn = MaintenanceConnection()
+    actions = [(2, "songplays", "VACUUM SORT ONLY songplays;", "unsorted"),
+               (1, "users", "ANALYZE users PREDICATE COLUMNS;", "stats off")]
+
+    report = run_maintenance(conn.cursor(), actions, time_budget=60)
+    assert [step["status"] for step in report] == ["done", "done"]
+    assert len(conn.timeouts) == 2 and all(0 < timeout <= 60000 for timeout in conn.timeouts)
+
+
+def test_run_maintenance_skips_rest_after_timeout():
+    conn = MaintenanceConnection(cancelled=["VACUUM SORT ONLY songplays;"])
+    actions = [(3, "songplays", "VACUUM SORT ONLY songplays;", "unsorted"),
+               (2, "users", "ANALYZE users PREDICATE COLUMNS;", "stats off"),
+               (1, "songs", "VACUUM DELETE ONLY songs;", "deleted")]
+
+    report = run_maintenance(conn.cursor(), actions, time_budget=60)
+    assert [step["status"] for step in report] == ["cancelled (budget)", "skipped (budget)", "skipped (budget)"]
+    assert conn.executed == []
+
+
+def test_run_maintenance_no_budget():
+    conn = MaintenanceConnection()
+    report = run_maintenance(conn.cursor(), [(1, "songs", "VACUUM DELETE ONLY songs;", "deleted")], time_budget=0)
+    assert report[0]["status"] == "skipped (budget)"
+    assert conn.timeouts == [] and conn.executed == []
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from manifest import (get_slice_count, parse_s3_url, list_objects, balance_keys, interleave, write_manifest,
+                      full_copy_queries)
+
+
+def put(s3, key, size):
+    s3.Object("udacity-dend", key).put(Body=b"x" * size)
+
+
+def test_get_slice_count():
+    assert get_slice_count("dc2.large", "4") == 8
+    assert get_slice_count("DC2.8XLARGE", 2) == 32
+    assert get_slice_count("unknown", 3) == 6
+
+
+def test_parse_s3_url():
+    assert parse_s3_url("'s3://udacity-dend/log_data'") == ("udacity-dend", "log_data")
+    assert parse_s3_url("s3://sparkify-etl") == ("sparkify-etl", "")
+    with pytest.raises(ValueError):
+        parse_s3_url("udacity-dend/log_data")
+
+
+def test_balance_keys():
+    keys = [("a", 10), ("b", 7), ("c", 5), ("d", 3), ("e", 2), ("f", 1)]
+    buckets = balance_keys(keys, 2)
+    assert sorted(sum(size for _, size in bucket) for bucket in buckets) == [14, 14]
+    assert sorted(key for bucket in buckets for key, _ in bucket) == [key for key, _ in keys]
+
+
+def test_interleave():
+    assert interleave([[("a", 3), ("c", 1)], [("b", 2)]]) == [("a", 3), ("b", 2), ("c", 1)]
+
+
+def test_list_objects(s3):
+    put(s3, "log_data/2018/11/2018-11-01-events.json", 3)
+    put(s3, "log_data/2018/11/2018-11-02-events.json", 4)
+    put(s3, "log_data/readme.txt", 1)
+
+    assert list_objects(s3, "'s3://udacity-dend/log_data'") == [("log_data/2018/11/2018-11-01-events.json", 3),
+                                                               ("log_data/2018/11/2018-11-02-events.json", 4)]
+    assert list_objects(s3, "s3://udacity-dend/log_data",
+                        start_after="log_data/2018/11/2018-11-01-events.json") == [
+        ("log_data/2018/11/2018-11-02-events.json", 4)]
+
+
+def test_write_manifest(s3):
+    url = write_manifest(s3, "udacity-dend", [("song_data/A/TRA.json", 5)], "s3://sparkify-etl/manifests/test.manifest")
+
+    assert url == "'s3://sparkify-etl/manifests/test.manifest'"
+    manifest = json.loads(s3.Object("sparkify-etl", "manifests/test.manifest").get()["Body"].read())
+    assert manifest == {"entries": [{"url": "s3://udacity-dend/song_data/A/TRA.json", "mandatory": True,
+                                     "meta": {"content_length": 5}}]}
+
+
+def test_full_copy_queries(s3, config):
+    for i in range(10):
+        put(s3, "log_data/2018/11/2018-11-{:02d}-events.json".format(i + 1), 100 + i)
+        put(s3, "song_data/A/A/TR{}.json".format(i), 10 + i)
+
+    queries = full_copy_queries(config, s3)
+
+    assert len(queries) == 2
+    assert queries[0].lstrip().startswith("COPY staging_events_raw")
+    assert "'s3://sparkify-etl/manifests/log_data.manifest'" in queries[0] and "MANIFEST" in queries[0]
+    assert queries[1].lstrip().startswith("COPY staging_songs_raw")
+    manifest = json.loads(s3.Object("sparkify-etl", "manifests/song_data.manifest").get()["Body"].read())
+    assert len(manifest["entries"]) == 10
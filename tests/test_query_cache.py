@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import datetime
+from query_cache import QueryCache, bump_table_versions, normalize_sql, referenced_tables
+from sql_queries import table_version_upsert, table_version_select
+
+
+class VersionedCursor:
+    """
+    cursor over an etl_table_versions table held in memory, answering other queries with one row.
+    """
+
+    def __init__(self):
+        self.versions = {}
+        self.queries = []
+        self.description = [("plays",)]
+        self.result = []
+
+    def execute(self, query, params=None):
+        if query == table_version_upsert:
+            self.versions[params["table_name"]] = params["loaded_at"]
+        elif query == table_version_select:
+            self.result = list(self.versions.items())
+        else:
+            self.queries.append(query)
+            self.result = [(len(self.queries),)]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT  *\n FROM Songplays WHERE level = 'Paid';") == \
+        "select * from songplays where level = 'Paid'"
+    assert referenced_tables(normalize_sql("SELECT * FROM songplays sp JOIN users u ON (sp.user_id = u.user_id)")) \
+        == ["songplays", "users"]
+
+
+def test_cached_until_tables_bumped(tmp_path):
+    cur = VersionedCursor()
+    bump_table_versions(cur, ["songplays", "users"])
+    cache = QueryCache(str(tmp_path))
+    sql = "SELECT COUNT(*) FROM songplays;"
+
+    assert cache.fetchall(cur, sql) == (["plays"], [(1,)])
+    assert cache.fetchall(cur, "select count(*)\nfrom songplays") == (["plays"], [(1,)])  # same normalized sql
+    assert len(cur.queries) == 1
+
+    bump_table_versions(cur, ["users"])  # not read by the query
+    assert cache.fetchall(cur, sql) == (["plays"], [(1,)])
+
+    cur.versions["songplays"] = datetime(2100, 1, 1)  # new load
+    assert cache.fetchall(cur, sql) == (["plays"], [(2,)])
+    assert len(cur.queries) == 2
+
+
+def test_versions_reused_within_ttl(tmp_path):
+    cur = VersionedCursor()
+    bump_table_versions(cur, ["songplays"])
+    cache = QueryCache(str(tmp_path), version_ttl=3600)
+    sql = "SELECT COUNT(*) FROM songplays;"
+
+    cache.fetchall(cur, sql)
+    cur.versions["songplays"] = datetime(2100, 1, 1)
+    assert cache.fetchall(cur, sql) == (["plays"], [(1,)])  # versions not read again yet
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cur = VersionedCursor()
+    cache = QueryCache(str(tmp_path))
+    cache.fetchall(cur, "SELECT 1 FROM songplays;")
+    first, = tmp_path.iterdir()
+    os.utime(str(first), (0, 0))  # used long ago
+    size = first.stat().st_size
+
+    cache.max_bytes = size
+    cache.fetchall(cur, "SELECT 2 FROM songplays;")
+    cache.fetchall(cur, "SELECT 1 FROM songplays;")
+    assert len(cur.queries) == 3  # first result evicted by the second one
+    assert len(list(tmp_path.iterdir())) == 1
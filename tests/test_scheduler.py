@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from time import sleep
+import pytest
+from scheduler import build_dependencies, critical_path, run_dag
+
+
+def step(name, reads=(), writes=()):
+    return {"name": name, "query": name, "reads": list(reads), "writes": list(writes)}
+
+
+STEPS = [
+    step("staging_songplays", ["staging_events", "staging_songs"], ["staging_songplays"]),
+    step("songplays", ["staging_songplays", "songplays"], ["songplays"]),
+    step("users", ["staging_events", "users"], ["users"]),
+    step("time", ["staging_songplays"], ["time"]),
+]
+
+
+def test_build_dependencies():
+    deps = build_dependencies(STEPS)
+    assert deps == {"staging_songplays": set(), "songplays": {"staging_songplays"}, "users": set(),
+                    "time": {"staging_songplays"}}
+
+
+def test_critical_path():
+    deps = build_dependencies(STEPS)
+    path, total = critical_path(STEPS, deps, {"staging_songplays": 2.0, "songplays": 3.0, "users": 4.0, "time": 1.0})
+    assert path == ["staging_songplays", "songplays"]
+    assert total == 5.0
+
+
+def test_run_dag_respects_dependencies():
+    order, lock = [], threading.Lock()
+
+    def run(step):
+        with lock:
+            order.append(step["name"])
+
+    durations = run_dag(STEPS, run, max_workers=2)
+    assert set(durations) == {s["name"] for s in STEPS}
+    assert order.index("staging_songplays") < order.index("songplays")
+    assert order.index("staging_songplays") < order.index("time")
+
+
+def test_run_dag_cancels_queued_steps_on_error():
+    independent = [step("a", writes=["a"]), step("b", writes=["b"]), step("c", writes=["c"])]
+    started = []
+
+    def run(step):
+        started.append(step["name"])
+        if step["name"] == "a":
+            raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        run_dag(independent, run, max_workers=1)
+    sleep(0.2)  # queued steps would have started by now
+    assert started == ["a"]
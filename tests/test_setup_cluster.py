@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from setup_cluster import wlm_configuration, config_parameter_group, wait_for_cluster, provision
+
+
+def test_wlm_configuration():
+    queues = wlm_configuration("etl", 60, 3, 40, 5, True, 10)
+    assert queues[0]["query_group"] == ["etl"] and queues[0]["memory_percent_to_use"] == 60
+    assert queues[1]["query_concurrency"] == 5
+    assert queues[2] == {"short_query_queue": True, "max_execution_time": 10000}
+
+    assert len(wlm_configuration("etl", 60, 3, 40, 5, False)) == 2
+    with pytest.raises(ValueError):
+        wlm_configuration("etl", 70, 3, 40, 5, False)
+
+
+def test_config_parameter_group_default(aws, config):
+    ec2, iam, redshift = aws
+    config.set("WLM", "PARAMETER_GROUP", "")
+    assert config_parameter_group(redshift, config) == ""
+
+
+def test_wait_for_cluster_timeout(aws):
+    ec2, iam, redshift = aws
+    redshift.create_cluster(ClusterIdentifier="dwhcluster", NodeType="dc2.large", MasterUsername="dwhuser",
+                            MasterUserPassword="Passw0rd", ClusterType="single-node")
+    with pytest.raises(TimeoutError):
+        wait_for_cluster(redshift, "dwhcluster", status="paused", timeout=0)
+
+
+def test_provision(aws):
+    ec2, iam, redshift = aws
+    cluster_info, endpoint, role_arn, sg = provision(
+        ec2, iam, redshift,
+        "dwhcluster", "multi-node", "dc2.large", "2",
+        "dwh", "dwhuser", "Passw0rd", "5439", "dwhRole")
+
+    assert cluster_info["ClusterStatus"] == "available"
+    assert endpoint == cluster_info["Endpoint"]["Address"]
+    assert role_arn == iam.get_role(RoleName="dwhRole")["Role"]["Arn"]
+    assert sg is not None
+
+
+def test_provision_with_parameter_group(aws):
+    ec2, iam, redshift = aws
+    redshift.create_cluster_parameter_group(ParameterGroupName="dwhcluster-wlm", ParameterGroupFamily="redshift-1.0",
+                                            Description="test")
+    cluster_info, _, _, _ = provision(
+        ec2, iam, redshift,
+        "dwhcluster", "multi-node", "dc2.large", "2",
+        "dwh", "dwhuser", "Passw0rd", "5439", "dwhRole", "dwhcluster-wlm")
+
+    assert [group["ParameterGroupName"] for group in cluster_info["ClusterParameterGroups"]] == ["dwhcluster-wlm"]
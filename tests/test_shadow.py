@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from shadow import shadow_sql, shadow_steps, swap_shadow_tables
+from sql_queries import insert_table_steps, production_tables, table_version_upsert
+
+
+class SwapCursor:
+    """
+    cursor recording statements, answering the existing tables query with given tables.
+    """
+
+    def __init__(self, existing):
+        self.executed = []
+        self.existing = existing
+        self.rowcount = -1
+        self.connection = self
+        self.server_version = 80002
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+    def fetchall(self):
+        return [(table,) for table in self.existing]
+
+
+def test_shadow_sql_qualified_names_and_aliases():
+    assert shadow_sql("SELECT sp.songplay_id FROM public.songplays AS sp JOIN users u ON (sp.user_id = u.user_id);") \
+        == "SELECT sp.songplay_id FROM public.songplays_shadow AS sp JOIN users_shadow u ON (sp.user_id = u.user_id);"
+    assert shadow_sql("DELETE FROM songs USING staging_songs AS s_s WHERE songs.song_id = s_s.song_id;") \
+        == "DELETE FROM songs_shadow USING staging_songs AS s_s WHERE songs_shadow.song_id = s_s.song_id;"
+
+
+def test_shadow_sql_keeps_other_names():
+    # staging tables & columns containing a production table name
+    query = "SELECT start_time, songplays_count FROM staging_songplays, staging_songs, staging_time_users;"
+    assert shadow_sql(query) == query
+    assert shadow_sql("INSERT INTO song_plays SELECT * FROM time;") == \
+        "INSERT INTO song_plays_shadow SELECT * FROM time_shadow;"
+    assert shadow_sql("songplays_shadow") == "songplays_shadow"
+
+
+def test_shadow_steps():
+    steps = {step["name"]: step for step in shadow_steps(insert_table_steps)}
+
+    assert steps["staging_songplays"]["reads"] == ["staging_events", "staging_songs", "songplays_shadow"]
+    assert steps["staging_songplays"]["writes"] == ["staging_songplays"]
+    assert "FROM staging_songs AS s_s" in steps["staging_songplays"]["query"]
+    assert "LEFT JOIN songplays_shadow AS sp" in steps["staging_songplays"]["query"]
+    assert steps["songplays"]["writes"] == ["songplays_shadow"]
+    assert steps["songplays"]["query"].startswith("\nINSERT INTO songplays_shadow (")
+    assert insert_table_steps[2]["writes"] == ["songplays"]  # not changed in place
+
+
+def test_swap_order():
+    cur = SwapCursor(existing=["songplays", "users"])
+    swap_shadow_tables(cur)
+
+    renames = [query for query, _ in cur.executed if query.startswith("ALTER TABLE")]
+    assert renames[:3] == ["ALTER TABLE songplays RENAME TO songplays_old;",
+                           "ALTER TABLE songplays_shadow RENAME TO songplays;",
+                           "ALTER TABLE users RENAME TO users_old;"]
+    assert renames[3] == "ALTER TABLE users_shadow RENAME TO users;"
+    assert len(renames) == len(production_tables) + 2  # tables not created yet are only renamed into place
+
+    # versions bumped after every rename (same transaction)
+    versions = [params["table_name"] for query, params in cur.executed if query == table_version_upsert]
+    assert versions == production_tables
+    last_rename = max(i for i, (query, _) in enumerate(cur.executed) if query.startswith("ALTER TABLE"))
+    first_bump = min(i for i, (query, _) in enumerate(cur.executed) if query == table_version_upsert)
+    assert last_rename < first_bump